@@ -0,0 +1,173 @@
+"""
+OpenWebRX admission: admit new clients against a CPU budget, instead of a fixed number of them
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+import threading
+import metrics
+
+#How it works:
+#  - the load is measured: every UPDATE_INTERVAL, we read the CPU time used on the whole machine from /proc/stat,
+#    in cores (so it covers the csdr processes, the worker processes and everything else that runs on the receiver),
+#  - the cost of a session is estimated from its demodulator and its digimode, in cores. We start from DEFAULT_COSTS
+#    and SECONDARY_COSTS, and learn the real ones from the clients that run their own DSP: the CPU time of their
+#    process groups is measured, and averaged for each demodulator (and for each digimode, above the demodulator),
+#  - a new client is admitted if the load + the cost of the clients admitted recently (they are not in the measured
+#    load yet) + its own cost fits into the budget. If it does not, it waits in a queue for at most queue_timeout
+#    seconds, and is admitted when the load goes down (and max_clients and the overload governor still let it in),
+#    in the order of arrival. If the queue is full, or the wait is over, it is rejected (and gets retry.html),
+#  - a client that asks for a digimode gets it only if the cost of the digimode fits into the budget.
+
+UPDATE_INTERVAL = 3 #seconds
+LOAD_SMOOTHING = 0.5 #weight of the newest measurement of the load
+COST_SMOOTHING = 0.2 #weight of the newest measurement of the cost of a demodulator
+RESERVATION_TIME = 15 #seconds an admitted client is counted with its estimated cost, until it shows up in the load
+DEFAULT_COSTS = {"nfm": 0.04, "am": 0.03, "ssb": 0.03} #cores, for a client running its own csdr chain
+DEFAULT_COST = 0.04 #for demodulators not in DEFAULT_COSTS
+SECONDARY_COSTS = {"bpsk31": 0.06, "rtty": 0.06} #cores, on top of the demodulator
+SERVER_MODS = {"usb": "ssb", "lsb": "ssb", "cw": "ssb"} #start_mod can be one of these, the client sends "ssb" for them
+
+def busy_cores_seconds():
+    #CPU time used on all the cores since boot, in seconds, from the first line of /proc/stat
+    try:
+        f = open("/proc/stat")
+        fields = f.readline().split()[1:]
+        f.close()
+    except IOError: return None #possibly not on Linux
+    user, nice, system, idle, iowait, irq, softirq = [int(value) for value in fields[:7]]
+    steal = int(fields[7]) if len(fields) > 7 else 0
+    return (user+nice+system+irq+softirq+steal)/float(metrics.clock_ticks)
+
+class admission_controller:
+
+    def __init__(self, budget, queue_length, queue_timeout):
+        self.budget = budget #cores
+        self.queue_length = queue_length
+        self.queue_timeout = queue_timeout
+        self.costs = dict(DEFAULT_COSTS)
+        self.secondary_costs = dict(SECONDARY_COSTS)
+        self.load = None #cores, None until it has been measured twice
+        self.reservations = [] # (time of admission, cost)
+        self.queue = [] #of tickets, waiting to be admitted
+        self.condition = threading.Condition()
+        self.last_busy = self.last_time = None
+        self.session_cpu = {} # client id -> CPU seconds of its process groups at the last update
+        self.admitted = self.queued = self.rejected = self.secondary_refused = 0
+
+    def cost(self, demodulator, secondary=None):
+        demodulator = SERVER_MODS.get(demodulator, demodulator)
+        cost = self.costs.get(demodulator, DEFAULT_COST)
+        if secondary: cost += self.secondary_costs.get(secondary, max(self.secondary_costs.values()))
+        return cost
+
+    def update(self, sessions):
+        #sessions: list of (client id, demodulator, secondary demodulator or None, CPU seconds of its process groups),
+        #for the clients that run their own DSP. Called every UPDATE_INTERVAL.
+        now = time.time()
+        busy = busy_cores_seconds()
+        interval = now-self.last_time if self.last_time else None
+        self.condition.acquire()
+        try:
+            if busy != None and self.last_busy != None and interval > 0:
+                load = (busy-self.last_busy)/interval
+                self.load = load if self.load == None else LOAD_SMOOTHING*load+(1-LOAD_SMOOTHING)*self.load
+            self.last_busy, self.last_time = busy, now
+            session_cpu = {}
+            for client_id, demodulator, secondary, cpu in sessions:
+                session_cpu[client_id] = cpu
+                last_cpu = self.session_cpu.get(client_id)
+                if last_cpu == None or cpu < last_cpu or not interval: continue #new, or its DSP has been restarted
+                self.learn(SERVER_MODS.get(demodulator, demodulator), secondary, (cpu-last_cpu)/interval)
+            self.session_cpu = session_cpu
+            self.reservations = [(admitted, cost) for admitted, cost in self.reservations if now-admitted < RESERVATION_TIME]
+            self.condition.notify_all() #the queue may move on
+        finally:
+            self.condition.release()
+
+    def learn(self, demodulator, secondary, cores):
+        if secondary:
+            table, key, cores = self.secondary_costs, secondary, max(0, cores-self.costs.get(demodulator, DEFAULT_COST))
+        else: table, key = self.costs, demodulator
+        table[key] = COST_SMOOTHING*cores+(1-COST_SMOOTHING)*table.get(key, cores)
+
+    def projected_load(self):
+        return (self.load or 0)+sum(cost for admitted, cost in self.reservations)
+
+    def fits(self, cost):
+        return self.projected_load()+cost <= self.budget
+
+    def admit(self, demodulator, allowed=None):
+        #returns True if a new client with this demodulator can be admitted, waits in the queue if it has to.
+        #allowed() is checked too, whenever the client could be admitted: the limits we do not know about (e.g. the
+        #number of clients) may have been reached while it was waiting.
+        cost = self.cost(demodulator)
+        admissible = lambda: self.fits(cost) and (not allowed or allowed())
+        self.condition.acquire()
+        try:
+            if not self.queue and admissible(): return self.reserve(cost)
+            if len(self.queue) >= self.queue_length or self.queue_timeout <= 0:
+                self.rejected += 1
+                return False
+            ticket = object()
+            self.queue.append(ticket)
+            self.queued += 1
+            deadline = time.time()+self.queue_timeout
+            print "[openwebrx-admission] client queued (%d in the queue), load: %.2f of %.2f cores" % (len(self.queue), self.projected_load(), self.budget)
+            while True:
+                if self.queue[0] is ticket and admissible():
+                    self.queue.pop(0)
+                    self.condition.notify_all() #for the next one in the queue
+                    return self.reserve(cost)
+                remaining = deadline-time.time()
+                if remaining <= 0:
+                    self.queue.remove(ticket)
+                    self.condition.notify_all()
+                    self.rejected += 1
+                    return False
+                self.condition.wait(remaining)
+        finally:
+            self.condition.release()
+
+    def reserve(self, cost):
+        self.reservations.append((time.time(), cost))
+        self.admitted += 1
+        return True
+
+    def allow_secondary(self, demodulator, secondary):
+        #returns True if a client can start decoding this digimode
+        self.condition.acquire()
+        try:
+            if self.fits(self.cost(demodulator, secondary)-self.cost(demodulator)): return True
+            self.secondary_refused += 1
+            return False
+        finally:
+            self.condition.release()
+
+    def add_metrics(self, m):
+        m.add("openwebrx_admission_budget_cores", "gauge", "CPU budget of the admission control.", self.budget)
+        m.add("openwebrx_admission_load_cores", "gauge", "CPU load measured on the machine, with the clients admitted in the last seconds.", self.projected_load())
+        m.add("openwebrx_admission_queue_length", "gauge", "Clients waiting to be admitted.", len(self.queue))
+        for decision, count in (("admitted", self.admitted), ("queued", self.queued), ("rejected", self.rejected), ("secondary_refused", self.secondary_refused)):
+            m.add("openwebrx_admission_decisions_total", "counter", "Decisions of the admission control (queued clients are counted again when admitted or rejected).", count, decision=decision)
+        for demodulator, cost in self.costs.items():
+            m.add("openwebrx_admission_cost_cores", "gauge", "Estimated CPU cost of a client, by demodulator and digimode.", cost, demodulator=demodulator)
+        for secondary, cost in self.secondary_costs.items():
+            m.add("openwebrx_admission_cost_cores", "gauge", "Estimated CPU cost of a client, by demodulator and digimode.", cost, secondary=secondary)
@@ -0,0 +1,163 @@
+"""
+OpenWebRX affinity: place the csdr process groups on CPU cores, and give them priorities by what they do
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import threading
+import ctypes
+import ctypes.util
+import multiprocessing
+
+#How it works:
+#  - the cores are split in two sets: iq_cores for the SDR reader and the I/Q distribution (start_rtl_command with
+#    nmux or the shared memory ring buffer, and the converter of the channelizer), and chain_cores for everything else,
+#  - each DSP chain (an owner: a csdr.dsp, a channel of the channelizer...) gets one core of chain_cores, the one with
+#    the fewest chains on it, until it is released. Every process group of the owner (front end, back end, secondary
+#    chains) is placed on that core, so the stages of a chain pass the samples to each other through its caches,
+#  - the priority is set by the kind of the process group: "audio" (the chains of the clients), "fft" (the spectrum),
+#    "digimode" (secondary chains, shared decoders, the skimmer) and "iq", with the nice values in NICE,
+#  - both are set in preexec_fn, in the child before it runs the shell, so every process of the pipeline inherits
+#    them. The back ends that come from the chain pool are running already, they are placed afterwards (place_group),
+#  - Python 2 has no os.sched_setaffinity(), so we call sched_setaffinity() and setpriority() of libc with ctypes.
+#Lowering the nice value below 0 needs CAP_SYS_NICE: if it is not allowed, the process keeps the nice value of
+#OpenWebRX, so the default NICE only makes the FFT and digimode chains nicer than the audio.
+#In the "workers" server_mode, each worker process places the chains of its own clients, it does not know about the
+#chains of the other workers.
+
+KINDS = ("audio", "fft", "digimode", "iq")
+NICE = {"audio": 0, "fft": 5, "digimode": 10, "iq": 0}
+PRIO_PROCESS = 0
+PRIO_PGRP = 1
+CPU_SETSIZE = 1024
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    libc.sched_setaffinity, libc.setpriority
+except (OSError, AttributeError):
+    libc = None #not on Linux
+
+class cpu_set_t(ctypes.Structure):
+    _fields_ = [("bits", ctypes.c_ulong * (CPU_SETSIZE / (8 * ctypes.sizeof(ctypes.c_ulong))))]
+
+def set_affinity(pid, cores):
+    #pid 0 is the calling process. Returns False if it has failed.
+    if not libc: return False
+    mask = cpu_set_t()
+    bits_per_word = 8 * ctypes.sizeof(ctypes.c_ulong)
+    for core in cores: mask.bits[core / bits_per_word] |= 1 << (core % bits_per_word)
+    return libc.sched_setaffinity(pid, ctypes.sizeof(mask), ctypes.byref(mask)) == 0
+
+def set_priority(which, who, nice):
+    if not libc: return False
+    return libc.setpriority(which, who, nice) == 0
+
+def process_group_pids(pgid):
+    #from /proc/<pid>/stat, like metrics.process_group_cpu()
+    pids = []
+    try: entries = [pid for pid in os.listdir("/proc") if pid.isdigit()]
+    except OSError: return pids
+    for pid in entries:
+        try:
+            f = open("/proc/%s/stat" % pid)
+            stat = f.read()
+            f.close()
+        except IOError: continue #it has exited meanwhile
+        if int(stat[stat.rfind(")")+2:].split(" ")[2]) == pgid: pids.append(int(pid))
+    return pids
+
+def format_cores(cores):
+    return ",".join(str(core) for core in cores)
+
+class scheduler:
+
+    def __init__(self, iq_cores, chain_cores=None, nice=None):
+        core_count = multiprocessing.cpu_count()
+        self.iq_cores = [core for core in iq_cores if core < core_count] or [0]
+        self.chain_cores = [core for core in (chain_cores or []) if core < core_count] or \
+            [core for core in xrange(core_count) if core not in self.iq_cores] or range(core_count)
+        self.nice = dict(NICE)
+        self.nice.update(nice or {})
+        self.lock = threading.Lock()
+        self.owner_cores = {} # owner -> core
+        self.chain_count = dict((core, 0) for core in self.chain_cores)
+        self.groups = {} # pgid -> (owner, label, kind, cores, nice)
+        print "[openwebrx-affinity] I/Q cores: %s, chain cores: %s, libc: %s" % (format_cores(self.iq_cores), format_cores(self.chain_cores), "found" if libc else "not found")
+
+    def cores_of(self, owner, kind):
+        #the core set of the process groups of this owner
+        if kind == "iq" and owner == None: return self.iq_cores
+        self.lock.acquire()
+        try:
+            core = self.owner_cores.get(owner)
+            if core == None:
+                core = min(self.chain_cores, key = lambda core: self.chain_count[core])
+                self.owner_cores[owner] = core
+                self.chain_count[core] += 1
+            return [core]
+        finally:
+            self.lock.release()
+
+    def preexec(self, owner, kind, new_group=True):
+        #returns a preexec_fn for subprocess.Popen: a new process group, placed on the cores of the owner.
+        #owner is None for the I/Q distribution, which goes on the I/Q cores.
+        cores = self.cores_of(owner, kind)
+        nice = self.nice.get(kind, 0)
+        def preexec_function():
+            if new_group: os.setpgrp()
+            try:
+                set_affinity(0, cores)
+                set_priority(PRIO_PROCESS, 0, nice)
+            except: pass #an exception here would make Popen fail
+        return preexec_function
+
+    def placed(self, owner, label, kind, pgid):
+        #records a process group started with preexec(), for the status (pgid is the pid if it has no group of its own)
+        self.lock.acquire()
+        self.groups[pgid] = (owner, label, kind, [self.owner_cores[owner]] if owner in self.owner_cores else self.iq_cores, self.nice.get(kind, 0))
+        self.lock.release()
+
+    def place_group(self, owner, label, kind, pgid):
+        #for a process group that is running already, e.g. from the chain pool
+        cores = self.cores_of(owner, kind)
+        for pid in process_group_pids(pgid): set_affinity(pid, cores)
+        set_priority(PRIO_PGRP, pgid, self.nice.get(kind, 0))
+        self.placed(owner, label, kind, pgid)
+
+    def forget(self, pgid):
+        #the process group has been stopped, or given back to the chain pool
+        self.lock.acquire()
+        self.groups.pop(pgid, None)
+        self.lock.release()
+
+    def release(self, owner):
+        #the owner has stopped all of its process groups, its core can be given to others
+        self.lock.acquire()
+        core = self.owner_cores.pop(owner, None)
+        if core != None: self.chain_count[core] -= 1
+        for pgid in [pgid for pgid, group in self.groups.items() if group[0] == owner]: del self.groups[pgid]
+        self.lock.release()
+
+    def placements(self):
+        #returns a list of (pgid, label, kind, cores, nice) of the process groups that are running
+        self.lock.acquire()
+        groups = self.groups.items()
+        self.lock.release()
+        return sorted((pgid, label, kind, cores, nice) for pgid, (owner, label, kind, cores, nice) in groups if os.path.exists("/proc/%d" % pgid))
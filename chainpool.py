@@ -0,0 +1,101 @@
+"""
+OpenWebRX chainpool: csdr pipelines started in advance, so that a client does not have to wait for them
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import subprocess
+import threading
+import os
+import signal
+
+#How it works:
+#  - a pipeline reading its stdin costs no CPU until it gets data, so we can keep a few of them ready for each
+#    command that has been used (or announced with warm()), and hand them out immediately on get(),
+#  - the fork of the replacement happens in a background thread, not while the client is waiting,
+#  - a pipeline that has been used is not given out again (it may still have samples of the previous client in its
+#    buffers), it is killed by release(), and it has been replaced in the pool already.
+#Only the back ends of the csdr chains are pooled (see csdr.dsp.back_end_chain()): the front end, with its control
+#pipes, is started and stopped with the session of the client, and a mode switch keeps it running.
+
+def kill_process_group(process):
+    try: os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+    except OSError: pass #it has exited already
+
+class chain_pool:
+
+    def __init__(self, idle_count=1):
+        self.idle_count = idle_count #idle pipelines kept ready for each command
+        self.idle = {} # command -> list of Popen objects
+        self.starting = {} # command -> pipelines being started by refill(), counted so that parallel refills do not overshoot
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def popen(self, command, env):
+        return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, shell=True, preexec_fn=os.setpgrp, env=env)
+
+    def get(self, command, env=None):
+        process = None
+        self.lock.acquire()
+        processes = self.idle.setdefault(command, [])
+        while processes and not process:
+            process = processes.pop(0)
+            if process.poll() != None: process = None #it has exited meanwhile
+        self.lock.release()
+        if not process:
+            print "[openwebrx-chainpool] no idle pipeline for:", command
+            process = self.popen(command, env)
+        self.warm([command], env)
+        return process
+
+    def warm(self, commands, env=None):
+        #start idle pipelines for these commands in the background, if there are not enough of them
+        if self.idle_count <= 0: return
+        thread = threading.Thread(target = self.refill, args = (commands, env))
+        thread.daemon = True
+        thread.start()
+
+    def refill(self, commands, env):
+        for command in commands:
+            while True:
+                self.lock.acquire()
+                processes = self.idle.setdefault(command, [])
+                missing = not self.stopped and len(processes)+self.starting.get(command, 0) < self.idle_count
+                if missing: self.starting[command] = self.starting.get(command, 0)+1
+                self.lock.release()
+                if not missing: break
+                process = self.popen(command, env)
+                self.lock.acquire()
+                self.starting[command] -= 1
+                stopped = self.stopped
+                if not stopped: self.idle.setdefault(command, []).append(process)
+                self.lock.release()
+                if stopped: kill_process_group(process)
+
+    def release(self, process):
+        kill_process_group(process)
+
+    def stop(self):
+        self.lock.acquire()
+        self.stopped = True
+        idle = self.idle
+        self.idle = {}
+        self.lock.release()
+        for processes in idle.values():
+            for process in processes: kill_process_group(process)
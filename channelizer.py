@@ -0,0 +1,146 @@
+"""
+OpenWebRX channelizer: split the wideband I/Q stream into sub-bands once, for all clients
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import subprocess
+import os
+import signal
+import socket
+import time
+import shmring
+
+#How it works:
+#  - the I/Q stream coming from the receiver is converted to complex float once, and served on converter_port,
+#  - a fixed bank of channel_count overlapping channels is made from it: each one is shifted to its center and
+#    decimated by a common factor, then served on its own port (base_port+1, base_port+2, ...),
+#  - channel centers are spaced by samp_rate/channel_count, and each channel is wider than the spacing by
+#    max_passband (the widest passband of a client, about the audio output rate) and the transition bands, so that
+#    any passband of a client is contained in the channel closest to its middle,
+#  - a client DSP chain connects to the channel that contains its passband, so its own shift and decimation run
+#    at channel_rate instead of samp_rate. The more channels, the closer channel_rate gets to max_passband, but each
+#    channel costs a shift and a decimation at samp_rate: with 2.4 MS/s, 8 channels give 480 kS/s (5x less than
+#    samp_rate), 32 channels give 114 kS/s (21x less).
+
+class channelizer:
+
+    def __init__(self):
+        self.samp_rate = 2400000
+        self.channel_count = 8
+        self.nc_port = 4951
+        self.iq_shm_path = None #read the I/Q samples from this ring buffer instead of nmux, see shmring.py
+        self.base_port = 4952
+        self.format_conversion = "csdr convert_u8_f"
+        self.transition_bw_rate = 0.15 # of the channel spacing
+        self.max_passband = 12000 #Hz, the passband of a client is at most the audio output rate wide
+        self.nmux_memory = 10 #in megabytes, for each nmux instance
+        self.processes = []
+        self.scheduler = None #affinity.scheduler to place the process groups on cores with
+        self.running = False
+
+    def channel_spacing(self):
+        return float(self.samp_rate)/self.channel_count
+
+    def decimation(self):
+        #the channel has to be as wide as the spacing plus the widest passband, plus the transition band on both sides
+        spacing=self.channel_spacing()
+        return max(1, int(self.samp_rate/(spacing+self.max_passband+2*spacing*self.transition_bw_rate)))
+
+    def channel_rate(self):
+        return float(self.samp_rate)/self.decimation()
+
+    def channel_center(self, channel):
+        return -self.samp_rate/2.0+(channel+0.5)*self.channel_spacing()
+
+    def channel_port(self, channel):
+        return self.base_port+1+channel
+
+    def usable_bw(self):
+        #a passband is usable in a channel if it is this close to its center
+        return self.channel_rate()/2.0-self.channel_spacing()*self.transition_bw_rate
+
+    def contains(self, channel, low_freq, high_freq):
+        center=self.channel_center(channel)
+        return max(abs(low_freq-center), abs(high_freq-center)) <= self.usable_bw()
+
+    def find_channel(self, low_freq, high_freq):
+        #returns the channel closest to the middle of the passband
+        middle=(low_freq+high_freq)/2.0
+        channel=int((middle+self.samp_rate/2.0)/self.channel_spacing())
+        return min(max(channel,0),self.channel_count-1)
+
+    def nmux_bufsizes(self, bytes_per_sec):
+        nmux_bufcnt = nmux_bufsize = 0
+        while nmux_bufsize < bytes_per_sec/8: nmux_bufsize += 4096
+        while nmux_bufsize * nmux_bufcnt < self.nmux_memory * 1e6: nmux_bufcnt += 1
+        return (nmux_bufsize, nmux_bufcnt)
+
+    def nmux_command(self, port, bytes_per_sec):
+        return "nmux --bufsize %d --bufcnt %d --port %d --address 127.0.0.1" % (self.nmux_bufsizes(bytes_per_sec) + (port,))
+
+    def converter_chain(self):
+        command=shmring.source_command(self.nc_port, self.iq_shm_path)+" | "
+        if self.format_conversion!="": command+=self.format_conversion+" | "
+        return command+self.nmux_command(self.base_port, self.samp_rate*8)
+
+    def channel_chain(self, channel):
+        return "nc -v 127.0.0.1 {converter_port} | csdr shift_addition_cc {shift} | csdr fir_decimate_cc {decimation} {transition_bw} HAMMING | {nmux}".format( \
+            converter_port=self.base_port, \
+            shift=-self.channel_center(channel)/self.samp_rate, \
+            decimation=self.decimation(), \
+            transition_bw=self.transition_bw_rate*self.channel_spacing()/self.samp_rate, \
+            nmux=self.nmux_command(self.channel_port(channel), self.channel_rate()*8) )
+
+    def popen(self, command, port, owner, label):
+        #the converter goes on the I/Q cores (owner is None), each channel on a core of its own (see affinity.py)
+        print "[openwebrx-channelizer] Command =", command
+        if self.scheduler:
+            process=subprocess.Popen(command, shell=True, preexec_fn=self.scheduler.preexec(owner, "iq"))
+            self.scheduler.placed(owner, label, "iq", process.pid)
+        else: process=subprocess.Popen(command, shell=True, preexec_fn=os.setpgrp)
+        self.processes.append(process)
+        while True: #wait for nmux to start listening
+            testsock=socket.socket()
+            try: testsock.connect(("127.0.0.1", port))
+            except:
+                time.sleep(0.1)
+                continue
+            testsock.close()
+            break
+
+    def start(self):
+        print "[openwebrx-channelizer] starting %d channels, channel_rate = %g, decimation = %d"%(self.channel_count, self.channel_rate(), self.decimation())
+        self.popen(self.converter_chain(), self.base_port, None, "channelizer")
+        for channel in range(0,self.channel_count):
+            self.popen(self.channel_chain(channel), self.channel_port(channel), ("channelizer", channel), "channel %d" % channel)
+        self.running = True
+
+    def stop(self):
+        for process in self.processes:
+            try: os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+            except Exception as e: print "[openwebrx-channelizer] stop() ::", e
+        if self.scheduler:
+            if self.processes: self.scheduler.forget(self.processes[0].pid) #the converter
+            for channel in range(0,self.channel_count): self.scheduler.release(("channelizer", channel))
+        self.processes = []
+        self.running = False
+
+    def failed(self):
+        return any(process.poll()!=None for process in self.processes)
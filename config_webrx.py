@@ -38,6 +38,23 @@ config_webrx: configuration options for OpenWebRX
 web_port=8073
 server_hostname="localhost" # If this contains an incorrect value, the web UI may freeze on load (it can't open websocket)
 max_clients=20
+cpu_budget=0 #in CPU cores. If not 0, new clients are only admitted while the CPU load (measured, plus the estimated cost of
+             #the new client, which depends on its demodulator) fits into this many cores, and digimodes are only started
+             #for a client if they fit as well. Set it a bit below the number of cores, to leave room for the audio to flow.
+admission_queue_length=5 #With cpu_budget, at most this many new clients wait for CPU to be freed...
+admission_queue_timeout=20 #...for at most this many seconds, before they get the "no client slots left" page.
+overload_governor=True #If the CPU is saturated (or the clients lag behind), step down the waterfall frame rate, then the
+                       #spectrum averaging, then the digimode waterfall, and finally stop admitting new clients, restoring them
+                       #when the load is lower again. The clients are told about it.
+overload_cpu_high=0.9 #CPU usage of the machine (from 0 to 1) above which the governor steps down one more feature...
+overload_cpu_low=0.7 #...and below which it restores them, one by one.
+metrics_enable=True #Counters for monitoring (e.g. with Prometheus) on http://server_hostname:web_port/metrics
+server_mode="threaded" # "threaded": one thread per WebSocket client, polling its DSP and socket in a loop.
+                      # "evented": all WebSocket clients are driven by a single event loop, woken up when data is available.
+                      #            Idle clients cost almost no CPU this way, so it is better for many clients.
+                      # "workers": like "evented", but the clients are spread over ws_workers processes, so that they can use
+                      #            more than one CPU core (Python runs only one thread at a time in a process).
+ws_workers=0 #Number of worker processes in the "workers" server_mode, 0 means one for each CPU core.
 
 # ==== Web GUI configuration ====
 receiver_name="[Callsign]"
@@ -70,6 +87,11 @@ sdrhu_public_listing = False
 fft_fps=9
 fft_size=4096 #Should be power of 2
 fft_voverlap_factor=0.3 #If fft_voverlap_factor is above 0, multiple FFTs will be used for creating a line on the diagram.
+fft_ring_rows=64 #The last fft_ring_rows FFT rows are kept in memory, shared by all clients. A client that lags more than this skips to the newest row.
+fft_pyramid_levels=4 #Each client gets the FFT only in the range it displays, at the resolution of its screen (fft_size, fft_size/2, ... for 4 levels). 1 switches this off.
+                     #With fft_compression="adpcm", these rows are sent with 8 bits per bin.
+fft_delta_codec=True #Clients that support it get the FFT rows with 8 bits per bin, predicted from the previous rows, and only the difference is sent (about 25% smaller than adpcm). Needs fft_pyramid_levels>1 and NumPy.
+fft_latency_budget=0.5 #seconds. If a client cannot receive the FFT rows at fft_fps without this much data queuing up for it (on top of its round-trip time), it gets fewer of them (audio is not affected).
 
 # samp_rate = 250000
 samp_rate = 2400000
@@ -82,15 +104,30 @@ fft_compression="adpcm" #valid values: "adpcm", "none"
 
 digimodes_enable=True #Decoding digimodes come with higher CPU usage. 
 digimodes_fft_size=1024
+digimodes_shared=True #Clients tuned to the same digimode channel share a single decoder, instead of running one each.
+demodulators_shared=True #Clients listening to the same frequency with the same mode, filter and squelch share a single demodulator, instead of running one each.
+
+skimmer_enable=False #Decode every PSK31 signal in the band at once, and list them to the clients (needs NumPy).
+skimmer_max_channels=32 #The skimmer decodes at most this many signals at the same time.
 
 start_rtl_thread=True
 
+# ==== Shared channelizer ====
+# If enabled, the I/Q stream is converted once, and split into overlapping channels that are shared by all clients.
+# The DSP chain of each client connects to the channel it is tuned to, so its cost depends on the channel bandwidth instead of samp_rate.
+# Retuning to a frequency outside the current channel restarts the DSP chain of that client.
+shared_channelizer = False
+channelizer_channels = 8 #The channel spacing will be samp_rate/channelizer_channels. More channels make the client DSP chains cheaper, but each channel costs a shift and a decimation at samp_rate.
+channelizer_max_passband = 12000 #Hz. Each channel is this much wider than the spacing; a wider passband of a client will be cut.
+channelizer_base_port = 4952 #TCP ports from this to channelizer_base_port+channelizer_channels will be used on localhost.
+channelizer_nmux_memory = 10 #in megabytes, for each channel
+
 """
 Note: if you experience audio underruns while CPU usage is 100%, you can: 
 - decrease `samp_rate`,
 - set `fft_voverlap_factor` to 0,
 - decrease `fft_fps` and `fft_size`,
-- limit the number of users by decreasing `max_clients`.
+- limit the number of users by decreasing `max_clients`, or better, by setting `cpu_budget`.
 """
 
 # ==== I/Q sources ====
@@ -140,6 +177,15 @@ To use a HackRF, compile the HackRF host tools from its "stdout" branch:
 # You will have to correctly specify: samp_rate, center_freq, format_conversion in order to correctly play an I/Q file.
 #start_rtl_command="(while true; do cat my_iq_file.raw; done) | csdr flowcontrol {sr} 20 ".format(sr=samp_rate*2*1.05)
 #format_conversion="csdr convert_u8_f"
+# Or let OpenWebRX play it: if iq_replay_file is set, it is used instead of start_rtl_command. If its extension is
+# .u8, .s8, .s16 or .f32 (like the recordings made with iq_record_seconds), format_conversion is set from it.
+#iq_replay_file="my_iq_file.u8"
+iq_replay_speed = 1.0 #1 is real time (samp_rate), 2 is twice as fast, and 0 is as fast as it can be read.
+iq_replay_loop = True
+
+iq_record_seconds = 0 #If set, the last this many seconds of I/Q samples are kept, and saved into iq_record_dir when
+                      #http://localhost:web_port/iq_record is requested (only from the server itself).
+iq_record_dir = "/tmp"
 
 #>> The rx_sdr command works with a variety of SDR harware: RTL-SDR, HackRF, SDRplay, UHD, Airspy, Red Pitaya, audio devices, etc. 
 # It will auto-detect your SDR hardware if the following tools are installed:
@@ -205,8 +251,29 @@ csdr_dynamic_bufsize = False # This allows you to change the buffering mode of c
 csdr_print_bufsizes = False  # This prints the buffer sizes used for csdr processes.
 csdr_through = False # Setting this True will print out how much data is going into the DSP chains.
 
+dsp_plugin = "csdr" # "csdr": the demodulator of each client is a csdr pipeline (this is the default).
+                    # "npdsp": the demodulator runs in a thread of OpenWebRX with NumPy (needs python-numpy).
+                    #   It uses less CPU per client, but digimodes are not supported with it yet.
+csdr_chain_pool_size = 1 # The demodulator part of the csdr chains (everything after the bandpass filter) is started in advance,
+                         # and kept idle until a client needs it, so that switching the mode is fast.
+                         # This many idle chains are kept ready for each mode. 0 disables this.
+
+csdr_scheduling = False # Pin the csdr process groups to CPU cores, and give them priorities by what they do (Linux only):
+                        # the SDR reader and the I/Q distribution run on iq_cores, and each DSP chain is kept on one of
+                        # chain_cores (the one with the fewest chains), so that its processes share the caches of that core.
+iq_cores = [0] # Cores for start_rtl_command, nmux (or the shared memory ring buffer) and the converter of shared_channelizer.
+chain_cores = [] # Cores for the DSP chains. Empty: all the cores that are not in iq_cores.
+csdr_nice = {"audio": 0, "fft": 5, "digimode": 10, "iq": 0} # Nice values of the process groups, by kind: the chains of the clients,
+                        # the spectrum, the digimodes (with the skimmer), and the I/Q distribution. Values below 0 need root.
+
 nmux_memory = 50 #in megabytes. This sets the approximate size of the circular buffer used by nmux.
 
+iq_distribution = "nmux" # How the I/Q samples get from the SDR to the DSP chains:
+                         # "nmux": nmux sends them to each chain over a TCP connection on iq_server_port.
+                         # "shm": they are written into a ring buffer of nmux_memory megabytes in shared memory (iq_shm_path),
+                         #   and each chain reads them from there. This saves the copying through TCP connections.
+iq_shm_path = "/dev/shm/openwebrx-iq"
+
 #Look up external IP address automatically from icanhazip.com, and use it as [server_hostname]
 """
 print "[openwebrx-config] Detecting external IP address..."
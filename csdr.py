@@ -26,6 +26,9 @@ import os
 import code
 import signal
 import fcntl
+import errno
+import threading
+import shmring
 
 class dsp:
 
@@ -53,57 +56,85 @@ class dsp:
         self.csdr_through = False
         self.squelch_level = 0
         self.fft_averages = 50
-        self.iqtee = False
-        self.iqtee2 = False
         self.secondary_demodulator = None
         self.secondary_fft_size = 1024
         self.secondary_process_fft = None
         self.secondary_process_demod = None
-        self.pipe_names=["bpf_pipe", "shift_pipe", "squelch_pipe", "smeter_pipe", "iqtee_pipe", "iqtee2_pipe"]
+        self.secondary_fft_enabled = True #False while the overload governor has stopped it, see governor.py
+        self.pipe_names=["bpf_pipe", "shift_pipe", "squelch_pipe", "smeter_pipe"]
         self.secondary_pipe_names=["secondary_shift_pipe"]
         self.secondary_offset_freq = 1000
-
-    def chain(self,which):
-        any_chain_base="nc -v 127.0.0.1 {nc_port} | "
+        self.private_secondary_demod = True #False if the decoder is shared with other clients, see digimodes.py
+        self.channelizer = None
+        self.channel = None
+        self.backend = None #the demodulator part of the chain, see back_end_chain()
+        self.chain_pool = None #chainpool.chain_pool to get back ends from
+        self.iq_shm_path = None #the I/Q samples are read from this ring buffer instead of nmux if set, see shmring.py
+        self.scheduler = None #affinity.scheduler to place the process groups on cores with
+        self.label = "csdr" #the name of the chain in the placements of the scheduler
+
+    def any_chain_base(self):
+        if self.iq_shm_path and self.channel==None: any_chain_base=shmring.source_command(self.nc_port, self.iq_shm_path)+" | "
+        else: any_chain_base="nc -v 127.0.0.1 {nc_port} | " #the channels of the channelizer come from nmux
         if self.csdr_dynamic_bufsize: any_chain_base+="csdr setbuf {start_bufsize} | "
         if self.csdr_through: any_chain_base+="csdr through | "
-        any_chain_base+=self.format_conversion+(" | " if  self.format_conversion!="" else "") ##"csdr flowcontrol {flowcontrol} auto 1.5 10 | "
+        return any_chain_base+self.format_conversion+(" | " if  self.format_conversion!="" else "") ##"csdr flowcontrol {flowcontrol} auto 1.5 10 | "
+
+    def chain(self,which):
         if which == "fft":
-            fft_chain_base = any_chain_base+"csdr fft_cc {fft_size} {fft_block_size} | " + \
+            fft_chain_base = self.any_chain_base()+"csdr fft_cc {fft_size} {fft_block_size} | " + \
                 ("csdr logpower_cf -70 | " if self.fft_averages == 0 else "csdr logaveragepower_cf -70 {fft_size} {fft_averages} | ") + \
                 "csdr fft_exchange_sides_ff {fft_size}"
             if self.fft_compression=="adpcm":
                 return fft_chain_base+" | csdr compress_fft_adpcm_f_u8 {fft_size}"
             else:
                 return fft_chain_base
-        chain_begin=any_chain_base+"csdr shift_addition_cc --fifo {shift_pipe} | csdr fir_decimate_cc {decimation} {ddc_transition_bw} HAMMING | csdr bandpass_fir_fft_cc --fifo {bpf_pipe} {bpf_transition_bw} HAMMING | csdr squelch_and_smeter_cc --fifo {squelch_pipe} --outfifo {smeter_pipe} 5 1 | "
-        if self.secondary_demodulator:
-            chain_begin+="csdr tee {iqtee_pipe} | "
-            chain_begin+="csdr tee {iqtee2_pipe} | " 
+        return self.front_end_chain()+" | "+self.back_end_chain(which)
+
+    def front_end_chain(self):
+        #the part of the demodulator chain that does not depend on the demodulator: its output is the IF signal
+        return self.any_chain_base()+"csdr shift_addition_cc --fifo {shift_pipe} | csdr fir_decimate_cc {decimation} {ddc_transition_bw} HAMMING | csdr bandpass_fir_fft_cc --fifo {bpf_pipe} {bpf_transition_bw} HAMMING | csdr squelch_and_smeter_cc --fifo {squelch_pipe} --outfifo {smeter_pipe} 5 1"
+
+    def back_end_chain(self,which):
+        #reads the IF signal on its stdin: it has no control pipes, so an idle one can be started in advance
         chain_end = ""
         if self.audio_compression=="adpcm":
             chain_end = " | csdr encode_ima_adpcm_i16_u8"
-        if which == "nfm": return chain_begin + "csdr fmdemod_quadri_cf | csdr limit_ff | csdr old_fractional_decimator_ff {last_decimation} | csdr deemphasis_nfm_ff 11025 | csdr fastagc_ff 1024 | csdr convert_f_s16"+chain_end
-        elif which == "am": return chain_begin + "csdr amdemod_cf | csdr fastdcblock_ff | csdr old_fractional_decimator_ff {last_decimation} | csdr agc_ff | csdr limit_ff | csdr convert_f_s16"+chain_end
-        elif which == "ssb": return chain_begin + "csdr realpart_cf | csdr old_fractional_decimator_ff {last_decimation} | csdr agc_ff | csdr limit_ff | csdr convert_f_s16"+chain_end
+        if which == "nfm": return "csdr fmdemod_quadri_cf | csdr limit_ff | csdr old_fractional_decimator_ff {last_decimation} | csdr deemphasis_nfm_ff 11025 | csdr fastagc_ff 1024 | csdr convert_f_s16"+chain_end
+        elif which == "am": return "csdr amdemod_cf | csdr fastdcblock_ff | csdr old_fractional_decimator_ff {last_decimation} | csdr agc_ff | csdr limit_ff | csdr convert_f_s16"+chain_end
+        elif which == "ssb": return "csdr realpart_cf | csdr old_fractional_decimator_ff {last_decimation} | csdr agc_ff | csdr limit_ff | csdr convert_f_s16"+chain_end
 
     def secondary_chain(self, which):
-        secondary_chain_base="cat {input_pipe} | "
+        secondary_chain_base="" #the IF signal comes on stdin, from relay_function()
         if which == "fft":
             return secondary_chain_base+"csdr realpart_cf | csdr fft_fc {secondary_fft_input_size} {secondary_fft_block_size} | csdr logpower_cf -70 " + (" | csdr compress_fft_adpcm_f_u8 {secondary_fft_size}" if self.fft_compression=="adpcm" else "")
-        elif which == "bpsk31":
-            return secondary_chain_base + "csdr shift_addition_cc --fifo {secondary_shift_pipe} | " + \
-                    "csdr bandpass_fir_fft_cc $(csdr '=-(31.25)/{if_samp_rate}') $(csdr '=(31.25)/{if_samp_rate}') $(csdr '=31.25/{if_samp_rate}') | " + \
+        else: return secondary_chain_base + "csdr shift_addition_cc --fifo {secondary_shift_pipe} | " + self.digimode_chain(which)
+
+    def digimode_chain(self, which):
+        #decodes the signal at the center of its input, sampled at {if_samp_rate}
+        if which == "bpsk31":
+            return "csdr bandpass_fir_fft_cc $(csdr '=-(31.25)/{if_samp_rate}') $(csdr '=(31.25)/{if_samp_rate}') $(csdr '=31.25/{if_samp_rate}') | " + \
                     "csdr simple_agc_cc 0.001 0.5 | " + \
                     "csdr timing_recovery_cc GARDNER {secondary_samples_per_bits} 0.5 2 --add_q | " + \
                     "CSDR_FIXED_BUFSIZE=1 csdr dbpsk_decoder_c_u8 | " + \
                     "CSDR_FIXED_BUFSIZE=1 csdr psk31_varicode_decoder_u8_u8"
 
+    def shared_decoder_command(self):
+        #a chain of its own that decodes the secondary_demodulator at offset_freq, see digimodes.py
+        self.select_channel()
+        command=self.any_chain_base()+"csdr shift_addition_cc {shift_rate} | csdr fir_decimate_cc {decimation} {ddc_transition_bw} HAMMING | "+self.digimode_chain(self.secondary_demodulator)
+        return command.format(nc_port=self.nc_port, start_bufsize=self.base_bufsize*self.decimation, shift_rate=self.shift_rate(), \
+            decimation=self.decimation, ddc_transition_bw=self.ddc_transition_bw(), if_samp_rate=self.if_samp_rate(), \
+            secondary_samples_per_bits=self.secondary_samples_per_bits())
+
     def set_secondary_demodulator(self, what):
+        #the primary demodulator keeps running while the secondary one is replaced
+        if self.secondary_processes_running: self.stop_secondary_demodulator()
         self.secondary_demodulator = what
+        if self.running and self.demodulator != "fft": self.start_secondary_demodulator()
 
     def secondary_fft_block_size(self):
-        return (self.samp_rate/self.decimation)/(self.fft_fps*2) #*2 is there because we do FFT on real signal here
+        return int(self.if_samp_rate()/(self.fft_fps*2)) #*2 is there because we do FFT on real signal here
 
     def secondary_decimation(self):
         return 1 #currently unused
@@ -130,18 +161,16 @@ class dsp:
     def start_secondary_demodulator(self):
         if(not self.secondary_demodulator): return
         print "[openwebrx] starting secondary demodulator from IF input sampled at %d"%self.if_samp_rate()
-        secondary_command_fft=self.secondary_chain("fft")
-        secondary_command_demod=self.secondary_chain(self.secondary_demodulator)
+        secondary_command_fft=self.secondary_chain("fft") if self.secondary_fft_enabled else ""
+        secondary_command_demod=self.secondary_chain(self.secondary_demodulator) if self.private_secondary_demod else ""
         self.try_create_pipes(self.secondary_pipe_names, secondary_command_demod + secondary_command_fft)
 
         secondary_command_fft=secondary_command_fft.format( \
-            input_pipe=self.iqtee_pipe, \
             secondary_fft_input_size=self.secondary_fft_size, \
             secondary_fft_size=self.secondary_fft_size, \
             secondary_fft_block_size=self.secondary_fft_block_size(), \
             )
         secondary_command_demod=secondary_command_demod.format( \
-            input_pipe=self.iqtee2_pipe, \
             secondary_shift_pipe=self.secondary_shift_pipe, \
             secondary_decimation=self.secondary_decimation(), \
             secondary_samples_per_bits=self.secondary_samples_per_bits(), \
@@ -153,13 +182,15 @@ class dsp:
         print "[openwebrx-dsp-plugin:csdr] secondary command (fft) =", secondary_command_fft
         print "[openwebrx-dsp-plugin:csdr] secondary command (demod) =", secondary_command_demod
         #code.interact(local=locals())
-        my_env=os.environ.copy()
-        #if self.csdr_dynamic_bufsize: my_env["CSDR_DYNAMIC_BUFSIZE_ON"]="1";
-        if self.csdr_print_bufsizes: my_env["CSDR_PRINT_BUFSIZES"]="1";
-        self.secondary_process_fft = subprocess.Popen(secondary_command_fft, stdout=subprocess.PIPE, shell=True, preexec_fn=os.setpgrp, env=my_env)
-        print "[openwebrx-dsp-plugin:csdr] Popen on secondary command (fft)"
-        self.secondary_process_demod = subprocess.Popen(secondary_command_demod, stdout=subprocess.PIPE, shell=True, preexec_fn=os.setpgrp, env=my_env) #TODO digimodes
-        print "[openwebrx-dsp-plugin:csdr] Popen on secondary command (demod)" #TODO digimodes
+        my_env=self.process_env(False)
+        self.secondary_process_fft = None
+        if self.secondary_fft_enabled:
+            self.secondary_process_fft = self.popen(secondary_command_fft, "digimode", stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=my_env)
+            print "[openwebrx-dsp-plugin:csdr] Popen on secondary command (fft)"
+        self.secondary_process_demod = None
+        if self.private_secondary_demod:
+            self.secondary_process_demod = self.popen(secondary_command_demod, "digimode", stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=my_env) #TODO digimodes
+            print "[openwebrx-dsp-plugin:csdr] Popen on secondary command (demod)" #TODO digimodes
         self.secondary_processes_running = True
 
         #open control pipes for csdr and send initialization data
@@ -171,28 +202,42 @@ class dsp:
             self.set_secondary_offset_freq(self.secondary_offset_freq) #TODO digimodes
             # print "==========> 4"
 
-        self.set_pipe_nonblocking(self.secondary_process_demod.stdout)
-        self.set_pipe_nonblocking(self.secondary_process_fft.stdout)
+        if self.secondary_process_demod: self.set_pipe_nonblocking(self.secondary_process_demod.stdout)
+        if self.secondary_process_fft: self.set_pipe_nonblocking(self.secondary_process_fft.stdout)
+        for process in (self.secondary_process_fft, self.secondary_process_demod): #the relay drops what they cannot take
+            if process: self.set_pipe_nonblocking(process.stdin)
 
     def set_secondary_offset_freq(self, value):
         self.secondary_offset_freq=value
-        if self.secondary_processes_running:
+        if self.secondary_processes_running and self.secondary_shift_pipe:
             self.secondary_shift_pipe_file.write("%g\n"%(-float(self.secondary_offset_freq)/self.if_samp_rate()))
             self.secondary_shift_pipe_file.flush()
 
     def stop_secondary_demodulator(self):
         if self.secondary_processes_running == False: return
         self.try_delete_pipes(self.secondary_pipe_names)
-        if self.secondary_process_fft: os.killpg(os.getpgid(self.secondary_process_fft.pid), signal.SIGTERM)
-        if self.secondary_process_demod: os.killpg(os.getpgid(self.secondary_process_demod.pid), signal.SIGTERM)
+        for process in (self.secondary_process_fft, self.secondary_process_demod):
+            if not process: continue
+            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+            if self.scheduler: self.scheduler.forget(process.pid)
         self.secondary_processes_running = False
 
     def read_secondary_demod(self, size):
+        if not self.secondary_process_demod: return ""
         return self.secondary_process_demod.stdout.read(size)
 
     def read_secondary_fft(self, size):
+        if not self.secondary_process_fft: return ""
         return self.secondary_process_fft.stdout.read(size)
 
+    def set_secondary_fft_enabled(self, enabled):
+        #the secondary demodulator is restarted, with or without the secondary FFT
+        if self.secondary_fft_enabled == enabled: return
+        self.secondary_fft_enabled = enabled
+        if self.secondary_processes_running:
+            self.stop_secondary_demodulator()
+            self.start_secondary_demodulator()
+
     def get_secondary_demodulator(self):
         return self.secondary_demodulator
 
@@ -236,8 +281,12 @@ class dsp:
         self.set_samp_rate(self.samp_rate) #as it depends on output_rate
 
     def set_demodulator(self,demodulator):
-        #to change this, restart is required
+        #while running, only the back end of the chain is replaced
         self.demodulator=demodulator
+        if self.running and self.backend:
+            old_backend=self.backend
+            self.backend=self.start_backend()
+            self.release_backend(old_backend)
 
     def get_demodulator(self):
         return self.demodulator
@@ -261,16 +310,48 @@ class dsp:
     def set_format_conversion(self,format_conversion):
         self.format_conversion=format_conversion
 
+    def set_channelizer(self,channelizer):
+        #to change this, restart is required
+        self.channelizer=channelizer
+        self.set_format_conversion("") #the channelizer outputs complex float already
+        self.set_samp_rate(channelizer.channel_rate())
+
+    def channel_passband(self):
+        return (self.offset_freq+self.low_cut, self.offset_freq+self.high_cut)
+
+    def select_channel(self):
+        #returns False if the passband is not covered by the current channel and we have to restart
+        if not self.channelizer: return True
+        if self.channel!=None and self.channelizer.contains(self.channel, *self.channel_passband()): return True
+        channel=self.channelizer.find_channel(*self.channel_passband())
+        if not self.channelizer.contains(channel, *self.channel_passband()):
+            print "[openwebrx-dsp-plugin:csdr] passband is wider than a channel of the channelizer, it will be cut"
+        if channel==self.channel: return True
+        self.channel=channel
+        self.nc_port=self.channelizer.channel_port(channel)
+        return False
+
+    def shift_rate(self):
+        if self.channelizer and self.channel!=None:
+            return -float(self.offset_freq-self.channelizer.channel_center(self.channel))/self.samp_rate
+        return -float(self.offset_freq)/self.samp_rate
+
     def set_offset_freq(self,offset_freq):
         self.offset_freq=offset_freq
         if self.running:
-            self.shift_pipe_file.write("%g\n"%(-float(self.offset_freq)/self.samp_rate))
+            if not self.select_channel():
+                self.restart()
+                return
+            self.shift_pipe_file.write("%g\n"%self.shift_rate())
             self.shift_pipe_file.flush()
 
     def set_bpf(self,low_cut,high_cut):
         self.low_cut=low_cut
         self.high_cut=high_cut
         if self.running:
+            if not self.select_channel():
+                self.restart()
+                return
             self.bpf_pipe_file.write( "%g %g\n"%(float(self.low_cut)/self.if_samp_rate(), float(self.high_cut)/self.if_samp_rate()) )
             self.bpf_pipe_file.flush()
 
@@ -320,7 +401,8 @@ class dsp:
         fcntl.fcntl(pipe, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
     def start(self):
-        command_base=self.chain(self.demodulator)
+        self.select_channel()
+        command_base=self.chain("fft") if self.demodulator=="fft" else self.front_end_chain()
 
         #create control pipes for csdr
         self.pipe_base_path="/tmp/openwebrx_pipe_{myid}_".format(myid=id(self))
@@ -352,15 +434,18 @@ class dsp:
             last_decimation=self.last_decimation, fft_size=self.fft_size, fft_block_size=self.fft_block_size(), fft_averages=self.fft_averages, \
             bpf_transition_bw=float(self.bpf_transition_bw)/self.if_samp_rate(), ddc_transition_bw=self.ddc_transition_bw(), \
             flowcontrol=int(self.samp_rate*2), start_bufsize=self.base_bufsize*self.decimation, nc_port=self.nc_port, \
-            squelch_pipe=self.squelch_pipe, smeter_pipe=self.smeter_pipe, iqtee_pipe=self.iqtee_pipe, iqtee2_pipe=self.iqtee2_pipe )
+            squelch_pipe=self.squelch_pipe, smeter_pipe=self.smeter_pipe )
 
         print "[openwebrx-dsp-plugin:csdr] Command =",command
         #code.interact(local=locals())
-        my_env=os.environ.copy()
-        if self.csdr_dynamic_bufsize: my_env["CSDR_DYNAMIC_BUFSIZE_ON"]="1";
-        if self.csdr_print_bufsizes: my_env["CSDR_PRINT_BUFSIZES"]="1";
-        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True, preexec_fn=os.setpgrp, env=my_env)
+        self.process = self.popen(command, "fft" if self.demodulator=="fft" else "audio", stdout=subprocess.PIPE, env=self.process_env())
         self.running = True
+        if self.demodulator != "fft":
+            self.backend=self.start_backend()
+            relay=threading.Thread(target=self.relay_function, args=(self.process,))
+            relay.daemon=True
+            relay.start()
+            if self.chain_pool: self.chain_pool.warm(self.back_end_commands(), self.process_env()) #for the next mode switch
 
         #open control pipes for csdr and send initialization data
         if self.bpf_pipe != None:
@@ -376,13 +461,115 @@ class dsp:
             self.smeter_pipe_file=open(self.smeter_pipe,"r")
             self.set_pipe_nonblocking(self.smeter_pipe_file)
 
-        self.start_secondary_demodulator()
+        if self.demodulator != "fft": self.start_secondary_demodulator()
+
+    def process_env(self, dynamic_bufsize=True):
+        my_env=os.environ.copy()
+        if self.csdr_dynamic_bufsize and dynamic_bufsize: my_env["CSDR_DYNAMIC_BUFSIZE_ON"]="1";
+        if self.csdr_print_bufsizes: my_env["CSDR_PRINT_BUFSIZES"]="1";
+        return my_env
+
+    def back_end_command(self, which):
+        return self.back_end_chain(which).format(last_decimation=self.last_decimation)
+
+    def back_end_commands(self):
+        return [self.back_end_command(which) for which in ("nfm", "am", "ssb")]
+
+    def start_backend(self):
+        command=self.back_end_command(self.demodulator)
+        print "[openwebrx-dsp-plugin:csdr] Back end command =",command
+        if not self.chain_pool: return self.popen(command, "audio", stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=self.process_env())
+        backend = self.chain_pool.get(command, self.process_env())
+        if self.scheduler: self.scheduler.place_group(self, self.label, "audio", backend.pid) #it may have been started for another dsp
+        return backend
+
+    def popen(self, command, kind, **kwargs):
+        #starts a pipeline in a process group of its own, placed on a core by the scheduler if there is one (see affinity.py)
+        if not self.scheduler: return subprocess.Popen(command, shell=True, preexec_fn=os.setpgrp, **kwargs)
+        process = subprocess.Popen(command, shell=True, preexec_fn=self.scheduler.preexec(self, kind), **kwargs)
+        self.scheduler.placed(self, self.label, kind, process.pid)
+        return process
+
+    def release_placement(self):
+        #gives the core of this dsp back to the scheduler, after all of its process groups have been stopped
+        if self.scheduler: self.scheduler.release(self)
+
+    def release_backend(self, backend):
+        if self.scheduler: self.scheduler.forget(backend.pid)
+        if self.chain_pool: self.chain_pool.release(backend)
+        else: os.killpg(os.getpgid(backend.pid), signal.SIGTERM)
+
+    def relay_function(self, front_end):
+        #copies the IF signal from the front end to the back end and the secondary chains, which can be replaced meanwhile.
+        #The back end gets all of it. The secondary chains are written without blocking: if one of them is too slow,
+        #whole chunks are dropped for it (what it has taken of a chunk is completed first, to keep the sample alignment).
+        fd=front_end.stdout.fileno()
+        preamble=""
+        if self.csdr_dynamic_bufsize: #each new back end has to get it first
+            while len(preamble)<8:
+                data=os.read(fd, 8-len(preamble))
+                if not data: return
+                preamble+=data
+        primed=set() #pids of the back ends that have got the preamble
+        pending={} #pid of a secondary chain -> the rest of the chunk it has not taken yet
+        leftover=""
+        while True:
+            try: data=os.read(fd, 65536)
+            except OSError: break
+            if not data or self.process is not front_end: break #the front end has been stopped
+            data=leftover+data
+            usable=len(data)-len(data)%8 #a new consumer must start at a whole complex sample
+            leftover=data[usable:]
+            backend=self.backend
+            if backend:
+                try:
+                    if preamble and backend.pid not in primed:
+                        self.write_all(backend.stdin.fileno(), preamble)
+                        primed.add(backend.pid)
+                    self.write_all(backend.stdin.fileno(), data[:usable])
+                except (OSError, IOError, ValueError): pass #it has been stopped meanwhile
+            secondaries=[process for process in (self.secondary_process_fft, self.secondary_process_demod) if process] if self.secondary_processes_running else []
+            for pid in [pid for pid in pending if pid not in [process.pid for process in secondaries]]: del pending[pid]
+            for consumer in secondaries:
+                chunk=pending.pop(consumer.pid, "")
+                try:
+                    if chunk: chunk=chunk[os.write(consumer.stdin.fileno(), chunk):]
+                    if not chunk: chunk=data[os.write(consumer.stdin.fileno(), data[:usable]):usable]
+                except OSError as e:
+                    if e.errno!=errno.EAGAIN: continue #it has been stopped meanwhile
+                except (IOError, ValueError): continue
+                if chunk: pending[consumer.pid]=chunk
+
+    def write_all(self, fd, data):
+        while data: data=data[os.write(fd, data):]
 
     def read(self,size):
-        return self.process.stdout.read(size)
+        return (self.backend or self.process).stdout.read(size)
+
+    def poll_fds(self):
+        #file descriptors of the outputs that are running, so that the caller can wait on them with poll()
+        fds={}
+        if self.running:
+            fds["audio"]=(self.backend or self.process).stdout.fileno()
+            if self.smeter_pipe: fds["smeter"]=self.smeter_pipe_file.fileno()
+        if self.secondary_processes_running:
+            if self.secondary_process_fft: fds["secondary_fft"]=self.secondary_process_fft.stdout.fileno()
+            if self.secondary_process_demod: fds["secondary_demod"]=self.secondary_process_demod.stdout.fileno()
+        return fds
+
+    def process_groups(self):
+        #ids of the process groups running for this dsp, e.g. to measure their CPU usage
+        pgids=[]
+        if self.running: pgids.append(self.process.pid) #the pipelines are started with os.setpgrp()
+        if self.running and self.backend: pgids.append(self.backend.pid)
+        if self.secondary_processes_running: pgids+=[process.pid for process in (self.secondary_process_fft, self.secondary_process_demod) if process]
+        return pgids
 
     def stop(self):
         os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
+        if self.backend:
+            self.release_backend(self.backend)
+            self.backend = None
         self.stop_secondary_demodulator()
         #if(self.process.poll()!=None):return # returns None while subprocess is running
         #while(self.process.poll()==None):
@@ -393,6 +580,7 @@ class dsp:
         #   time.sleep(0.1)
 
         self.try_delete_pipes(self.pipe_names)
+        self.release_placement()
 
         # if self.bpf_pipe:
             # try: os.unlink(self.bpf_pipe)
@@ -420,5 +608,6 @@ class dsp:
         self.start()
 
     def __del__(self):
+        if not self.running: return #e.g. the dsp of a shared decoder, which only makes its command
         self.stop()
         del(self.process)
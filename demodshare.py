@@ -0,0 +1,247 @@
+"""
+OpenWebRX demodshare: one demodulator for the clients listening to the same channel with the same settings
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import threading
+import audioop
+import time
+import fanout
+
+#How it works:
+#  - a chain is identified by everything that makes its audio: offset_freq, demodulator, low_cut, high_cut,
+#    squelch_level and output_rate (see key_of()). Clients with the same key subscribe to the same chain,
+#  - the chain is a DSP of the dsp_plugin, set up like the one of a client. A thread reads its audio and publishes it
+#    into a ring buffer, and each subscriber reads it at its own pace, just like the spectrum rows,
+#  - when a client changes a setting, it moves to the chain of its new key:
+#     - if there is one, it joins it,
+#     - if it has been alone on its chain, the chain is retuned in place (through the control pipes of csdr, so there
+#       is no restart),
+#     - otherwise it is split off onto a new chain, and the others keep theirs,
+#  - the chains output 16-bit samples, and the ADPCM encoding is done for each client (audio_encoder), so that
+#    the stream of a client stays continuous when it moves to another chain (an IMA ADPCM decoder cannot join an
+#    encoded stream in the middle). audioop does it in C, at about 0.1 ms of CPU per second of audio.
+#The secondary demodulator (digimodes) needs the IF signal of the chain of the client, so a client that uses it
+#runs a chain of its own instead (see ws_session.update_audio_source() in openwebrx.py).
+
+CHUNK_SIZE = 1024 #bytes of audio read at once (a multiple of 4, so that it is always whole ADPCM bytes)
+RING_SIZE = 64 #chunks, about 3 s at 11025 samples/s
+
+def key_of(dsp):
+    low_cut, high_cut = dsp.get_bpf()
+    return (dsp.offset_freq, dsp.get_demodulator(), low_cut, high_cut, dsp.squelch_level, dsp.get_output_rate())
+
+def describe(key):
+    return "%s at %+d Hz (%d..%d Hz)" % (key[1], key[0], key[2], key[3])
+
+class audio_encoder:
+    # IMA ADPCM of the 16-bit samples, with the same output as "csdr encode_ima_adpcm_i16_u8"
+    # (audioop puts the first sample into the high nibble of a byte, csdr into the low one).
+
+    nibble_swap = "".join(chr(((i & 15) << 4) | (i >> 4)) for i in range(256))
+
+    def __init__(self):
+        self.state = None
+        self.leftover = ""
+
+    def encode(self, data):
+        data = self.leftover + data
+        usable = len(data) - len(data) % 4 #two samples make a byte
+        self.leftover = data[usable:]
+        encoded, self.state = audioop.lin2adpcm(data[:usable], 2, self.state)
+        return encoded.translate(self.nibble_swap)
+
+class shared_chain:
+
+    def __init__(self, dsp, key, on_audio):
+        self.dsp = dsp
+        self.key = key
+        self.on_audio = on_audio #called from the reader thread after each chunk
+        self.subscribers = 0
+        self.ring = fanout.ring_buffer(RING_SIZE)
+        self.condition = threading.Condition()
+        self.smeter_level = None
+        self.smeter_count = 0 #number of smeter levels read so far
+        self.stopped = False
+        self.apply(key)
+        print "[openwebrx-demodshare] starting chain:", describe(key)
+        dsp.start()
+        self.reader_thread = threading.Thread(target = self.read_function, args = ())
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+    def apply(self, key):
+        offset_freq, demodulator, low_cut, high_cut, squelch_level, output_rate = key
+        dsp = self.dsp
+        if dsp.get_demodulator() != demodulator: dsp.set_demodulator(demodulator) #while running, only the back end is replaced
+        dsp.set_offset_freq(offset_freq)
+        dsp.set_bpf(low_cut, high_cut)
+        dsp.set_squelch_level(squelch_level)
+
+    def retune(self, key):
+        print "[openwebrx-demodshare] retuning chain from %s to %s" % (describe(self.key), describe(key))
+        if key[5] != self.key[5]: #the output rate can only be changed with a restart
+            self.dsp.stop()
+            self.dsp.set_output_rate(key[5])
+            self.apply(key)
+            self.dsp.start()
+        else: self.apply(key)
+        self.key = key
+
+    def read_function(self):
+        leftover = ""
+        while not self.stopped:
+            try: data = self.dsp.read(CHUNK_SIZE)
+            except (IOError, OSError, ValueError): data = "" #it is being stopped
+            if not data:
+                time.sleep(0.05) #the back end has been replaced, or the chain is restarting
+                continue
+            data = leftover + data
+            usable = len(data) - len(data) % 2 #whole 16-bit samples
+            leftover = data[usable:]
+            self.read_smeter()
+            self.condition.acquire()
+            self.ring.publish(data[:usable])
+            self.condition.notify_all()
+            self.condition.release()
+            if self.on_audio: self.on_audio()
+
+    def read_smeter(self):
+        while True:
+            try: level = self.dsp.get_smeter_level()
+            except: break #nothing new, the pipe is non-blocking
+            if level == None: break
+            self.smeter_level = level
+            self.smeter_count += 1
+
+    def wait(self, reader, timeout):
+        self.condition.acquire()
+        if not reader.lag(): self.condition.wait(timeout)
+        self.condition.release()
+
+    def stop(self):
+        print "[openwebrx-demodshare] stopping chain:", describe(self.key)
+        self.stopped = True
+        try: self.dsp.stop()
+        except OSError: pass #it has exited already
+
+class subscription:
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.key = chain.key
+        self.reader = chain.ring.reader()
+        self.smeter_count = chain.smeter_count
+
+    def read(self):
+        #returns the chunks of audio since the last call
+        return self.reader.read()
+
+    def wait(self, timeout=0.1):
+        #like read(), but waits for the next chunk if there is nothing to read yet
+        self.chain.wait(self.reader, timeout)
+        return self.reader.read()
+
+    def get_smeter_level(self):
+        #returns None if there has not been a new level since the last call
+        chain = self.chain
+        if chain.smeter_count == self.smeter_count: return None
+        self.smeter_count = chain.smeter_count
+        return chain.smeter_level
+
+class demodulator_service:
+
+    def __init__(self, make_dsp, on_audio=None):
+        self.make_dsp = make_dsp #returns a DSP set up like the ones of the clients, with audio_compression="none"
+        self.on_audio = on_audio
+        self.chains = {} # key -> shared_chain
+        self.splits = 0 #clients that have been moved off a chain they shared, onto a new one
+        self.lock = threading.Lock()
+
+    def subscribe(self, key):
+        self.lock.acquire()
+        try:
+            return subscription(self.get_chain(key))
+        finally:
+            self.lock.release()
+
+    def get_chain(self, key):
+        chain = self.chains.get(key)
+        if chain: print "[openwebrx-demodshare] client joins chain: %s (%d clients now)" % (describe(key), chain.subscribers + 1)
+        else:
+            dsp = self.make_dsp()
+            dsp.set_output_rate(key[5])
+            chain = self.chains[key] = shared_chain(dsp, key, self.on_audio)
+        chain.subscribers += 1
+        return chain
+
+    def retune(self, old, key):
+        #returns the subscription for the new key, which can be old itself
+        if old.key == key: return old
+        self.lock.acquire()
+        try:
+            chain = self.chains.get(old.key)
+            if chain and chain.subscribers == 1 and key not in self.chains:
+                del self.chains[old.key]
+                chain.retune(key)
+                self.chains[key] = chain
+                old.key = key
+                return old
+            new = subscription(self.get_chain(key)) #before releasing the old one, so that a chain we keep is not restarted
+            if chain and chain.subscribers > 1: self.splits += 1
+            self.release_chain(old.key)
+            return new
+        finally:
+            self.lock.release()
+
+    def unsubscribe(self, old):
+        self.lock.acquire()
+        try:
+            self.release_chain(old.key)
+        finally:
+            self.lock.release()
+
+    def release_chain(self, key):
+        chain = self.chains.get(key)
+        if not chain: return
+        chain.subscribers -= 1
+        if chain.subscribers <= 0:
+            del self.chains[key]
+            chain.stop()
+
+    def counts(self):
+        #returns (number of chains running, number of subscribers): subscribers-chains is the number of chains saved
+        self.lock.acquire()
+        chains = self.chains.values()
+        self.lock.release()
+        return (len(chains), sum(chain.subscribers for chain in chains))
+
+    def process_groups(self):
+        self.lock.acquire()
+        chains = self.chains.values()
+        self.lock.release()
+        return [pgid for chain in chains for pgid in chain.dsp.process_groups()]
+
+    def stop(self):
+        self.lock.acquire()
+        chains = self.chains.values()
+        self.chains = {}
+        self.lock.release()
+        for chain in chains: chain.stop()
@@ -0,0 +1,147 @@
+"""
+OpenWebRX digimodes: decoders shared by the clients listening to the same digimode channel
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import subprocess
+import threading
+import os
+import signal
+import fanout
+
+#How it works:
+#  - a decoder is identified by the absolute frequency of the channel (rounded to FREQUENCY_STEP) and the mode,
+#  - the first client that subscribes to it starts its csdr chain: it reads the I/Q stream (or a channel of the
+#    shared channelizer) on its own, and does not depend on the DSP chain of any client,
+#  - the decoded characters are published into a ring buffer, and each subscriber reads it at its own pace,
+#    just like the spectrum rows,
+#  - the decoder is stopped when its last subscriber leaves. If it has exited, the next subscribe() restarts it
+#    with the same ring buffer, so the readers of the subscribers that are there already get its output too.
+#The secondary FFT (the small waterfall of the digimode passband) is still made by the chain of each client.
+
+FREQUENCY_STEP = 4 #Hz, clients tuned closer than this share the decoder (PSK31 decoding tolerates a few Hz of error)
+RING_SIZE = 256 #chunks of decoded data
+
+class shared_decoder:
+
+    def __init__(self, dsp, frequency, mode, ring=None):
+        self.frequency = frequency
+        self.mode = mode
+        self.subscribers = 0
+        self.ring = ring or fanout.ring_buffer(RING_SIZE)
+        command = dsp.shared_decoder_command()
+        print "[openwebrx-digimodes] starting %s decoder at %d Hz: %s" % (mode, frequency, command)
+        self.dsp = dsp #it only makes the command, and places the process group (see affinity.py)
+        self.process = dsp.popen(command, "digimode", stdout=subprocess.PIPE, env=dsp.process_env(False))
+        self.reader_thread = threading.Thread(target = self.read_function, args = ())
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+    def read_function(self):
+        fd = self.process.stdout.fileno()
+        while True:
+            try: data = os.read(fd, 256)
+            except OSError: break
+            if not data: break
+            self.ring.publish(data)
+
+    def alive(self):
+        return self.process.poll() == None
+
+    def stop(self):
+        print "[openwebrx-digimodes] stopping %s decoder at %d Hz" % (self.mode, self.frequency)
+        try: os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
+        except OSError: pass #it has exited already
+        self.dsp.release_placement()
+
+class subscription:
+
+    def __init__(self, key, offset_freq, mode, reader):
+        self.key = key
+        self.offset_freq = offset_freq #as asked for by the client, before rounding
+        self.mode = mode
+        self.reader = reader
+
+    def read(self):
+        #returns the chunks of decoded data since the last call
+        return self.reader.read()
+
+class decoder_service:
+
+    def __init__(self, make_dsp, center_freq):
+        self.make_dsp = make_dsp #returns a csdr.dsp set up like the ones of the clients
+        self.center_freq = center_freq
+        self.decoders = {} # (frequency, mode) -> shared_decoder
+        self.lock = threading.Lock()
+
+    def subscribe(self, offset_freq, mode):
+        #offset_freq is relative to center_freq
+        frequency = self.center_freq + int(round(float(offset_freq)/FREQUENCY_STEP))*FREQUENCY_STEP
+        key = (frequency, mode)
+        self.lock.acquire()
+        try:
+            decoder = self.decoders.get(key)
+            if decoder and not decoder.alive():
+                print "[openwebrx-digimodes] %s decoder at %d Hz has exited, restarting it" % (mode, frequency)
+                decoder.stop()
+                decoder.reader_thread.join() #the ring has a single writer, the old one has to finish first
+                subscribers = decoder.subscribers
+                decoder = self.start_decoder(key, decoder.ring)
+                decoder.subscribers = subscribers
+            elif not decoder: decoder = self.start_decoder(key)
+            decoder.subscribers += 1
+            return subscription(key, offset_freq, mode, decoder.ring.reader())
+        finally:
+            self.lock.release()
+
+    def start_decoder(self, key, ring=None):
+        frequency, mode = key
+        dsp = self.make_dsp()
+        dsp.set_secondary_demodulator(mode)
+        dsp.set_offset_freq(frequency - self.center_freq)
+        dsp.set_bpf(-dsp.secondary_bw(), dsp.secondary_bw()) #with a channelizer, this is the passband the channel is chosen for
+        self.decoders[key] = shared_decoder(dsp, frequency, mode, ring)
+        return self.decoders[key]
+
+    def unsubscribe(self, subscription):
+        self.lock.acquire()
+        try:
+            decoder = self.decoders.get(subscription.key)
+            if not decoder: return
+            decoder.subscribers -= 1
+            if decoder.subscribers <= 0:
+                del self.decoders[subscription.key]
+                decoder.stop()
+        finally:
+            self.lock.release()
+
+    def counts(self):
+        #returns (number of decoders running, number of subscribers)
+        self.lock.acquire()
+        decoders = self.decoders.values()
+        self.lock.release()
+        return (len(decoders), sum(decoder.subscribers for decoder in decoders))
+
+    def stop(self):
+        self.lock.acquire()
+        decoders = self.decoders.values()
+        self.decoders = {}
+        self.lock.release()
+        for decoder in decoders: decoder.stop()
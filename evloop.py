@@ -0,0 +1,144 @@
+"""
+evloop: a poll() based event loop to drive many WebSocket clients from one thread
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import select
+import os
+import fcntl
+import errno
+import socket
+import threading
+import traceback
+import sys
+import rxws
+
+POLLIN = select.POLLIN | select.POLLPRI
+POLLOUT = select.POLLOUT
+POLLERR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+def set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+class event_loop:
+
+    def __init__(self):
+        self.poll = select.poll()
+        self.callbacks = {} # fd -> callback(fd, events)
+        self.events = {} # fd -> registered event mask
+        self.pending = [] # callables queued from other threads
+        self.pending_lock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        set_nonblocking(self.wakeup_r)
+        set_nonblocking(self.wakeup_w)
+        self.register(self.wakeup_r, POLLIN, self.on_wakeup)
+
+    def register(self, fd, events, callback):
+        self.callbacks[fd] = callback
+        self.events[fd] = events
+        self.poll.register(fd, events)
+
+    def modify(self, fd, events):
+        if fd not in self.events or self.events[fd] == events: return
+        self.events[fd] = events
+        self.poll.modify(fd, events)
+
+    def unregister(self, fd):
+        if fd not in self.callbacks: return
+        del self.callbacks[fd]
+        del self.events[fd]
+        try: self.poll.unregister(fd)
+        except: pass
+
+    def call_soon_threadsafe(self, callback):
+        #can be called from any thread, callback will run on the thread of the loop
+        self.pending_lock.acquire()
+        self.pending.append(callback)
+        notify = len(self.pending) == 1
+        self.pending_lock.release()
+        if notify:
+            try: os.write(self.wakeup_w, "x")
+            except OSError: pass #pipe is full, the loop will wake up anyway
+
+    def on_wakeup(self, fd, events):
+        try:
+            while os.read(self.wakeup_r, 4096): pass
+        except OSError: pass
+        self.pending_lock.acquire()
+        pending = self.pending
+        self.pending = []
+        self.pending_lock.release()
+        for callback in pending:
+            self.run_callback(callback)
+
+    def run_callback(self, callback, *args):
+        try: callback(*args)
+        except:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            print "[openwebrx-evloop] exception in callback:", exc_type, exc_value
+            traceback.print_tb(exc_traceback)
+
+    def run(self):
+        while True:
+            try: ready = self.poll.poll()
+            except select.error as e:
+                if e[0] == errno.EINTR: continue
+                raise
+            for fd, events in ready:
+                callback = self.callbacks.get(fd)
+                if callback: self.run_callback(callback, fd, events)
+
+    def start(self):
+        thread = threading.Thread(target = self.run, args = ())
+        thread.daemon = True
+        thread.start()
+        return thread
+
+class connection:
+    # Wraps a non-blocking socket, with an rxws.frame_writer as wfile, so that rxws can write to it the same way as to
+    # BaseHTTPRequestHandler.wfile. Whatever the kernel does not accept at once is sent when the socket becomes writable.
+
+    def __init__(self, sock, loop):
+        self.sock = sock
+        self.loop = loop
+        self.fd = sock.fileno()
+        self.wfile = rxws.frame_writer(sock)
+        self.wfile.max_pending_bytes = 4*1024*1024
+        self.read_events = POLLIN
+        sock.setblocking(0)
+
+    def flush(self):
+        if self.wfile.flush(): self.loop.modify(self.fd, self.read_events)
+        else: self.loop.modify(self.fd, self.read_events | POLLOUT)
+
+    def recv(self, size = 65536):
+        #returns "" if nothing is available, raises socket.error if the peer has closed the connection
+        try: data = self.sock.recv(size)
+        except socket.error as e:
+            if e[0] in (errno.EAGAIN, errno.EWOULDBLOCK): return ""
+            raise
+        if not data: raise socket.error(errno.ECONNRESET, "connection closed by peer")
+        return data
+
+    def close(self):
+        self.loop.unregister(self.fd)
+        try: self.sock.close()
+        except: pass
@@ -0,0 +1,73 @@
+"""
+fanout: share a stream of rows (e.g. FFT rows of the waterfall) between many readers
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+class ring_buffer:
+    # The last `size` rows are kept, each reader has its own position in it.
+    # There is a single writer thread, and we need no lock:
+    #  - publish() stores the row first, and only then increments write_index,
+    #  - a reader checks write_index again after reading, to see if the writer has overwritten what it has read.
+    #    The slot of write_index may be being written, so a reader can only be size-1 rows behind.
+
+    def __init__(self, size):
+        self.size = size
+        self.rows = [None] * size
+        self.write_index = 0 #number of rows published so far
+
+    def publish(self, row):
+        self.rows[self.write_index % self.size] = row
+        self.write_index += 1
+
+    def reader(self):
+        return ring_reader(self)
+
+class ring_reader:
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = ring.write_index #we start with the next row
+        self.rows_read = 0
+        self.rows_skipped = 0
+
+    def lag(self):
+        return self.ring.write_index - self.position
+
+    def skip_to_newest(self):
+        #we keep the newest row only
+        write_index = self.ring.write_index
+        if write_index - self.position > 1:
+            self.rows_skipped += write_index - self.position - 1
+            self.position = write_index - 1
+
+    def read(self):
+        #returns the list of rows that have been published since the last call
+        if self.lag() >= self.ring.size: self.skip_to_newest() #the oldest one may be overwritten while we read it
+        write_index = self.ring.write_index
+        rows = [self.ring.rows[i % self.ring.size] for i in xrange(self.position, write_index)]
+        if self.ring.write_index - self.position >= self.ring.size: #we've been lapped while reading
+            self.skip_to_newest()
+            return self.read()
+        self.position = write_index
+        self.rows_read += len(rows)
+        return rows
+
+    def __str__(self):
+        return "lag=%d rows_read=%d rows_skipped=%d" % (self.lag(), self.rows_read, self.rows_skipped)
@@ -0,0 +1,89 @@
+"""
+OpenWebRX governor: step down the expensive features when the receiver is overloaded, and restore them later
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+
+#How it works:
+#  - update() is called with the CPU usage of the machine and the fraction of the clients that lag behind (their
+#    queuing is over fft_latency_budget, see pacer.py), every few seconds,
+#  - while one of them is above its high threshold, the level goes up by one every STEP_UP_HOLD seconds. Once both of
+#    them are below their low thresholds, it goes down by one every STEP_DOWN_HOLD seconds. Between the thresholds it
+#    stays where it is, so it does not flap,
+#  - each level keeps what the previous ones have stepped down, and adds one more:
+#     1: the waterfall of every client is sent at FFT_FPS_FACTOR of fft_fps at most,
+#     2: the spectrum is averaged over FFT_AVERAGES_FACTOR of the FFTs (the csdr chain of the spectrum is restarted),
+#     3: the secondary FFT of the digimodes (the waterfall in the digimode panel) is stopped, the decoding goes on,
+#     4: no new clients are admitted,
+#  - the level is sent to the clients in the broadcast message, and openwebrx.js tells the user when it changes.
+
+LEVEL_NORMAL = 0
+LEVEL_FFT_FPS = 1
+LEVEL_FFT_AVERAGES = 2
+LEVEL_SECONDARY_FFT = 3
+LEVEL_ADMISSION = 4
+
+STEP_UP_HOLD = 6 #seconds
+STEP_DOWN_HOLD = 30 #seconds
+LAG_HIGH = 0.25 #of the clients
+LAG_LOW = 0.05
+FFT_FPS_FACTOR = 0.5
+FFT_AVERAGES_FACTOR = 0.25
+
+def fft_fps(fps, level):
+    #the frame rate a client can get at most
+    return fps*FFT_FPS_FACTOR if level >= LEVEL_FFT_FPS else fps
+
+def fft_averages(averages, level):
+    return max(1, int(averages*FFT_AVERAGES_FACTOR)) if averages and level >= LEVEL_FFT_AVERAGES else averages
+
+def secondary_fft_enabled(level):
+    return level < LEVEL_SECONDARY_FFT
+
+def admits_new_clients(level):
+    return level < LEVEL_ADMISSION
+
+class overload_governor:
+
+    def __init__(self, cpu_high, cpu_low):
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.level = LEVEL_NORMAL
+        self.last_change = 0
+        self.relaxed_since = None
+        self.changes = 0
+
+    def update(self, cpu_usage, lagging):
+        #cpu_usage and lagging are from 0 to 1. Returns the new level if it has changed, None if not.
+        now = time.time()
+        overloaded = cpu_usage >= self.cpu_high or lagging >= LAG_HIGH
+        relaxed = cpu_usage <= self.cpu_low and lagging <= LAG_LOW
+        if not relaxed: self.relaxed_since = None
+        elif self.relaxed_since == None: self.relaxed_since = now
+        if overloaded and self.level < LEVEL_ADMISSION and now-self.last_change >= STEP_UP_HOLD: step = 1
+        elif relaxed and self.level > LEVEL_NORMAL and now-max(self.last_change, self.relaxed_since) >= STEP_DOWN_HOLD: step = -1
+        else: return None
+        self.level += step
+        self.last_change = now
+        self.changes += 1
+        print "[openwebrx-governor] %s: level %d (cpu usage: %d%%, clients lagging: %d%%)" % \
+            ("overloaded" if step > 0 else "load is lower", self.level, cpu_usage*100, lagging*100)
+        return self.level
@@ -0,0 +1,241 @@
+/*
+
+	This file is part of OpenWebRX,
+	an open-source SDR receiver software with a web UI.
+	Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU Affero General Public License as
+	published by the Free Software Foundation, either version 3 of the
+	License, or (at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU Affero General Public License for more details.
+
+	You should have received a copy of the GNU Affero General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+*/
+
+// The audio of openwebrx.js, off the main thread. This file is loaded in one of two ways:
+//  - as an AudioWorklet module (where the browser has AudioWorklet: only on https:// or localhost). The AUD frames
+//    are transferred to the audio rendering thread, which decodes them into a ring buffer and plays from it, so the
+//    waterfall cannot cause dropouts,
+//  - as a Web Worker otherwise. It decodes and resamples, and sends back audio_buffer_size long Float32Arrays for
+//    the ScriptProcessorNode in openwebrx.js, which only has to copy them.
+// In both, the ADPCM decoder, the gain and the resampler are the ones below, instead of sdr.js on the main thread.
+
+var ima_adpcm_index_table = [ -1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8 ];
+var ima_adpcm_step_table = [
+	7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66, 73, 80, 88, 97, 107, 118,
+	130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963, 1060,
+	1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484,
+	7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767
+];
+
+var audio_resampler_taps_per_phase = 24; //the length of the interpolation filter, per output sample
+
+function audio_decoder(interpolation)
+{
+	// decodes the payload of AUD frames into Float32Arrays at interpolation times the rate of the server
+	this.interpolation = interpolation;
+	this.gain = 1.0;
+	this.adpcm_index = 0; //the ADPCM stream is continuous, like with sdrjs.ImaAdpcm
+	this.adpcm_predictor = 0;
+	// windowed sinc lowpass at the Nyquist frequency of the server rate, split into the phases of the interpolator
+	var length = interpolation * audio_resampler_taps_per_phase;
+	var taps = new Float32Array(length);
+	var sum = 0;
+	for(var i = 0; i < length; i++)
+	{
+		var t = (i - (length - 1) / 2) / interpolation;
+		var window = 0.42 - 0.5 * Math.cos(2 * Math.PI * i / (length - 1)) + 0.08 * Math.cos(4 * Math.PI * i / (length - 1)); //Blackman
+		taps[i] = (t == 0 ? 1 : Math.sin(Math.PI * t) / (Math.PI * t)) * window;
+		sum += taps[i];
+	}
+	this.phases = [];
+	for(var p = 0; p < interpolation; p++)
+	{
+		var phase = new Float32Array(audio_resampler_taps_per_phase);
+		for(var k = 0; k < audio_resampler_taps_per_phase; k++) phase[k] = taps[p + k * interpolation] * interpolation / sum;
+		this.phases.push(phase);
+	}
+	this.history = new Float32Array(audio_resampler_taps_per_phase * 2); //the last input samples, twice, so that no wrapping is needed
+	this.history_position = 0;
+}
+
+audio_decoder.prototype.decode = function(data, compression)
+{
+	// data is an ArrayBuffer without the "AUD " header, returns the samples at the server rate, with the gain applied
+	var output, scale = this.gain / 32768;
+	if(compression == "adpcm")
+	{
+		var bytes = new Uint8Array(data);
+		output = new Float32Array(bytes.length * 2);
+		var index = this.adpcm_index, predictor = this.adpcm_predictor;
+		for(var i = 0; i < output.length; i++)
+		{
+			var nibble = (i & 1) ? bytes[i >> 1] >> 4 : bytes[i >> 1] & 15;
+			var step = ima_adpcm_step_table[index];
+			var delta = step >> 3;
+			if(nibble & 4) delta += step;
+			if(nibble & 2) delta += step >> 1;
+			if(nibble & 1) delta += step >> 2;
+			predictor += (nibble & 8) ? -delta : delta;
+			if(predictor > 32767) predictor = 32767;
+			else if(predictor < -32768) predictor = -32768;
+			index += ima_adpcm_index_table[nibble];
+			if(index < 0) index = 0;
+			else if(index > 88) index = 88;
+			output[i] = predictor * scale;
+		}
+		this.adpcm_index = index;
+		this.adpcm_predictor = predictor;
+	}
+	else
+	{
+		var samples = new Int16Array(data, 0, data.byteLength >> 1);
+		output = new Float32Array(samples.length);
+		for(var i = 0; i < samples.length; i++) output[i] = samples[i] * scale;
+	}
+	return output;
+};
+
+audio_decoder.prototype.resample = function(input)
+{
+	var l = this.interpolation, n = audio_resampler_taps_per_phase;
+	if(l == 1) return input;
+	var output = new Float32Array(input.length * l);
+	var history = this.history, position = this.history_position;
+	for(var i = 0; i < input.length; i++)
+	{
+		position = (position + 1) % n;
+		history[position] = history[position + n] = input[i];
+		// history[position+n-k] is the input k samples ago
+		for(var p = 0; p < l; p++)
+		{
+			var phase = this.phases[p], acc = 0;
+			for(var k = 0; k < n; k++) acc += phase[k] * history[position + n - k];
+			output[i * l + p] = acc;
+		}
+	}
+	this.history_position = position;
+	return output;
+};
+
+audio_decoder.prototype.process = function(data, compression)
+{
+	return this.resample(this.decode(data, compression));
+};
+
+if(typeof registerProcessor == "function")
+{
+	class openwebrx_audio_processor extends AudioWorkletProcessor
+	{
+		// options.processorOptions: interpolation, compression, start_samples (we start playing when we have this
+		// many), max_samples and decrease_to_samples (if we have more than max_samples, we drop the oldest ones)
+		constructor(options)
+		{
+			super();
+			var o = options.processorOptions;
+			this.decoder = new audio_decoder(o.interpolation);
+			this.compression = o.compression;
+			this.start_samples = o.start_samples;
+			this.max_samples = o.max_samples;
+			this.decrease_to_samples = o.decrease_to_samples;
+			// the ring buffer: only written by onmessage and read by process(), both on the audio rendering
+			// thread, so the two positions are all the synchronization it needs
+			this.ring = new Float32Array(o.max_samples * 2);
+			this.write_position = 0; //samples written so far
+			this.read_position = 0;
+			this.playing = false;
+			this.underruns = 0;
+			this.overruns = 0;
+			this.frames_since_status = 0;
+			this.port.onmessage = this.on_message.bind(this);
+		}
+
+		on_message(event)
+		{
+			var message = event.data;
+			if(message.audio) this.push(this.decoder.process(message.audio, this.compression));
+			if(message.gain !== undefined) this.decoder.gain = message.gain;
+			if(message.compression) this.compression = message.compression;
+		}
+
+		push(samples)
+		{
+			var ring = this.ring, size = ring.length;
+			for(var i = 0; i < samples.length; i++) ring[(this.write_position + i) % size] = samples[i];
+			this.write_position += samples.length;
+			if(this.write_position - this.read_position > this.max_samples)
+			{
+				this.read_position = this.write_position - this.decrease_to_samples; //we have fallen behind, we drop what is oldest
+				this.overruns++;
+			}
+			if(!this.playing && this.write_position - this.read_position >= this.start_samples) this.playing = true;
+		}
+
+		process(inputs, outputs)
+		{
+			var output = outputs[0][0], ring = this.ring, size = ring.length;
+			var available = this.write_position - this.read_position;
+			if(this.playing)
+			{
+				var count = Math.min(available, output.length);
+				for(var i = 0; i < count; i++) output[i] = ring[(this.read_position + i) % size];
+				this.read_position += count;
+				if(count < output.length)
+				{
+					this.playing = false; //the rest of output is silence, we wait until start_samples are buffered again
+					this.underruns++;
+				}
+			}
+			this.frames_since_status += output.length;
+			if(this.frames_since_status >= sampleRate / 4)
+			{
+				this.frames_since_status = 0;
+				this.port.postMessage({ buffered: (this.write_position - this.read_position) / sampleRate, underruns: this.underruns, overruns: this.overruns, playing: this.playing });
+			}
+			return true;
+		}
+	}
+	registerProcessor("openwebrx-audio-processor", openwebrx_audio_processor);
+}
+else if(typeof importScripts == "function")
+{
+	// in a Web Worker
+	var worker_decoder, worker_compression, worker_chunk_size, worker_chunk, worker_chunk_fill = 0;
+	onmessage = function(event)
+	{
+		var message = event.data;
+		if(message.interpolation)
+		{
+			worker_decoder = new audio_decoder(message.interpolation);
+			worker_compression = message.compression;
+			worker_chunk_size = message.chunk_size;
+			worker_chunk = new Float32Array(worker_chunk_size);
+		}
+		if(message.gain !== undefined) worker_decoder.gain = message.gain;
+		if(message.compression) worker_compression = message.compression;
+		if(!message.audio) return;
+		// the ScriptProcessorNode takes audio_buffer_size samples at a time
+		var samples = worker_decoder.process(message.audio, worker_compression), chunks = [];
+		for(var i = 0; i < samples.length; )
+		{
+			var count = Math.min(samples.length - i, worker_chunk_size - worker_chunk_fill);
+			worker_chunk.set(samples.subarray(i, i + count), worker_chunk_fill);
+			worker_chunk_fill += count;
+			i += count;
+			if(worker_chunk_fill == worker_chunk_size)
+			{
+				chunks.push(worker_chunk);
+				worker_chunk = new Float32Array(worker_chunk_size);
+				worker_chunk_fill = 0;
+			}
+		}
+		if(chunks.length) postMessage({ chunks: chunks }, chunks.map(function(chunk) { return chunk.buffer; }));
+	};
+}
@@ -0,0 +1,155 @@
+/*
+
+	This file is part of OpenWebRX,
+	an open-source SDR receiver software with a web UI.
+	Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU Affero General Public License as
+	published by the Free Software Foundation, either version 3 of the
+	License, or (at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU Affero General Public License for more details.
+
+	You should have received a copy of the GNU Affero General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+*/
+
+// The waterfall of openwebrx.js. It draws on a single canvas, in a Web Worker if the browser can hand the canvas
+// over to one (OffscreenCanvas), and on the page otherwise (then this file is loaded with a <script> tag).
+//  - the colors come from a lookup table of 256 entries, made by waterfall_mklut() in openwebrx.js from
+//    waterfall_colors, waterfall_min_level and waterfall_max_level: a row is one lookup per bin,
+//  - the rows are written into a circular texture (ring): a canvas as tall as the waterfall, where the newest row
+//    overwrites the oldest one. Only the new row is drawn for each row. The visible canvas is drawn from the ring
+//    with two blits, the newest rows on top, once for each frame of the browser (requestAnimationFrame), however
+//    many rows have come since the last one, so nothing has to be moved around in the DOM,
+//  - a row can be a slice of the band at a lower resolution (FFTL and FFTD messages, see spectrum.py): its bins are
+//    colored at the width of the slice, and scaled into its place in the ring by drawImage(). The rest of the row
+//    gets the color of the lowest level, so the ring has no transparent pixels once every row has been written, and
+//    the visible canvas does not have to be cleared before the blits.
+
+function waterfall_renderer(canvas, width, rows)
+{
+	this.canvas = canvas;
+	this.context = canvas.getContext("2d");
+	this.width = width;
+	this.lut = new Uint32Array(256);
+	this.empty_color = "rgba(0,0,0,0)"; //of the row outside a slice
+	this.draw_pending = false;
+	this.min_level = 0;
+	this.scale = 0;
+	this.row_images = {}; // width -> ImageData of one row
+	this.row_canvas = this.create_canvas(width, 1); //a slice is put here, then scaled into the ring
+	this.row_context = this.row_canvas.getContext("2d");
+	this.resize(rows);
+}
+
+waterfall_renderer.prototype.create_canvas = function(width, height)
+{
+	if(typeof OffscreenCanvas != "undefined") return new OffscreenCanvas(width, height);
+	var canvas = document.createElement("canvas");
+	canvas.width = width;
+	canvas.height = height;
+	return canvas;
+};
+
+waterfall_renderer.prototype.set_colors = function(lut, min_level, max_level)
+{
+	// lut has 256*4 bytes in RGBA order, so as an Uint32Array it is in the byte order of the ImageData
+	this.lut = new Uint32Array(lut);
+	var bytes = new Uint8Array(lut);
+	this.empty_color = "rgba(" + bytes[0] + "," + bytes[1] + "," + bytes[2] + "," + bytes[3] / 255 + ")";
+	this.min_level = min_level;
+	this.scale = 256 / (max_level - min_level);
+};
+
+waterfall_renderer.prototype.row_image = function(count)
+{
+	if(!this.row_images[count]) this.row_images[count] = this.context.createImageData(count, 1);
+	return this.row_images[count];
+};
+
+waterfall_renderer.prototype.add_row = function(data, view_start, view_end)
+{
+	// view_start and view_end (from 0 to 1) are where the row is in the band, if it is a slice of it
+	var count = Math.min(data.length, this.width), image = this.row_image(count);
+	var pixels = new Uint32Array(image.data.buffer), lut = this.lut, min_level = this.min_level, scale = this.scale;
+	for(var x = 0; x < count; x++)
+	{
+		var index = ((data[x] - min_level) * scale) | 0;
+		pixels[x] = lut[index < 0 ? 0 : (index > 255 ? 255 : index)];
+	}
+	this.line = (this.line + this.rows - 1) % this.rows; //the newest row is above the previous one
+	if(typeof view_start == "undefined" || (view_start == 0 && view_end == 1 && count == this.width))
+		this.ring_context.putImageData(image, 0, this.line);
+	else
+	{
+		this.ring_context.fillStyle = this.empty_color; //outside the slice
+		this.ring_context.fillRect(0, this.line, this.width, 1);
+		this.row_context.putImageData(image, 0, 0);
+		this.ring_context.drawImage(this.row_canvas, 0, 0, count, 1, view_start * this.width, this.line, (view_end - view_start) * this.width, 1);
+	}
+	if(this.written < this.rows) this.written++;
+	this.request_draw();
+};
+
+waterfall_renderer.prototype.request_draw = function()
+{
+	// the rows that come before the next frame are drawn with it, at once
+	if(this.draw_pending) return;
+	this.draw_pending = true;
+	var renderer = this, callback = function() { renderer.draw_pending = false; renderer.draw(); };
+	if(typeof requestAnimationFrame == "function") requestAnimationFrame(callback);
+	else setTimeout(callback, 1000 / 60); //e.g. in the workers of older browsers
+};
+
+waterfall_renderer.prototype.draw = function()
+{
+	var w = this.width, first = this.rows - this.line;
+	if(this.written < this.rows) this.context.clearRect(0, 0, w, this.rows); //the rows that have not been written yet are transparent
+	this.context.drawImage(this.ring, 0, this.line, w, first, 0, 0, w, first);
+	if(this.line) this.context.drawImage(this.ring, 0, 0, w, this.line, 0, first, w, this.line);
+};
+
+waterfall_renderer.prototype.resize = function(rows)
+{
+	// the new ring starts with what is on the canvas now, the newest row on top
+	var old_canvas = this.ring ? this.create_canvas(this.width, this.rows) : null;
+	if(old_canvas) old_canvas.getContext("2d").drawImage(this.canvas, 0, 0);
+	this.rows = rows;
+	this.ring = this.create_canvas(this.width, rows);
+	this.ring_context = this.ring.getContext("2d");
+	this.ring_context.imageSmoothingEnabled = false; //the bins of a slice are scaled up as blocks, not blurred
+	if(old_canvas) this.ring_context.drawImage(old_canvas, 0, 0);
+	this.line = 0;
+	this.written = 0; //the old rows may have transparent pixels
+	this.canvas.height = rows;
+	this.draw();
+};
+
+waterfall_renderer.prototype.clear = function()
+{
+	this.ring_context.clearRect(0, 0, this.width, this.rows);
+	this.line = 0;
+	this.written = 0;
+	this.draw();
+};
+
+if(typeof importScripts == "function" && typeof document == "undefined")
+{
+	// in a Web Worker, the messages come from waterfall_post() in openwebrx.js
+	var worker_renderer;
+	onmessage = function(event)
+	{
+		var message = event.data;
+		if(message.canvas) worker_renderer = new waterfall_renderer(message.canvas, message.width, message.rows);
+		if(message.lut) worker_renderer.set_colors(message.lut, message.min_level, message.max_level);
+		if(message.rows && !message.canvas) worker_renderer.resize(message.rows);
+		if(message.clear) worker_renderer.clear();
+		if(message.row) worker_renderer.add_row(message.row, message.view_start, message.view_end);
+	};
+}
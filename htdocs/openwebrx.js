@@ -46,6 +46,7 @@ var audio_buffer_current_size=0;
 var fft_size;
 var fft_fps;
 var fft_compression="none";
+var fft_pyramid_levels=0;
 var fft_codec=new sdrjs.ImaAdpcm();
 var audio_compression="none";
 var waterfall_setup_done=0;
@@ -126,6 +127,7 @@ function style_value(of_what,which)
 function updateVolume()
 {
 	volume = parseFloat(e("openwebrx-panel-volume").value) / 100;
+	audio_pipeline_post({ gain: volume });
 }
 
 function toggleMute()
@@ -174,6 +176,7 @@ function updateWaterfallColors(which)
 	}
 	waterfall_min_level=parseInt(wfmin.value);
 	waterfall_max_level=parseInt(wfmax.value);
+	waterfall_update_colors();
 }
 function waterfallColorsDefault()
 {
@@ -181,6 +184,7 @@ function waterfallColorsDefault()
 	waterfall_max_level=waterfall_max_level_default;
 	e("openwebrx-waterfall-color-min").value=waterfall_min_level.toString();
 	e("openwebrx-waterfall-color-max").value=waterfall_max_level.toString();
+	waterfall_update_colors();
 }
 
 function waterfallColorsAuto()
@@ -1103,6 +1107,7 @@ function resize_waterfall_container(check_init)
 	if(check_init&&!waterfall_setup_done) return;
 	var numHeight;
 	mathbox_container.style.height=canvas_container.style.height=(numHeight=window.innerHeight-e("webrx-top-container").clientHeight-e("openwebrx-scale-container").clientHeight).toString()+"px";
+	if(numHeight>waterfall_rows) waterfall_resize(numHeight);
 	if(mathbox)
 	{
 		//mathbox.three.camera.aspect = document.body.offsetWidth / numHeight;
@@ -1161,10 +1166,19 @@ function on_ws_recv(evt)
 		var audio_data;
 		if(audio_compression=="adpcm") audio_data=new Uint8Array(evt.data,4)
 		else audio_data=new Int16Array(evt.data,4);
-		audio_prepare(audio_data);
+		if(audio_pipeline=="main") audio_prepare(audio_data);
+		else audio_pipeline_post({ audio: evt.data.slice(4) }); //decoded in the worker or the AudioWorklet
 		audio_buffer_current_size_debug+=audio_data.length;
 		audio_buffer_all_size_debug+=audio_data.length;
-		if(!(ios||is_chrome) && (audio_initialized==0 && audio_prepared_buffers.length>audio_buffering_fill_to)) audio_init()
+		if(!(ios||is_chrome) && (audio_initialized==0 && audio_ready_to_start())) audio_init()
+	}
+	else if(first4Chars=="FFTL")
+	{
+		waterfall_add_queue(fft_level_expand(evt.data));
+	}
+	else if(first4Chars=="FFTD")
+	{
+		waterfall_add_queue(fft_delta_decode(evt.data));
 	}
 	else if(first3Chars=="FFT")
 	{
@@ -1188,6 +1202,10 @@ function on_ws_recv(evt)
         secondary_demod_push_data(arrayBufferToString(evt.data).substring(4));
         //console.log("DAT");
 	} 
+    else if(first4Chars=="SKM ")
+    {
+        skimmer_push(arrayBufferToString(evt.data).substring(4));
+    }
     else if(first3Chars=="MSG")
 	{
 		/*try
@@ -1235,6 +1253,15 @@ function on_ws_recv(evt)
 						fft_compression=param[1];
 						divlog( "FFT stream is "+ ((fft_compression=="adpcm")?"compressed":"uncompressed")+"." )
 						break;
+					case "fft_codecs":
+						if(param[1].split(",").indexOf("delta")>=0) ws.send("SET fft_codec=delta"); //see fft_delta_decode()
+						break;
+					case "fft_pyramid_levels":
+						fft_pyramid_levels=parseInt(param[1]);
+						break;
+					case "skimmer":
+						if(param[1]=="1") e("openwebrx-button-skimmer").style.display="table-cell";
+						break;
 					case "cpu_usage":
 						var server_cpu_usage=parseInt(param[1]);
 						progressbar_set(e("openwebrx-bar-server-cpu"),server_cpu_usage/100,"Server CPU ["+param[1]+"%]",server_cpu_usage>85);
@@ -1246,6 +1273,15 @@ function on_ws_recv(evt)
 					case "max_clients":
 						max_clients_num=parseInt(param[1]);
 						break;
+					case "overload_level":
+						var level=parseInt(param[1]);
+						if(level!=server_overload_level) divlog(overload_level_messages[Math.min(level,overload_level_messages.length-1)],level>server_overload_level);
+						server_overload_level=level;
+						break;
+					case "secondary_refused":
+						divlog("The server does not have enough CPU left to decode digimodes for you now.",1);
+						secondary_demod_close_window();
+						break;
 					case "s":
 						smeter_level=parseFloat(param[1]);
 						setSmeterAbsoluteValue(smeter_level);
@@ -1287,6 +1323,211 @@ function waterfall_measure_minmax_print()
 	console.log("Waterfall | min = "+waterfall_measure_minmax_min.toString()+" dB | max = "+waterfall_measure_minmax_max.toString()+" dB");
 }
 
+function fft_level_expand(data)
+{
+	//FFTL messages have a part of the FFT at a lower resolution (see spectrum.py on the server)
+	var header=new DataView(data,4,16);
+	var format=header.getUint8(0), level_size=header.getUint32(4,true), first_bin=header.getUint32(8,true), offset=header.getFloat32(12,true);
+	var bins=(format==0)?new Float32Array(data,20):new Uint8Array(data,20);
+	return fft_level_row(bins,(format==0)?null:offset,level_size,first_bin);
+}
+
+function fft_level_row(bins, offset, level_size, first_bin)
+{
+	//bins are float, or uint8 if offset is not null. The row keeps the width of the slice, and where it is in the band
+	//(view_start and view_end, from 0 to 1): the waterfall draws it there, scaled, so we do not expand it to fft_size.
+	var row=new Float32Array(bins.length);
+	if(offset===null) row.set(bins);
+	else for(var i=0;i<bins.length;i++) row[i]=offset+bins[i]*0.5;
+	row.view_start=first_bin/level_size;
+	row.view_end=(first_bin+bins.length)/level_size;
+	return row;
+}
+
+function fft_row_expand(row)
+{
+	//a row of fft_size bins from a slice, for the 3D view. Outside the slice we fill in its minimum.
+	if(typeof row.view_start=="undefined") return row;
+	var full=new Float32Array(fft_size);
+	var first=Math.round(row.view_start*fft_size), ratio=(row.view_end-row.view_start)*fft_size/row.length;
+	var min_value=Math.min.apply(Math,row);
+	full.fill(min_value);
+	for(var i=0;i<row.length;i++) full.fill(row[i],first+Math.floor(i*ratio),first+Math.floor((i+1)*ratio));
+	return full;
+}
+
+var fft_delta_ema=null; //the average of the previous rows, the same as in spectrum.delta_encoder on the server
+
+function fft_delta_decode(data)
+{
+	//FFTD messages: the residuals of the 8 bit bins after a prediction from the previous rows, deflated (see spectrum.py)
+	var header=new DataView(data,4,20);
+	var flags=header.getUint8(0), level_size=header.getUint32(4,true), first_bin=header.getUint32(8,true), bin_count=header.getUint32(12,true), offset=header.getFloat32(16,true);
+	var residuals=inflate_raw(new Uint8Array(data,24),bin_count);
+	var bins=new Uint8Array(bin_count);
+	if(flags&1||!fft_delta_ema||fft_delta_ema.length!=bin_count)
+	{
+		fft_delta_ema=new Int32Array(bin_count);
+		for(var i=0;i<bin_count;i++) { bins[i]=residuals[i]; fft_delta_ema[i]=residuals[i]*16; }
+	}
+	else for(var i=0;i<bin_count;i++)
+	{
+		bins[i]=((fft_delta_ema[i]+8)>>4)+residuals[i]; //wraps around at 256, as on the server
+		fft_delta_ema[i]+=(bins[i]*16-fft_delta_ema[i])>>2;
+	}
+	return fft_level_row(bins,offset,level_size,first_bin);
+}
+
+// ========================================================
+// =================  INFLATE (RFC 1951)  =================
+// ========================================================
+
+var inflate_length_base=[3,4,5,6,7,8,9,10,11,13,15,17,19,23,27,31,35,43,51,59,67,83,99,115,131,163,195,227,258];
+var inflate_length_extra=[0,0,0,0,0,0,0,0,1,1,1,1,2,2,2,2,3,3,3,3,4,4,4,4,5,5,5,5,0];
+var inflate_distance_base=[1,2,3,4,5,7,9,13,17,25,33,49,65,97,129,193,257,385,513,769,1025,1537,2049,3073,4097,6145,8193,12289,16385,24577];
+var inflate_distance_extra=[0,0,0,0,1,1,2,2,3,3,4,4,5,5,6,6,7,7,8,8,9,9,10,10,11,11,12,12,13,13];
+var inflate_code_length_order=[16,17,18,0,8,7,9,6,10,5,11,4,12,3,13,2,14,1,15];
+var inflate_fixed_tables=null;
+
+function inflate_huffman(lengths)
+{
+	//a canonical Huffman code: the number of codes of each length, and the symbols in the order of their codes
+	var counts=new Uint16Array(16), offsets=new Uint16Array(16), symbols=new Uint16Array(lengths.length);
+	for(var i=0;i<lengths.length;i++) counts[lengths[i]]++;
+	counts[0]=0;
+	for(var i=1;i<16;i++) offsets[i]=offsets[i-1]+counts[i-1];
+	for(var i=0;i<lengths.length;i++) if(lengths[i]) symbols[offsets[lengths[i]]++]=i;
+	return { counts: counts, symbols: symbols };
+}
+
+function inflate_raw(input, output_size)
+{
+	//decodes a raw deflate stream (as from zlib with negative wbits) of a known size
+	var output=new Uint8Array(output_size), out=0, position=0, bit_buffer=0, bit_count=0;
+	var bits=function(n)
+	{
+		while(bit_count<n) { bit_buffer|=(input[position++]|0)<<bit_count; bit_count+=8; }
+		var value=bit_buffer&((1<<n)-1);
+		bit_buffer>>>=n;
+		bit_count-=n;
+		return value;
+	};
+	var decode=function(huffman)
+	{
+		var code=0, first=0, index=0;
+		for(var length=1;length<16;length++)
+		{
+			code|=bits(1);
+			var count=huffman.counts[length];
+			if(code-count<first) return huffman.symbols[index+(code-first)];
+			index+=count;
+			first=(first+count)<<1;
+			code<<=1;
+		}
+		throw "inflate_raw(): invalid code";
+	};
+	var last;
+	do
+	{
+		last=bits(1);
+		var type=bits(2);
+		if(type==0)
+		{
+			bit_buffer=bit_count=0; //stored block: it starts at the next byte
+			var length=input[position]|(input[position+1]<<8);
+			position+=4;
+			output.set(input.subarray(position,position+length),out);
+			position+=length;
+			out+=length;
+			continue;
+		}
+		var length_code, distance_code;
+		if(type==1)
+		{
+			if(!inflate_fixed_tables)
+			{
+				var lengths=new Uint8Array(288);
+				for(var i=0;i<288;i++) lengths[i]=(i<144)?8:(i<256)?9:(i<280)?7:8;
+				var distances=new Uint8Array(30);
+				distances.fill(5);
+				inflate_fixed_tables=[inflate_huffman(lengths),inflate_huffman(distances)];
+			}
+			length_code=inflate_fixed_tables[0];
+			distance_code=inflate_fixed_tables[1];
+		}
+		else
+		{
+			var length_count=bits(5)+257, distance_count=bits(5)+1, code_length_count=bits(4)+4;
+			var code_lengths=new Uint8Array(19);
+			for(var i=0;i<code_length_count;i++) code_lengths[inflate_code_length_order[i]]=bits(3);
+			var code_length_code=inflate_huffman(code_lengths);
+			var lengths=new Uint8Array(length_count+distance_count);
+			for(var i=0;i<lengths.length;)
+			{
+				var symbol=decode(code_length_code);
+				if(symbol<16) { lengths[i++]=symbol; continue; }
+				var value=0, repeat;
+				if(symbol==16) { value=lengths[i-1]; repeat=3+bits(2); }
+				else if(symbol==17) repeat=3+bits(3);
+				else repeat=11+bits(7);
+				while(repeat--) lengths[i++]=value;
+			}
+			length_code=inflate_huffman(lengths.subarray(0,length_count));
+			distance_code=inflate_huffman(lengths.subarray(length_count));
+		}
+		while(true)
+		{
+			var symbol=decode(length_code);
+			if(symbol<256) output[out++]=symbol;
+			else if(symbol==256) break;
+			else
+			{
+				symbol-=257;
+				var length=inflate_length_base[symbol]+bits(inflate_length_extra[symbol]);
+				var distance_symbol=decode(distance_code);
+				var distance=inflate_distance_base[distance_symbol]+bits(inflate_distance_extra[distance_symbol]);
+				for(var i=0;i<length;i++,out++) output[out]=output[out-distance];
+			}
+		}
+	} while(!last);
+	return output;
+}
+
+var fft_view_timer=null;
+var fft_view_last="";
+
+function waterfall_view_update()
+{
+	//while dragging, the view is sent only a few times per second
+	if(!fft_pyramid_levels||fft_view_timer) return;
+	fft_view_timer=window.setTimeout(waterfall_view_send,200);
+}
+
+function waterfall_view_send()
+{
+	fft_view_timer=null;
+	if(!ws||ws.readyState!=WebSocket.OPEN) return;
+	var view;
+	if(mathbox_mode==MATHBOX_MODES.WATERFALL) view="0,1,"+mathbox_waterfall_frequency_resolution.toString(); //the 3D view shows the whole band
+	else
+	{
+		var winsize=canvas_container.clientWidth;
+		var canvases_width=winsize*zoom_levels[zoom_level];
+		var start=-zoom_offset_px/canvases_width;
+		view=start.toFixed(5)+","+(start+winsize/canvases_width).toFixed(5)+","+Math.round(winsize*(window.devicePixelRatio||1)).toString();
+	}
+	if(view==fft_view_last) return;
+	fft_view_last=view;
+	ws.send("SET fft_view="+view);
+}
+
+function waterfall_visibility_changed()
+{
+	//we don't need FFT rows while the tab is hidden, the server pauses them (the audio goes on)
+	if(!ws||ws.readyState!=WebSocket.OPEN) return;
+	ws.send("SET fft_fps="+((document.hidden)?"0":fft_fps.toString()));
+}
+
 function waterfall_add_queue(what)
 {
 	if(waterfall_measure_minmax) waterfall_measure_minmax_do(what);
@@ -1313,6 +1554,15 @@ function on_ws_opened()
 
 var was_error=0;
 
+var server_overload_level=0; //see governor.py
+var overload_level_messages=[
+	"The server is no longer overloaded, every feature is back.",
+	"The server is overloaded: the waterfall is slowed down.",
+	"The server is overloaded: the waterfall is slowed down, and the spectrum is averaged less.",
+	"The server is overloaded: the waterfall is slowed down, the spectrum is averaged less, and the digimode waterfall is paused.",
+	"The server is overloaded: the waterfall is slowed down, the spectrum is averaged less, the digimode waterfall is paused, and no new users are admitted."
+];
+
 function divlog(what, is_error)
 {
 	is_error=!!is_error;
@@ -1377,14 +1627,101 @@ function audio_prepare(data)
 	else return;
 
 	//console.log("prepare",data.length,audio_rebuffer.remaining());
-	while(audio_rebuffer.remaining())
-	{
-		audio_prepared_buffers.push(audio_rebuffer.take());
-		audio_buffer_current_count_debug++;
-	}
+	while(audio_rebuffer.remaining()) audio_prepared_push(audio_rebuffer.take());
+}
+
+function audio_prepared_push(buffer)
+{
+	//a buffer of audio_buffer_size samples for audio_onprocess()
+	audio_prepared_buffers.push(buffer);
+	audio_buffer_current_count_debug++;
 	if(audio_buffering && audio_prepared_buffers.length>audio_buffering_fill_to) { console.log("buffers now: "+audio_prepared_buffers.length.toString()); audio_buffering=false; }
 }
 
+var audio_pipeline="main"; //"worklet": AudioWorkletNode, "worker": Web Worker with a ScriptProcessorNode, "main": sdr.js on the main thread
+var audio_worklet_node;
+var audio_worker;
+var audio_pipeline_queue=[]; //messages while the AudioWorklet module is being loaded
+var audio_pipeline_samples_sent=0;
+var audio_worklet_status={ buffered: 0, underruns: 0, overruns: 0, playing: false };
+var audio_underruns_reported=0;
+var audio_underrun_report_interval_ms=5000;
+
+function audio_pipeline_init()
+{
+	//see openwebrx-audio.js
+	if(audio_client_resampling_factor==0) return;
+	if(audio_context.audioWorklet && window.AudioWorkletNode)
+	{
+		audio_pipeline="worklet";
+		audio_context.audioWorklet.addModule("openwebrx-audio.js").then(function(){
+			audio_worklet_node=new AudioWorkletNode(audio_context, "openwebrx-audio-processor", { numberOfInputs: 0, numberOfOutputs: 1, outputChannelCount: [1], processorOptions: {
+				interpolation: audio_client_resampling_factor,
+				compression: audio_compression,
+				start_samples: audio_buffering_fill_to*audio_buffer_size,
+				max_samples: Math.floor(audio_buffer_maximal_length_sec*audio_context.sampleRate),
+				decrease_to_samples: Math.floor(audio_buffer_decrease_to_on_overrun_sec*audio_context.sampleRate)
+			}});
+			audio_worklet_node.port.onmessage=audio_worklet_onmessage;
+			audio_worklet_node.port.postMessage({ gain: volume });
+			audio_pipeline_queue.forEach(function(message){ audio_pipeline_post(message); });
+			audio_pipeline_queue=[];
+			if(audio_initialized) audio_worklet_node.connect(audio_context.destination);
+			divlog("Audio is decoded in an AudioWorklet.");
+		}).catch(function(error){
+			console.log("audio_pipeline_init() :: AudioWorklet failed: "+error);
+			audio_pipeline_worker_init();
+		});
+	}
+	else audio_pipeline_worker_init();
+}
+
+function audio_pipeline_worker_init()
+{
+	audio_worklet_node=null;
+	try { audio_worker=new Worker("openwebrx-audio.js"); }
+	catch(e) { audio_pipeline="main"; audio_pipeline_queue=[]; return; } //sdr.js on the main thread then, as before
+	audio_pipeline="worker";
+	audio_worker.onmessage=function(event){ event.data.chunks.forEach(audio_prepared_push); };
+	audio_worker.postMessage({ interpolation: audio_client_resampling_factor, compression: audio_compression, chunk_size: audio_buffer_size, gain: volume });
+	audio_pipeline_queue.forEach(function(message){ audio_pipeline_post(message); });
+	audio_pipeline_queue=[];
+	divlog("Audio is decoded in a Web Worker.");
+}
+
+function audio_pipeline_post(message)
+{
+	if(audio_pipeline=="main") return;
+	if(message.audio) audio_pipeline_samples_sent+=(audio_compression=="adpcm"?2:0.5)*message.audio.byteLength*audio_client_resampling_factor;
+	var transfer=message.audio?[message.audio]:[]; //the AUD frames are handed over, not copied
+	if(audio_worklet_node) audio_worklet_node.port.postMessage(message, transfer);
+	else if(audio_worker) audio_worker.postMessage(message, transfer);
+	else audio_pipeline_queue.push(message);
+}
+
+function audio_worklet_onmessage(event)
+{
+	var status=event.data;
+	if(status.underruns>audio_worklet_status.underruns) { audio_underrun_cnt+=status.underruns-audio_worklet_status.underruns; console.log("audio underrun, "+audio_underrun_cnt.toString()); }
+	if(status.overruns>audio_worklet_status.overruns) { audio_overrun_cnt+=status.overruns-audio_worklet_status.overruns; console.log("audio overrun, "+audio_overrun_cnt.toString()); }
+	audio_worklet_status=status;
+	audio_buffer_progressbar_update();
+}
+
+function audio_ready_to_start()
+{
+	if(audio_pipeline=="worklet") return audio_pipeline_samples_sent>audio_buffering_fill_to*audio_buffer_size;
+	return audio_prepared_buffers.length>audio_buffering_fill_to;
+}
+
+function audio_report_underruns()
+{
+	//so that the server can tell how its listeners are doing
+	if(audio_underrun_cnt==audio_underruns_reported) return;
+	audio_underruns_reported=audio_underrun_cnt;
+	webrx_set_param("audio_underruns",audio_underrun_cnt);
+}
+
 
 function audio_prepare_without_resampler(data)
 {
@@ -1453,7 +1790,7 @@ function audio_onprocess(e)
 {
 	//console.log("audio onprocess");
 	if(audio_buffering) return;
-	if(audio_prepared_buffers.length==0) { audio_buffer_progressbar_update(); /*add_problem("audio underrun");*/ audio_buffering=true; }
+	if(audio_prepared_buffers.length==0) { audio_underrun_cnt++; audio_buffer_progressbar_update(); /*add_problem("audio underrun");*/ audio_buffering=true; }
 	else { e.outputBuffer.copyToChannel(audio_prepared_buffers.shift(),0); }
 }
 
@@ -1467,13 +1804,13 @@ var audio_underrun_cnt = 0;
 function audio_buffer_progressbar_update()
 {
 	if(audio_buffer_progressbar_update_disabled) return;
-	var audio_buffer_value=(audio_prepared_buffers.length*audio_buffer_size)/audio_context.sampleRate;
+	var audio_buffer_value=(audio_pipeline=="worklet")?audio_worklet_status.buffered:(audio_prepared_buffers.length*audio_buffer_size)/audio_context.sampleRate;
 	audio_buffer_total_average_level_length++; audio_buffer_total_average_level=(audio_buffer_total_average_level*((audio_buffer_total_average_level_length-1)/audio_buffer_total_average_level_length))+(audio_buffer_value/audio_buffer_total_average_level_length);
 	var overrun=audio_buffer_value>audio_buffer_maximal_length_sec;
-	var underrun=audio_prepared_buffers.length==0;
+	var underrun=(audio_pipeline=="worklet")?!audio_worklet_status.playing:audio_prepared_buffers.length==0;
 	var text="buffer";
-	if(overrun) { text="overrun"; console.log("audio overrun, "+(++audio_overrun_cnt).toString()); }
-	if(underrun) { text="underrun"; console.log("audio underrun, "+(++audio_underrun_cnt).toString()); }
+	if(overrun) { text="overrun"; if(audio_pipeline!="worklet") console.log("audio overrun, "+(++audio_overrun_cnt).toString()); }
+	if(underrun) { text="underrun"; console.log("audio underrun, "+audio_underrun_cnt.toString()); }
 	if(overrun||underrun)
 	{
 		audio_buffer_progressbar_update_disabled=true;
@@ -1617,6 +1954,7 @@ function audio_preinit()
 
 	audio_calculate_resampling(audio_context.sampleRate);
 	audio_resampler = new sdrjs.RationalResamplerFF(audio_client_resampling_factor,1);
+	audio_pipeline_init();
 	ws.send("SET output_rate="+audio_server_output_rate.toString()+" action=start"); //now we'll get AUD packets as well
 
 }
@@ -1635,18 +1973,26 @@ function audio_init()
 	audio_initialized=1; // only tell on_ws_recv() not to call it again
 
 
-	//on Chrome v36, createJavaScriptNode has been replaced by createScriptProcessor
-	createjsnode_function = (audio_context.createJavaScriptNode == undefined)?audio_context.createScriptProcessor.bind(audio_context):audio_context.createJavaScriptNode.bind(audio_context);
-	audio_node = createjsnode_function(audio_buffer_size, 0, 1);
-	audio_node.onaudioprocess = audio_onprocess;
-	audio_node.connect(audio_context.destination);
+	if(audio_pipeline=="worklet")
+	{
+		if(audio_worklet_node) audio_worklet_node.connect(audio_context.destination); //otherwise it is connected once the module is loaded
+	}
+	else
+	{
+		//on Chrome v36, createJavaScriptNode has been replaced by createScriptProcessor
+		createjsnode_function = (audio_context.createJavaScriptNode == undefined)?audio_context.createScriptProcessor.bind(audio_context):audio_context.createJavaScriptNode.bind(audio_context);
+		audio_node = createjsnode_function(audio_buffer_size, 0, 1);
+		audio_node.onaudioprocess = audio_onprocess;
+		audio_node.connect(audio_context.destination);
+	}
 	// --- Resampling ---
 	//https://github.com/grantgalitz/XAudioJS/blob/master/XAudioServer.js
 	//audio_resampler = new Resampler(audio_received_sample_rate, audio_context.sampleRate, 1, audio_buffer_size, true);
 	//audio_input_buffer_size = audio_buffer_size*(audio_received_sample_rate/audio_context.sampleRate);
 	webrx_set_param("audio_rate",audio_context.sampleRate); //Don't try to resample //TODO remove this
 
-	window.setInterval(audio_flush,audio_flush_interval_ms);
+	if(audio_pipeline!="worklet") window.setInterval(audio_flush,audio_flush_interval_ms); //the AudioWorklet drops what is too old by itself
+	window.setInterval(audio_report_underruns,audio_underrun_report_interval_ms);
 	divlog('Web Audio API succesfully initialized, sample rate: '+audio_context.sampleRate.toString()+ " sps");
 	/*audio_source=audio_context.createBufferSource();
    audio_buffer = audio_context.createBuffer(xhr.response, false);
@@ -1677,7 +2023,8 @@ function on_ws_closed()
 {
 	try
 	{
-		audio_node.disconnect();
+		if(audio_worklet_node) audio_worklet_node.disconnect();
+		else audio_node.disconnect();
 	}
 	catch (dont_care) {}
 	divlog("WebSocket has closed unexpectedly. Please reload the page.", 1);
@@ -1737,24 +2084,21 @@ function color_between(first, second, percent)
 }
 
 
-var canvas_context;
-var canvases = [];
-var canvas_default_height = 200;
+var canvases = []; //a single canvas, see openwebrx-waterfall.js
 var canvas_container;
 var canvas_phantom;
+var waterfall_rows = 1024; //the history that can be scrolled back, it grows if the waterfall is taller than this
+var waterfall_worker;
+var waterfall_renderer_local; //if the browser cannot draw in a worker
 
 function add_canvas()
 {
 	var new_canvas = document.createElement("canvas");
 	new_canvas.width=fft_size;
-	new_canvas.height=canvas_default_height;
-	canvas_actual_line=canvas_default_height-1;
 	new_canvas.style.width=(canvas_container.clientWidth*zoom_levels[zoom_level]).toString()+"px";
 	new_canvas.style.left=zoom_offset_px.toString()+"px";
-	new_canvas.style.height=canvas_default_height.toString()+"px";
-	new_canvas.openwebrx_top=(-canvas_default_height+1);
-	new_canvas.style.top=new_canvas.openwebrx_top.toString()+"px";
-	canvas_context = new_canvas.getContext("2d");
+	new_canvas.style.height=waterfall_rows.toString()+"px";
+	new_canvas.style.top="0px";
 	canvas_container.appendChild(new_canvas);
 	new_canvas.addEventListener("mouseover", canvas_mouseover, false);
 	new_canvas.addEventListener("mouseout", canvas_mouseout, false);
@@ -1763,6 +2107,58 @@ function add_canvas()
 	new_canvas.addEventListener("mousedown", canvas_mousedown, false);
 	new_canvas.addEventListener("wheel",canvas_mousewheel, false);
 	canvases.push(new_canvas);
+	if(new_canvas.transferControlToOffscreen && window.Worker)
+	{
+		try
+		{
+			var offscreen=new_canvas.transferControlToOffscreen();
+			waterfall_worker=new Worker("openwebrx-waterfall.js");
+			waterfall_worker.postMessage({ canvas: offscreen, width: fft_size, rows: waterfall_rows }, [offscreen]);
+		}
+		catch(e) { waterfall_worker=null; }
+	}
+	if(!waterfall_worker) waterfall_renderer_local=new waterfall_renderer(new_canvas, fft_size, waterfall_rows);
+	waterfall_update_colors();
+}
+
+function waterfall_post(message)
+{
+	if(waterfall_worker) waterfall_worker.postMessage(message);
+	else if(waterfall_renderer_local)
+	{
+		var r=waterfall_renderer_local;
+		if(message.lut) r.set_colors(message.lut, message.min_level, message.max_level);
+		if(message.rows) r.resize(message.rows);
+		if(message.clear) r.clear();
+		if(message.row) r.add_row(message.row, message.view_start, message.view_end);
+	}
+}
+
+function waterfall_mklut(waterfall_colors_arg)
+{
+	//the color of each 1/256 of the range between waterfall_min_level and waterfall_max_level, as RGBA bytes
+	var lut=new Uint8Array(256*4);
+	for(var i=0;i<256;i++)
+	{
+		var color=waterfall_mkcolor(waterfall_min_level+(i+0.5)*(waterfall_max_level-waterfall_min_level)/256, waterfall_colors_arg);
+		for(var j=0;j<4;j++) lut[i*4+j]=((color>>>0)>>((3-j)*8))&0xff;
+	}
+	return lut.buffer;
+}
+
+function waterfall_update_colors()
+{
+	//only the new rows get the new colors, as before
+	if(!canvases.length) return;
+	waterfall_post({ lut: waterfall_mklut(), min_level: waterfall_min_level, max_level: waterfall_max_level });
+}
+
+function waterfall_resize(rows)
+{
+	waterfall_rows=rows;
+	if(!canvases.length) return;
+	canvases[0].style.height=rows.toString()+"px";
+	waterfall_post({ rows: rows });
 }
 
 
@@ -1784,29 +2180,6 @@ function init_canvas_container()
 	add_canvas();
 }
 
-canvas_maxshift=0;
-
-function shift_canvases()
-{
-	canvases.forEach(function(p)
-	{
-		p.style.top=(p.openwebrx_top++).toString()+"px";
-	});
-	canvas_maxshift++;
-	if(canvas_container.clientHeight>canvas_maxshift)
-	{
-		canvas_phantom.style.top=canvas_maxshift.toString()+"px";
-		canvas_phantom.style.height=(canvas_container.clientHeight-canvas_maxshift).toString()+"px";
-		canvas_phantom.style.display="block";
-	}
-	else
-		canvas_phantom.style.display="none";
-
-
-	//canvas_container.style.height=(((canvases.length-1)*canvas_default_height)+(canvas_default_height-canvas_actual_line)).toString()+"px";
-	//canvas_container.style.height="100%";
-}
-
 function resize_canvases(zoom)
 {
 	if(typeof zoom == "undefined") zoom=false;
@@ -1821,6 +2194,7 @@ function resize_canvases(zoom)
 	});
 	canvas_phantom.style.width=new_width;
 	canvas_phantom.style.left=zoom_value;
+	waterfall_view_update();
 }
 
 function waterfall_init()
@@ -1869,6 +2243,23 @@ var mathbox_data_index_valid = function(x)
 	return x>mathbox_data_max_depth-mathbox_data_current_depth;
 }
 
+var mathbox_lut, mathbox_lut_min_level, mathbox_lut_max_level; //r, g, b of the 3D view, like the LUT of the waterfall
+
+var mathbox_color_index = function(dBValue)
+{
+	//returns the index of the color of dBValue in mathbox_lut, which is made again if the levels have changed
+	if(mathbox_lut_min_level!=waterfall_min_level || mathbox_lut_max_level!=waterfall_max_level)
+	{
+		var lut=new Uint8Array(waterfall_mklut(mathbox_waterfall_colors));
+		mathbox_lut=new Float32Array(256*3);
+		for(var i=0;i<256;i++) for(var j=0;j<3;j++) mathbox_lut[i*3+j]=lut[i*4+1+j]/255.0; //the lower 3 bytes of the color, as before
+		mathbox_lut_min_level=waterfall_min_level;
+		mathbox_lut_max_level=waterfall_max_level;
+	}
+	var index=((dBValue-waterfall_min_level)*256/(waterfall_max_level-waterfall_min_level))|0;
+	return (index<0?0:(index>255?255:index))*3;
+}
+
 
 
 function waterfall_add(data)
@@ -1950,24 +2341,14 @@ function waterfall_add(data)
 	if(mathbox_mode==MATHBOX_MODES.WATERFALL)
 	{
 		//Handle mathbox
+		data=fft_row_expand(data);
 		for(var i=0;i<fft_size;i++) mathbox_data[i+mathbox_data_index*fft_size]=data[i];
 		mathbox_shift();
 	}
 	else
 	{
-	//Add line to waterfall image
-	oneline_image = canvas_context.createImageData(w,1);
-	for(x=0;x<w;x++)
-	{
-		color=waterfall_mkcolor(data[x]);
-		for(i=0;i<4;i++)
-			oneline_image.data[x*4+i] = ((color>>>0)>>((3-i)*8))&0xff;
-	}
-
-	//Draw image
-	canvas_context.putImageData(oneline_image, 0, canvas_actual_line--);
-	shift_canvases();
-	if(canvas_actual_line<0) add_canvas();
+	//Add line to waterfall image (in the worker, if there is one)
+	waterfall_post({ row: data, view_start: data.view_start, view_end: data.view_end });
 	}
 
 
@@ -2115,11 +2496,8 @@ function mathbox_init()
       expr: function (emit, x, z, i, j, t) {
 		var dBValue;
 		if((dBValue=remap(x,z,t).dBValue)==undefined) return;
-		var color=waterfall_mkcolor(dBValue, mathbox_waterfall_colors);
-        var b = (color&0xff)/255.0;
-        var g = ((color&0xff00)>>8)/255.0;
-        var r = ((color&0xff0000)>>16)/255.0;
-        emit(r, g, b, 1.0);
+		var index=mathbox_color_index(dBValue);
+        emit(mathbox_lut[index], mathbox_lut[index+1], mathbox_lut[index+2], 1.0);
       },
       width:  mathbox_waterfall_frequency_resolution,
       height: mathbox_data_max_depth - 1,
@@ -2161,17 +2539,12 @@ function mathbox_toggle()
 	mathbox_container.style.display = (mathbox_mode == MATHBOX_MODES.WATERFALL) ? "block" : "none";
 	mathbox_clear_data();
 	waterfall_clear();
+	waterfall_view_update();
 }
 
 function waterfall_clear()
 {
-	while(canvases.length) //delete all canvases
-	{
-		var x=canvases.shift();
-		x.parentNode.removeChild(x);
-		delete x;
-	}
-	add_canvas();
+	waterfall_post({ clear: true });
 }
 
 function openwebrx_resize()
@@ -2189,9 +2562,11 @@ function openwebrx_init()
 	init_rx_photo();
 	open_websocket();
     secondary_demod_init();
+    skimmer_init();
 	place_panels(first_show_panel);
 	window.setTimeout(function(){window.setInterval(debug_audio,1000);},1000);
 	window.addEventListener("resize",openwebrx_resize);
+	document.addEventListener("visibilitychange",waterfall_visibility_changed);
 	check_top_bar_congestion();
 
 	//Synchronise volume with slider
@@ -2739,3 +3114,76 @@ function secondary_demod_waterfall_set_zoom(low_cut, high_cut)
     secondary_demod_canvases.map((x)=>{$(x).css("left",secondary_demod_canvas_left+"px").css("width",secondary_demod_canvas_width+"px");});
     secondary_demod_update_channel_freq_from_event();
 }
+
+// ========================================================
+// =======================  SKIMMER  ======================
+// ========================================================
+
+var skimmer_signals = []; //{freq, text, last_update}, sorted by frequency
+var skimmer_dirty = false;
+var skimmer_max_text = 80; //characters kept for a signal
+var skimmer_timeout = 120000; //ms, signals that have been silent for so long are removed
+var skimmer_merge_hz = 20; //the AFC of the skimmer moves the frequency a bit, we keep these together
+
+function skimmer_init()
+{
+    e("openwebrx-panel-skimmer").openwebrxHidden = true;
+    window.setInterval(skimmer_render, 500);
+}
+
+function skimmer_toggle()
+{
+    var show = e("openwebrx-panel-skimmer").openwebrxHidden;
+    ws.send("SET skimmer="+(show?"1":"0"));
+    if(!show) skimmer_signals = [];
+    toggle_panel("openwebrx-panel-skimmer", show);
+}
+
+function skimmer_push(message)
+{
+    var data = JSON.parse(message);
+    var signal = null;
+    for(var i=0;i<skimmer_signals.length;i++)
+        if(Math.abs(skimmer_signals[i].freq-data.freq)<skimmer_merge_hz) { signal = skimmer_signals[i]; break; }
+    if(!signal)
+    {
+        signal = { text: "" };
+        skimmer_signals.push(signal);
+        skimmer_signals.sort((a,b)=>a.freq-b.freq);
+    }
+    signal.freq = data.freq;
+    signal.text = (signal.text+data.text).slice(-skimmer_max_text);
+    signal.last_update = Date.now();
+    skimmer_dirty = true;
+}
+
+function skimmer_escape(text)
+{
+    return Array.from(text).map((y)=>{
+        var c=y.charCodeAt(0);
+        if(y=="\r"||y=="\n"||y==" ") return "&nbsp;";
+        if(c<32||c>126) return "";
+        if(y=="&") return "&amp;";
+        if(y=="<") return "&lt;";
+        if(y==">") return "&gt;";
+        return y;
+    }).join("");
+}
+
+function skimmer_render()
+{
+    var now = Date.now();
+    var count = skimmer_signals.length;
+    skimmer_signals = skimmer_signals.filter((x)=>now-x.last_update<skimmer_timeout);
+    if(!skimmer_dirty && count==skimmer_signals.length) return;
+    skimmer_dirty = false;
+    if(e("openwebrx-panel-skimmer").openwebrxHidden) return;
+    e("openwebrx-skimmer-content").innerHTML = skimmer_signals.map((x)=>
+        "<div class=\"openwebrx-skimmer-signal\" onclick=\"skimmer_tune("+x.freq+");\"><span class=\"openwebrx-skimmer-freq\">"+
+        format_frequency("{x}", x.freq, 1e6, 4)+"</span>"+skimmer_escape(x.text)+"</div>").join("");
+}
+
+function skimmer_tune(freq)
+{
+    demodulator_set_offset_frequency(0, freq-center_freq);
+}
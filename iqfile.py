@@ -0,0 +1,162 @@
+"""
+OpenWebRX iqfile: replay recorded I/Q files instead of a receiver, and record the last seconds of the I/Q stream
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import sys
+import time
+import mmap
+import socket
+import datetime
+import threading
+import shmring
+
+#How it works:
+#  - "iqfile.py play" is used as start_rtl_command if iq_replay_file is set: it maps the file into memory, and
+#    writes it to its stdout (to nmux or the shared memory ring) at samp_rate*iq_replay_speed, in a loop if
+#    iq_replay_loop is set. With iq_replay_speed = 0 it writes as fast as it can,
+#  - the format of the file is told by its extension (.u8, .s8, .s16, .f32), the same ones the recorder uses,
+#  - the recorder keeps the last iq_record_seconds of the I/Q stream, and saves them into a file when
+#    /iq_record is requested. With the shared memory ring these are in the ring already, and the recorder only
+#    copies them when asked. With nmux it reads the stream into a ring of its own in a thread,
+#  - the name of a recording has the center frequency and the sample rate, so that it can be played back with
+#    the same settings.
+
+FORMATS = ( # extension, format_conversion, bytes per I/Q sample
+    ("u8", "csdr convert_u8_f", 2),
+    ("s8", "csdr convert_s8_f", 2),
+    ("s16", "csdr convert_s16_f", 4),
+    ("f32", "", 8)
+)
+CHUNKS_PER_SECOND = 50 #the player writes this often, so that the stream is smooth
+
+def format_of_file(path):
+    #returns (format_conversion, sample_size), or None if the extension is not known
+    extension = path.rsplit(".", 1)[-1].lower()
+    for format_extension, format_conversion, sample_size in FORMATS:
+        if extension == format_extension: return (format_conversion, sample_size)
+    return None
+
+def extension_of_format(format_conversion):
+    #the recordings are the raw stream, so only the first command of format_conversion matters
+    for format_extension, known_format_conversion, sample_size in FORMATS:
+        if known_format_conversion and format_conversion.startswith(known_format_conversion): return format_extension
+    return "f32" if format_conversion == "" else "raw"
+
+def sample_size_of_format(format_conversion):
+    extension = extension_of_format(format_conversion)
+    return ([size for format_extension, known_format_conversion, size in FORMATS if format_extension == extension] or [8])[0]
+
+def player_command(path, samp_rate, sample_size, speed, loop):
+    return "%s %s play %s %d %d %g %d" % (sys.executable, os.path.abspath(__file__), path, samp_rate, sample_size, speed, 1 if loop else 0)
+
+def player_main(path, samp_rate, sample_size, speed, loop):
+    f = open(path, "rb")
+    size = os.fstat(f.fileno()).st_size
+    size -= size%sample_size
+    if size == 0:
+        print >>sys.stderr, "[openwebrx-iqfile] %s is empty" % path
+        return
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.close()
+    bytes_per_second = float(samp_rate*sample_size)
+    chunk_size = max(sample_size, int(bytes_per_second/CHUNKS_PER_SECOND)/sample_size*sample_size)
+    print >>sys.stderr, "[openwebrx-iqfile] playing %s (%.1f s) at %gx speed%s" % (path, size/bytes_per_second, speed, ", in a loop" if loop else "")
+    started = time.time()
+    sent = position = 0
+    while True:
+        if position >= size:
+            if not loop: break
+            position = 0
+        length = min(chunk_size, size-position)
+        try:
+            written = 0
+            while written < length: written += os.write(1, buffer(mm, position+written, length-written))
+        except OSError: break #the reader has exited
+        position += length
+        sent += length
+        if speed <= 0: continue
+        delay = started+sent/(bytes_per_second*speed)-time.time()
+        if delay > 0: time.sleep(delay)
+        elif delay < -1: started -= delay #we could not keep up: we do not try to catch up with a burst
+
+class recorder:
+
+    def __init__(self, nc_port, shm_path, samp_rate, center_freq, format_conversion, seconds, directory):
+        self.samp_rate = samp_rate
+        self.center_freq = center_freq
+        self.extension = extension_of_format(format_conversion)
+        self.sample_size = sample_size_of_format(format_conversion)
+        self.size = int(seconds*samp_rate)*self.sample_size
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.shm_reader = shmring.ring_reader(shm_path) if shm_path else None
+        if self.shm_reader:
+            if self.size > self.shm_reader.data_size-shmring.WRITE_CHUNK:
+                print "[openwebrx-iqfile] the shared memory ring only holds %.1f s, increase nmux_memory for longer recordings" % \
+                    (float(self.shm_reader.data_size-shmring.WRITE_CHUNK)/self.sample_size/samp_rate)
+            return
+        self.buffer = bytearray(self.size)
+        self.position = 0 #bytes received so far, the ring is self.buffer
+        self.sock = socket.create_connection(("127.0.0.1", nc_port))
+        thread = threading.Thread(target = self.receive_function, args = ())
+        thread.daemon = True
+        thread.start()
+
+    def receive_function(self):
+        while True:
+            data = self.sock.recv(65536)
+            if not data: break
+            self.lock.acquire()
+            offset = self.position%self.size
+            first = min(len(data), self.size-offset) #the rest wraps around to the start of the buffer
+            self.buffer[offset:offset+first] = data[:first]
+            self.buffer[:len(data)-first] = data[first:]
+            self.position += len(data)
+            self.lock.release()
+        print "[openwebrx-iqfile] the I/Q stream of the recorder has ended"
+
+    def last_samples(self):
+        if self.shm_reader: return self.shm_reader.read_last(self.size)
+        self.lock.acquire()
+        try:
+            partial = self.position%self.sample_size #we may have got a part of a sample from nmux, it goes
+            if self.position < self.size: return str(self.buffer[:self.position-partial])
+            offset = self.position%self.size
+            data = self.buffer[offset:]+self.buffer[:offset]
+            return str(data[(self.sample_size-partial)%self.sample_size:len(data)-partial])
+        finally:
+            self.lock.release()
+
+    def save(self):
+        #returns the name of the file
+        data = self.last_samples()
+        filename = os.path.join(self.directory, "openwebrx-%s-%dHz-%dsps.%s" % \
+            (datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S"), self.center_freq, self.samp_rate, self.extension))
+        f = open(filename, "wb")
+        f.write(data)
+        f.close()
+        print "[openwebrx-iqfile] saved %d bytes of I/Q samples to %s" % (len(data), filename)
+        return filename
+
+if __name__ == "__main__":
+    if len(sys.argv) == 7 and sys.argv[1] == "play": player_main(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), float(sys.argv[5]), sys.argv[6] == "1")
+    else: print >>sys.stderr, "usage: iqfile.py play <path> <samp_rate> <sample_size> <speed> <loop: 0 or 1>"
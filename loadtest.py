@@ -0,0 +1,358 @@
+"""
+OpenWebRX loadtest: simulates listeners over WebSocket, and measures how the server copes with them
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import math
+import errno
+import random
+import select
+import socket
+import base64
+import argparse
+import rxws
+
+#How it works:
+#  - each simulated listener does what openwebrx.js does: it loads "/" to get a client id, opens /ws/<client id>,
+#    answers "CLIENT DE SERVER", and after the "setup" message it sets a demodulator and starts the audio,
+#  - then it retunes now and then, like a listener who is looking around. Some of them (--storm-fraction) also
+#    do tuning storms: many offset_freq and mod changes in a short time, like dragging the filter on the waterfall,
+#  - the audio is played back by a model of the buffer of the browser: it starts once it has --audio-buffer seconds,
+#    and plays at output_rate. If it runs out, that is an underrun, and it waits for the buffer to fill up again,
+#  - the time between FFT frames is measured against 1/fft_fps,
+#  - the listeners are added step by step (--start, --step, --max). After each step (--step-time seconds), a line
+#    of JSON is written with the results of that step. The CPU time used by the server comes from /metrics (if
+#    metrics_enable is set), or from the cpu_usage messages (the CPU usage of the whole machine) otherwise,
+#  - audio "breaks" in a step if any listener had an underrun in it. The test stops there (unless --keep-going),
+#    and the last line of the output tells the number of listeners at which this first happened.
+#All the listeners run in this single thread, in a select() loop.
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) Firefox/60.0 openwebrx-loadtest" #the server sends other browsers to upgrade.html
+MODES = ( # mod, low_cut, high_cut: what the buttons of openwebrx.js set
+    ("nfm", -4000, 4000),
+    ("am", -4000, 4000),
+    ("ssb", 300, 3000), #usb
+    ("ssb", -3000, -300), #lsb
+)
+OUTPUT_RATE = 11025 #the default audio_server_output_rate of openwebrx.js
+RETUNE_INTERVAL = (5, 30) #s, between the tunings of a listener
+STORM_INTERVAL = (10, 20) #s, between the tuning storms of a stormy listener
+STORM_LENGTH = 1.0 #s
+STORM_COMMANDS = 20 #in a storm
+
+class ServerFullException(Exception):
+    pass
+
+def http_get(host, port, path, timeout=10):
+    #returns (status, body)
+    sock = socket.create_connection((host, port), timeout)
+    sock.sendall("GET %s HTTP/1.1\r\nHost: %s:%d\r\nUser-Agent: %s\r\nConnection: close\r\n\r\n" % (path, host, port, USER_AGENT))
+    response = ""
+    while True:
+        data = sock.recv(65536)
+        if not data: break
+        response += data
+    sock.close()
+    header, _, body = response.partition("\r\n\r\n")
+    status = int(header.split(" ", 2)[1])
+    if "content-encoding: gzip" in header.lower():
+        import zlib
+        body = zlib.decompress(body, 16+zlib.MAX_WBITS)
+    return (status, body)
+
+def percentile(values, fraction):
+    if not values: return None
+    values = sorted(values)
+    return values[min(len(values)-1, int(fraction*len(values)))]
+
+class listener:
+
+    def __init__(self, host, port, stormy, audio_buffer):
+        self.stormy = stormy
+        self.audio_buffer = audio_buffer
+        status, page = http_get(host, port, "/")
+        if status == 302: raise ServerFullException() #retry.html (or inactive.html)
+        match = re.search(r'var client_id="([^"]*)"', page)
+        if status != 200 or not match: raise IOError("no client id in the page, status %d" % status)
+        self.client_id = match.group(1)
+        self.sock = socket.create_connection((host, port), 10)
+        key = base64.b64encode(os.urandom(16))
+        self.sock.sendall("GET /ws/%s HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\nUser-Agent: %s\r\n\r\n" % \
+            (self.client_id, host, port, key, USER_AGENT))
+        response = ""
+        while not "\r\n\r\n" in response:
+            data = self.sock.recv(4096)
+            if not data: raise IOError("connection closed during the WebSocket handshake")
+            response += data
+        header, _, rest = response.partition("\r\n\r\n")
+        if not header.startswith("HTTP/1.1 101"): raise IOError("WebSocket handshake failed: "+header.split("\r\n")[0])
+        self.sock.setblocking(False)
+        self.decoder = rxws.frame_decoder(16*1024*1024)
+        self.decoder.feed(rest)
+        self.closed = False
+        self.started = False #we have got the setup message
+        self.bandwidth = 0
+        self.fft_fps = 0
+        self.audio_compression = "none"
+        self.cpu_usage = None
+        self.next_retune = self.next_storm = None
+        self.storm_end = 0
+        self.next_storm_command = 0
+        #audio model
+        self.buffered = 0.0 #seconds of audio in the buffer of the "browser"
+        self.playing = False
+        self.last_tick = time.time()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.underruns = 0
+        self.underrun_seconds = 0.0
+        self.audio_seconds = 0.0
+        self.fft_intervals = []
+        self.last_fft = None
+        self.frames = {}
+        self.bytes_received = 0
+        self.commands_sent = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, text):
+        #the frames of a client are masked
+        key = os.urandom(4)
+        header = rxws.get_header(len(text), rxws.OPCODE_TEXT)
+        self.sock.setblocking(True) #they are small, this does not stall the others for long
+        try: self.sock.sendall(header[0]+chr(ord(header[1])|0x80)+header[2:]+key+rxws.code_payload(text, key))
+        finally: self.sock.setblocking(False)
+        self.commands_sent += 1
+
+    def on_readable(self):
+        while True:
+            try: data = self.sock.recv(262144)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK): break
+                data = ""
+            if not data:
+                self.closed = True
+                break
+            self.bytes_received += len(data)
+            self.decoder.feed(data)
+        while True:
+            message = self.decoder.next_message()
+            if not message: break
+            opcode, payload = message
+            if opcode == rxws.OPCODE_CLOSE: self.closed = True
+            elif opcode in (rxws.OPCODE_TEXT, rxws.OPCODE_BINARY): self.on_message(payload)
+
+    def on_message(self, payload):
+        now = time.time()
+        begin_id = payload[:4]
+        self.frames[begin_id] = self.frames.get(begin_id, 0)+1
+        if payload.startswith("CLIENT DE SERVER"): self.send("SERVER DE CLIENT loadtest.py")
+        elif begin_id == "MSG ": self.on_msg(payload[4:].split(" "))
+        elif begin_id == "AUD ":
+            bytes_per_sample = 0.5 if self.audio_compression == "adpcm" else 2
+            seconds = (len(payload)-4)/bytes_per_sample/OUTPUT_RATE
+            self.buffered += seconds
+            self.audio_seconds += seconds
+        elif begin_id in ("FFT ", "FFTL", "FFTD"):
+            if self.last_fft: self.fft_intervals.append(now-self.last_fft)
+            self.last_fft = now
+
+    def on_msg(self, params):
+        values = dict(param.split("=", 1) for param in params if "=" in param)
+        if "bandwidth" in values: self.bandwidth = int(values["bandwidth"])
+        if "fft_fps" in values: self.fft_fps = float(values["fft_fps"])
+        if "audio_compression" in values: self.audio_compression = values["audio_compression"]
+        if "cpu_usage" in values: self.cpu_usage = int(values["cpu_usage"])/100.0
+        if "setup" in params:
+            if "delta" in values.get("fft_codecs", "").split(","): self.send("SET fft_codec=delta") #as openwebrx.js does
+            self.started = True
+            self.tune() #openwebrx.js sets the demodulator first, then starts the audio
+            self.send("SET output_rate=%d action=start" % OUTPUT_RATE)
+            self.next_retune = time.time()+random.uniform(*RETUNE_INTERVAL)
+            if self.stormy: self.next_storm = time.time()+random.uniform(*STORM_INTERVAL)
+
+    def random_offset(self):
+        return int(random.uniform(-0.45, 0.45)*self.bandwidth)
+
+    def tune(self, offset_freq=None, mode=None):
+        mod, low_cut, high_cut = mode or random.choice(MODES)
+        self.offset_freq = self.random_offset() if offset_freq == None else offset_freq
+        self.send("SET mod=%s low_cut=%d high_cut=%d offset_freq=%d" % (mod, low_cut, high_cut, self.offset_freq))
+
+    def tick(self, now):
+        elapsed = now-self.last_tick
+        self.last_tick = now
+        if not self.started: return
+        #audio playback
+        if self.playing:
+            self.buffered -= elapsed
+            if self.buffered < 0:
+                self.underruns += 1
+                self.underrun_seconds -= self.buffered
+                self.buffered = 0
+                self.playing = False
+        elif self.buffered >= self.audio_buffer: self.playing = True
+        #tuning
+        if now >= self.next_retune:
+            self.tune(max(-self.bandwidth/2, min(self.bandwidth/2, self.offset_freq+random.randint(-20000, 20000))))
+            self.next_retune = now+random.uniform(*RETUNE_INTERVAL)
+        if self.stormy and now >= self.next_storm:
+            self.storm_end = now+STORM_LENGTH
+            self.next_storm = now+random.uniform(*STORM_INTERVAL)
+        if now < self.storm_end and now >= self.next_storm_command:
+            #like dragging the passband across the waterfall, with a mode change sometimes
+            step = random.randint(-3000, 3000)
+            if random.random() < 0.1: self.tune(self.offset_freq+step)
+            else:
+                self.offset_freq = max(-self.bandwidth/2, min(self.bandwidth/2, self.offset_freq+step))
+                self.send("SET offset_freq=%d" % self.offset_freq)
+            self.next_storm_command = now+STORM_LENGTH/STORM_COMMANDS
+
+    def close(self):
+        try: self.sock.close()
+        except socket.error: pass
+
+def read_metrics(host, port):
+    #returns {name: sum of the values} of the counters we need, or None if /metrics is not enabled
+    try: status, body = http_get(host, port, "/metrics")
+    except (IOError, socket.error): return None
+    if status != 200: return None
+    result = {}
+    for line in body.split("\n"):
+        if not line or line[0] == "#": continue
+        name_labels, _, value = line.rpartition(" ")
+        name = name_labels.split("{", 1)[0]
+        if name == "openwebrx_dsp_cpu_seconds_total": name += ":"+re.search(r'chain="([^"]*)"', name_labels).group(1)
+        try: result[name] = result.get(name, 0)+float(value)
+        except ValueError: pass
+    return result
+
+def step_result(listeners, client_count, duration, metrics_before, metrics_after):
+    intervals = sum((l.fft_intervals for l in listeners), [])
+    fft_fps = max([l.fft_fps for l in listeners] or [0])
+    expected = 1.0/fft_fps if fft_fps else None
+    result = {
+        "type": "step",
+        "time": time.time(),
+        "clients": client_count,
+        "duration": round(duration, 3),
+        "audio_underruns": sum(l.underruns for l in listeners),
+        "audio_underrun_seconds": round(sum(l.underrun_seconds for l in listeners), 3),
+        "clients_with_underruns": len([l for l in listeners if l.underruns]),
+        "audio_seconds_per_client": round(sum(l.audio_seconds for l in listeners)/max(1, len(listeners)), 3),
+        "fft_frames": len(intervals),
+        "fft_interval_expected": expected,
+        "fft_interval_mean": round(sum(intervals)/len(intervals), 5) if intervals else None,
+        "fft_jitter_stdev": round(math.sqrt(sum((x-expected)**2 for x in intervals)/len(intervals)), 5) if intervals and expected else None,
+        "fft_interval_p99": round(percentile(intervals, 0.99), 5) if intervals else None,
+        "fft_interval_max": round(max(intervals), 5) if intervals else None,
+        "bytes_per_client": sum(l.bytes_received for l in listeners)/max(1, len(listeners)),
+        "commands_sent": sum(l.commands_sent for l in listeners),
+        "disconnected": len([l for l in listeners if l.closed]),
+    }
+    if metrics_before and metrics_after:
+        delta = lambda name: metrics_after.get(name, 0)-metrics_before.get(name, 0)
+        client_dsp = delta("openwebrx_dsp_cpu_seconds_total:client")
+        total = client_dsp+delta("openwebrx_dsp_cpu_seconds_total:spectrum")+delta("openwebrx_dsp_cpu_seconds_total:channelizer")+delta("process_cpu_seconds_total")
+        result["server_cpu"] = round(total/duration, 4) #in cores
+        result["server_cpu_per_client"] = round(total/duration/max(1, client_count), 4)
+        result["dsp_cpu_per_client"] = round(client_dsp/duration/max(1, client_count), 4)
+        result["cpu_source"] = "metrics"
+    else:
+        usages = [l.cpu_usage for l in listeners if l.cpu_usage != None]
+        if usages:
+            result["server_cpu"] = usages[-1] #of the whole machine, as a fraction of all the cores
+            result["server_cpu_per_client"] = round(usages[-1]/max(1, client_count), 4)
+            result["cpu_source"] = "cpu_usage"
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates listeners of an OpenWebRX server, and writes the results as JSON lines.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8073)
+    parser.add_argument("--start", type=int, default=1, help="listeners in the first step")
+    parser.add_argument("--step", type=int, default=1, help="listeners added in each step")
+    parser.add_argument("--max", type=int, default=20, help="listeners in the last step")
+    parser.add_argument("--step-time", type=float, default=20, help="seconds, the length of a step")
+    parser.add_argument("--settle-time", type=float, default=3, help="seconds after adding the listeners, before the step is measured")
+    parser.add_argument("--storm-fraction", type=float, default=0.2, help="of the listeners, do tuning storms")
+    parser.add_argument("--audio-buffer", type=float, default=0.5, help="seconds, the audio buffer of the simulated browser")
+    parser.add_argument("--keep-going", action="store_true", help="do not stop when the audio breaks")
+    parser.add_argument("--output", help="append the results to this file instead of writing them to stdout")
+    parser.add_argument("--seed", type=int, help="for the random tuning, so that runs can be repeated")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    output = open(args.output, "a") if args.output else sys.stdout
+    def write(record):
+        output.write(json.dumps(record, sort_keys=True)+"\n")
+        output.flush()
+    write({"type": "run", "time": time.time(), "options": vars(args)})
+
+    listeners = []
+    first_broken_at = None
+    server_full_at = None
+    client_count = args.start
+    while client_count <= args.max:
+        #add listeners
+        try:
+            while len(listeners) < client_count:
+                listeners.append(listener(args.host, args.port, random.random() < args.storm_fraction, args.audio_buffer))
+        except ServerFullException:
+            server_full_at = len(listeners)+1
+            print >>sys.stderr, "[openwebrx-loadtest] the server does not take more than %d listeners (max_clients)" % len(listeners)
+            break
+        #run the step
+        phase_end = time.time()+args.settle_time
+        measuring = False
+        while True:
+            now = time.time()
+            if now >= phase_end:
+                if measuring: break
+                measuring = True
+                for l in listeners: l.reset_counters()
+                metrics_before = read_metrics(args.host, args.port)
+                measure_start = time.time()
+                phase_end = measure_start+args.step_time
+            readable = select.select([l for l in listeners if not l.closed], [], [], 0.02)[0]
+            for l in readable: l.on_readable()
+            now = time.time()
+            for l in listeners: l.tick(now)
+        duration = time.time()-measure_start
+        result = step_result(listeners, client_count, duration, metrics_before, read_metrics(args.host, args.port))
+        write(result)
+        print >>sys.stderr, "[openwebrx-loadtest] %d listeners: %d underruns, FFT jitter %s s, server CPU per client %s" % \
+            (client_count, result["audio_underruns"], result["fft_jitter_stdev"], result.get("server_cpu_per_client"))
+        if (result["audio_underruns"] or result["disconnected"]) and first_broken_at == None:
+            first_broken_at = client_count
+            if not args.keep_going: break
+        client_count += args.step
+    for l in listeners: l.close()
+    write({"type": "summary", "time": time.time(), "first_broken_at": first_broken_at, "server_full_at": server_full_at, \
+        "max_clients_tested": len(listeners)})
+
+if __name__ == "__main__":
+    main()
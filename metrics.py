@@ -0,0 +1,126 @@
+"""
+OpenWebRX metrics: counters and histograms, exported in the Prometheus text format on /metrics
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import bisect
+import time
+
+#The hot paths only do a few additions on plain attributes (no locks): a value may be off by one update when
+#it is read from another thread, which is fine for monitoring.
+
+def message_type(begin_id):
+    #the type of a WebSocket message sent by rxws.send(), from its begin_id
+    if begin_id == "AUD ": return "audio"
+    if begin_id in ("FFT ", "FFTL", "FFTD"): return "fft"
+    if begin_id in ("FFTS", "DAT ", "SKM "): return "secondary"
+    return "msg"
+
+class histogram:
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets) #upper bounds
+        self.counts = [0]*(len(self.buckets)+1) #the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=""):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets+["+Inf"], self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%sle="%s"} %d' % (name, labels+"," if labels else "", bound, cumulative))
+        lines.append("%s_sum%s %s" % (name, "{"+labels+"}" if labels else "", repr(self.sum)))
+        lines.append("%s_count%s %d" % (name, "{"+labels+"}" if labels else "", self.count))
+        return lines
+
+class timed_lock:
+    # A threading.Lock that measures how long we wait for it and how long it is held.
+
+    def __init__(self, lock, buckets=(1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1)):
+        self.lock = lock
+        self.wait = histogram(buckets)
+        self.hold = histogram(buckets)
+        self.acquired_at = 0
+
+    def acquire(self):
+        start = time.time()
+        self.lock.acquire()
+        self.acquired_at = time.time()
+        self.wait.observe(self.acquired_at-start)
+
+    def release(self):
+        self.hold.observe(time.time()-self.acquired_at)
+        self.lock.release()
+
+clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+def process_group_cpu():
+    #returns {process group id: user+system CPU seconds of its processes}, from /proc/<pid>/stat
+    cpu = {}
+    try: pids = [pid for pid in os.listdir("/proc") if pid.isdigit()]
+    except OSError: return cpu #not on Linux
+    for pid in pids:
+        try:
+            f = open("/proc/%s/stat" % pid)
+            stat = f.read()
+            f.close()
+        except IOError: continue #it has exited meanwhile
+        fields = stat[stat.rfind(")")+2:].split(" ") #the name of the command may contain spaces
+        pgrp = int(fields[2])
+        cpu[pgrp] = cpu.get(pgrp, 0) + (int(fields[11])+int(fields[12]))/float(clock_ticks) #utime, stime
+    return cpu
+
+def format_value(value):
+    if isinstance(value, (int, long)): return str(value) #counters of bytes are too long for %g
+    return repr(float(value))
+
+def format_labels(labels):
+    return ",".join('%s="%s"' % (key, str(labels[key]).replace("\\", "\\\\").replace('"', '\\"')) for key in sorted(labels.keys()))
+
+class exposition:
+    # Collects the lines of the /metrics page. The lines of a metric have to be together, with its HELP and TYPE
+    # before them, so we keep them by metric, and join them at the end.
+
+    def __init__(self):
+        self.names = []
+        self.families = {} # name -> lines
+
+    def family(self, name, kind, help_text):
+        if name not in self.families:
+            self.names.append(name)
+            self.families[name] = ["# HELP %s %s" % (name, help_text), "# TYPE %s %s" % (name, kind)]
+        return self.families[name]
+
+    def add(self, name, kind, help_text, value, **labels):
+        label_text = format_labels(labels)
+        self.family(name, kind, help_text).append("%s%s %s" % (name, "{"+label_text+"}" if label_text else "", format_value(value)))
+
+    def add_histogram(self, name, help_text, histogram, **labels):
+        self.family(name, "histogram", help_text).extend(histogram.render(name, format_labels(labels)))
+
+    def render(self):
+        return "\n".join(line for name in self.names for line in self.families[name])+"\n"
@@ -0,0 +1,439 @@
+"""
+OpenWebRX npdsp plugin: do the signal processing in-process with NumPy
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import socket
+import threading
+import math
+import sys
+import traceback
+import csdr
+import shmring
+import demodshare
+
+try: import numpy
+except: numpy=None
+
+#How it works:
+#  - a worker thread per client reads the I/Q stream from nmux directly (no nc), and processes it block by block,
+#  - shift, lowpass filter and decimation are done in a single step in the frequency domain (see ddc below),
+#  - the rest runs at the IF sample rate, which is around output_rate,
+#  - the audio output and the smeter values are written into pipes, so read(), get_smeter_level() and poll_fds()
+#    work the same way as with the csdr plugin.
+
+def convert_input(data, format_conversion):
+    #returns complex64 samples from the raw I/Q stream, for the format_conversion commands we know
+    if format_conversion=="": samples=numpy.frombuffer(data, dtype=numpy.float32)
+    elif "convert_u8_f" in format_conversion: samples=(numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.float32)-127.5)/128
+    elif "convert_s8_f" in format_conversion: samples=numpy.frombuffer(data, dtype=numpy.int8).astype(numpy.float32)/128
+    elif "convert_s16_f" in format_conversion: samples=numpy.frombuffer(data, dtype=numpy.int16).astype(numpy.float32)/32768
+    else: raise ValueError("format_conversion is not supported by npdsp: "+format_conversion)
+    return samples.view(numpy.complex64) if len(samples)%2==0 else samples[:-1].view(numpy.complex64)
+
+def input_sample_size(format_conversion):
+    #bytes per I/Q sample
+    if format_conversion=="": return 8
+    elif "convert_s16_f" in format_conversion: return 4
+    return 2
+
+def lowpass_taps(cutoff, length):
+    #windowed sinc, cutoff is relative to the sample rate, DC gain is 1
+    t=numpy.arange(length)-(length-1)/2.0
+    taps=2*cutoff*numpy.sinc(2*cutoff*t)*numpy.hamming(length)
+    return taps/numpy.sum(taps)
+
+def smooth_decimation(samp_rate, output_rate):
+    #the largest decimation that keeps the IF rate above output_rate, and only has 2, 3 and 5 as prime factors (for the FFT)
+    decimation=max(1, int(samp_rate/output_rate))
+    while decimation>1:
+        rest=decimation
+        for factor in (2,3,5):
+            while rest%factor==0: rest/=factor
+        if rest==1: break
+        decimation-=1
+    return decimation
+
+class ddc:
+    # Shift, lowpass filter and decimate in one step, with fast convolution (overlap-save):
+    # we take the FFT of an input block, select the if_fft_size bins around the frequency we are tuned to,
+    # multiply them with the frequency response of the filter, and do a small inverse FFT on them.
+    # The shift is an integer number of bins this way, the rest of it is done at the IF rate.
+
+    def __init__(self, samp_rate, decimation, if_fft_size=256, if_overlap=64):
+        self.samp_rate=samp_rate
+        self.decimation=decimation
+        self.if_fft_size=if_fft_size
+        self.if_overlap=if_overlap
+        self.fft_size=decimation*if_fft_size
+        self.hop=decimation*(if_fft_size-if_overlap)
+        taps_length=decimation*if_overlap+1 #the first taps_length-1 samples of each block are lost to the overlap
+        taps=lowpass_taps(0.5/decimation-1.65/taps_length, taps_length)
+        self.bins=(numpy.fft.fftfreq(if_fft_size)*if_fft_size).astype(numpy.int64)
+        self.response=numpy.fft.fft(taps, self.fft_size)[self.bins%self.fft_size]/decimation
+        self.buffer=numpy.zeros(self.fft_size-self.hop, dtype=numpy.complex64)
+        self.block_phase=0.0
+        self.fine_phase=0.0
+        self.set_offset_freq(0)
+
+    def if_samp_rate(self):
+        return float(self.samp_rate)/self.decimation
+
+    def set_offset_freq(self, offset_freq):
+        self.bin_shift=int(round(float(offset_freq)/self.samp_rate*self.fft_size))
+        self.fine_shift=offset_freq-self.bin_shift*float(self.samp_rate)/self.fft_size
+
+    def process(self, samples):
+        self.buffer=numpy.concatenate((self.buffer, samples))
+        output=[]
+        bins=(self.bins+self.bin_shift)%self.fft_size
+        block_phase_step=-2*math.pi*self.bin_shift*self.hop/float(self.fft_size)
+        while len(self.buffer)>=self.fft_size:
+            spectrum=numpy.fft.fft(self.buffer[:self.fft_size])
+            block=numpy.fft.ifft(spectrum[bins]*self.response)[self.if_overlap:]
+            output.append(block*complex(math.cos(self.block_phase), math.sin(self.block_phase)))
+            self.block_phase=(self.block_phase+block_phase_step)%(2*math.pi)
+            self.buffer=self.buffer[self.hop:]
+        if not output: return numpy.zeros(0, dtype=numpy.complex64)
+        output=numpy.concatenate(output)
+        phase_step=-2*math.pi*self.fine_shift/self.if_samp_rate()
+        output*=numpy.exp(1j*(self.fine_phase+phase_step*numpy.arange(len(output))))
+        self.fine_phase=(self.fine_phase+phase_step*len(output))%(2*math.pi)
+        return output.astype(numpy.complex64)
+
+class fft_filter:
+    # FIR filter with overlap-save, for long filters (e.g. the bandpass filter) at the IF rate
+
+    def __init__(self, taps):
+        self.taps_length=len(taps)
+        self.fft_size=1
+        while self.fft_size<2*self.taps_length: self.fft_size*=2
+        self.hop=self.fft_size-self.taps_length+1
+        self.response=numpy.fft.fft(taps, self.fft_size)
+        self.buffer=numpy.zeros(self.taps_length-1, dtype=numpy.complex64)
+
+    def process(self, samples):
+        self.buffer=numpy.concatenate((self.buffer, samples))
+        output=[]
+        while len(self.buffer)>=self.fft_size:
+            output.append(numpy.fft.ifft(numpy.fft.fft(self.buffer[:self.fft_size])*self.response)[self.taps_length-1:])
+            self.buffer=self.buffer[self.hop:]
+        if not output: return numpy.zeros(0, dtype=numpy.complex64)
+        return numpy.concatenate(output).astype(numpy.complex64)
+
+class fir_filter:
+    # FIR filter with direct convolution, for short filters
+
+    def __init__(self, taps):
+        self.taps=numpy.array(taps, dtype=numpy.float32)
+        self.history=numpy.zeros(len(taps)-1, dtype=numpy.float32)
+
+    def process(self, samples):
+        samples=numpy.concatenate((self.history, samples))
+        self.history=samples[len(samples)-len(self.history):]
+        return numpy.convolve(samples, self.taps, mode="valid").astype(numpy.float32)
+
+def bandpass_filter(low_cut, high_cut, transition_bw, if_samp_rate):
+    #complex bandpass filter: a lowpass filter shifted to the middle of the passband
+    length=int(math.ceil(3.3*if_samp_rate/transition_bw))|1
+    taps=lowpass_taps((high_cut-low_cut)/2.0/if_samp_rate, length)
+    center=(low_cut+high_cut)/2.0/if_samp_rate
+    return fft_filter(taps*numpy.exp(2j*math.pi*center*numpy.arange(length)))
+
+class fractional_decimator:
+    # resampling with linear interpolation, like `csdr old_fractional_decimator_ff`
+
+    def __init__(self, rate):
+        self.rate=rate
+        self.position=0.0
+        self.last=numpy.zeros(1, dtype=numpy.float32)
+
+    def process(self, samples):
+        samples=numpy.concatenate((self.last, samples))
+        positions=numpy.arange(self.position, len(samples)-1, self.rate)
+        output=numpy.interp(positions, numpy.arange(len(samples)), samples).astype(numpy.float32)
+        self.position=(positions[-1]+self.rate if len(positions) else self.position)-(len(samples)-1)
+        self.last=samples[-1:]
+        return output
+
+class agc:
+    # peak following AGC: fast attack, slow decay, the gain is updated on every chunk of chunk_size samples
+
+    def __init__(self, reference=0.8, max_gain=1e5, decay_rate=0.0005, chunk_size=64):
+        self.reference=reference
+        self.max_gain=max_gain
+        self.decay_rate=decay_rate
+        self.chunk_size=chunk_size
+        self.gain=1.0
+        self.peak=0.0
+
+    def process(self, samples):
+        gains=numpy.empty(len(samples), dtype=numpy.float32)
+        for start in xrange(0, len(samples), self.chunk_size):
+            chunk=samples[start:start+self.chunk_size]
+            chunk_peak=float(numpy.max(numpy.abs(chunk))) if len(chunk) else 0.0
+            self.peak=max(chunk_peak, self.peak*(1-self.decay_rate*len(chunk)))
+            self.gain=min(self.reference/self.peak, self.max_gain) if self.peak>0 else self.max_gain
+            gains[start:start+self.chunk_size]=self.gain
+        return samples*gains
+
+ima_index_table=[-1, -1, -1, -1, 2, 4, 6, 8]*2
+ima_step_table=[7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66, 73, 80, 88, 97,
+    107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484,
+    7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767]
+
+class ima_adpcm_encoder(demodshare.audio_encoder):
+    # the same as `csdr encode_ima_adpcm_i16_u8`, coded by audioop in C (see demodshare.audio_encoder), from int16 arrays
+
+    def encode(self, samples):
+        return demodshare.audio_encoder.encode(self, samples.tostring())
+
+def ima_adpcm_decode(data):
+    #the inverse of ima_adpcm_encoder, starting from a reset state (as for each row of `csdr compress_fft_adpcm_f_u8`)
+    predictor=0
+    index=0
+    output=[]
+    for byte in bytearray(data):
+        for nibble in (byte&15, byte>>4):
+            step=ima_step_table[index]
+            delta=step>>3
+            if nibble&4: delta+=step
+            if nibble&2: delta+=step>>1
+            if nibble&1: delta+=step>>2
+            predictor=max(-32768, min(32767, predictor-delta if nibble&8 else predictor+delta))
+            index=max(0, min(88, index+ima_index_table[nibble]))
+            output.append(predictor)
+    return output
+
+class demodulator_chain:
+    # everything after the I/Q input: it is rebuilt when the demodulator or the sample rates change
+
+    def __init__(self, dsp):
+        self.ddc=ddc(dsp.samp_rate, dsp.decimation)
+        self.ddc.set_offset_freq(dsp.shift_freq())
+        self.if_samp_rate=self.ddc.if_samp_rate()
+        self.demodulator=dsp.demodulator
+        self.set_bpf(dsp.low_cut, dsp.high_cut, dsp.bpf_transition_bw)
+        self.decimator=fractional_decimator(self.if_samp_rate/dsp.output_rate)
+        self.agc=agc()
+        self.last_sample=numpy.complex64(0)
+        self.dc_level=0.0
+        #1st order lowpass at 300 Hz for deemphasis, truncated to a short FIR filter
+        alpha=math.exp(-2*math.pi*300/dsp.output_rate)
+        self.deemphasis=fir_filter((1-alpha)*alpha**numpy.arange(int(math.log(1e-4)/math.log(alpha))+1)) if self.demodulator=="nfm" else None
+        self.squelch_level=dsp.squelch_level
+
+    def set_bpf(self, low_cut, high_cut, transition_bw):
+        self.bpf=bandpass_filter(low_cut, high_cut, transition_bw, self.if_samp_rate)
+
+    def demodulate(self, samples):
+        if self.demodulator=="nfm":
+            previous=numpy.concatenate(([self.last_sample], samples[:-1]))
+            self.last_sample=samples[-1]
+            return (numpy.angle(samples*numpy.conj(previous))/math.pi).astype(numpy.float32)
+        elif self.demodulator=="am":
+            envelope=numpy.abs(samples)
+            self.dc_level=0.95*self.dc_level+0.05*float(numpy.mean(envelope))
+            return (envelope-self.dc_level).astype(numpy.float32)
+        else: #ssb: the bandpass filter has selected the sideband already
+            return samples.real.astype(numpy.float32)
+
+    def process(self, samples):
+        #returns (audio samples as float, power for the smeter)
+        samples=self.bpf.process(self.ddc.process(samples))
+        if not len(samples): return (numpy.zeros(0, dtype=numpy.float32), None)
+        power=float(numpy.mean(samples.real**2+samples.imag**2))
+        audio=self.decimator.process(self.demodulate(samples))
+        if self.deemphasis: audio=self.deemphasis.process(audio)
+        audio=numpy.clip(self.agc.process(audio), -1, 1)
+        if self.squelch_level>0 and power<self.squelch_level: audio[:]=0
+        return (audio, power)
+
+class dsp(csdr.dsp):
+    # The same interface as csdr.dsp (we inherit the setters and the calculation of the rates from it),
+    # but start() runs a worker thread instead of a csdr pipeline.
+
+    def __init__(self):
+        csdr.dsp.__init__(self)
+        self.name = "npdsp"
+        self.chain_lock = threading.Lock()
+        self.demodulator_chain = None
+        self.worker = None
+        self.sock = None
+        if not numpy: raise ImportError("NumPy is needed for the npdsp plugin")
+
+    def set_samp_rate(self,samp_rate):
+        csdr.dsp.set_samp_rate(self,samp_rate)
+        self.decimation=smooth_decimation(self.samp_rate, self.output_rate)
+        self.last_decimation=float(self.if_samp_rate())/self.output_rate
+
+    def shift_freq(self):
+        #offset of the frequency we are tuned to, from the center of the input
+        if self.channelizer and self.channel!=None: return self.offset_freq-self.channelizer.channel_center(self.channel)
+        return self.offset_freq
+
+    def set_offset_freq(self,offset_freq):
+        self.offset_freq=offset_freq
+        if self.running:
+            if not self.select_channel():
+                self.restart()
+                return
+            self.chain_lock.acquire()
+            self.demodulator_chain.ddc.set_offset_freq(self.shift_freq())
+            self.chain_lock.release()
+
+    def set_bpf(self,low_cut,high_cut):
+        self.low_cut=low_cut
+        self.high_cut=high_cut
+        if self.running:
+            if not self.select_channel():
+                self.restart()
+                return
+            self.chain_lock.acquire()
+            self.demodulator_chain.set_bpf(low_cut, high_cut, self.bpf_transition_bw)
+            self.chain_lock.release()
+
+    def set_squelch_level(self, squelch_level):
+        self.squelch_level=squelch_level
+        if self.running: self.demodulator_chain.squelch_level=squelch_level
+
+    def set_demodulator(self,demodulator):
+        self.demodulator=demodulator
+        if self.running:
+            self.chain_lock.acquire()
+            self.demodulator_chain=demodulator_chain(self) #the worker picks it up with the next block
+            self.chain_lock.release()
+
+    def set_secondary_demodulator(self, what):
+        if what: print "[openwebrx-dsp-plugin:npdsp] digimodes are not supported by this plugin yet"
+
+    def start(self):
+        self.select_channel()
+        self.demodulator_chain=demodulator_chain(self)
+        self.encoder=ima_adpcm_encoder() if self.audio_compression=="adpcm" else None
+        audio_r, self.audio_w = os.pipe()
+        smeter_r, self.smeter_w = os.pipe()
+        self.audio_file=os.fdopen(audio_r, "rb")
+        self.smeter_pipe="(internal)" #so that poll_fds() knows we have it
+        self.smeter_pipe_file=os.fdopen(smeter_r, "r")
+        self.set_pipe_nonblocking(self.smeter_pipe_file)
+        self.set_pipe_nonblocking(self.smeter_w) #we'd rather lose smeter values than block on them
+        self.sock=shmring.open_iq_stream(self.nc_port, self.iq_shm_path if self.channel==None else None) #the channels of the channelizer come from nmux
+        print "[openwebrx-dsp-plugin:npdsp] started, demodulator = %s, decimation = %d, if_samp_rate = %g"%(self.demodulator, self.decimation, self.if_samp_rate())
+        self.running = True
+        self.worker=threading.Thread(target=self.worker_function, args=(self.sock, self.audio_w, self.smeter_w))
+        self.worker.daemon=True
+        self.worker.start()
+
+    def worker_function(self, sock, audio_w, smeter_w):
+        sample_size=input_sample_size(self.format_conversion)
+        leftover=""
+        try:
+            while self.running:
+                data=sock.recv(65536) #from the ring buffer, this is a buffer object pointing into it, not a copy
+                if not data: break
+                if leftover: data=leftover+str(data)
+                usable=len(data)-len(data)%sample_size
+                leftover=data[usable:]
+                if usable<len(data): data=data[:usable] #the ring buffer returns whole samples, we only cut the data from nmux
+                self.chain_lock.acquire()
+                try: audio, power = self.demodulator_chain.process(convert_input(data, self.format_conversion))
+                finally: self.chain_lock.release()
+                if power!=None:
+                    try: os.write(smeter_w, "%g\n"%power)
+                    except OSError: pass
+                audio=(audio*32767).astype(numpy.int16)
+                output=self.encoder.encode(audio) if self.encoder else audio.tostring()
+                while output: #write() blocks if the client does not read, just like with csdr
+                    output=output[os.write(audio_w, output):]
+        except (OSError, socket.error):
+            pass #we have been stopped
+        except:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            print "[openwebrx-dsp-plugin:npdsp] worker error:", exc_type, exc_value
+            traceback.print_tb(exc_traceback)
+        finally:
+            for fd in (audio_w, smeter_w):
+                try: os.close(fd)
+                except OSError: pass
+
+    def read(self,size):
+        return self.audio_file.read(size)
+
+    def poll_fds(self):
+        if not self.running: return {}
+        return {"audio": self.audio_file.fileno(), "smeter": self.smeter_pipe_file.fileno()}
+
+    def process_groups(self):
+        return [] #we run in a thread of OpenWebRX
+
+    def stop(self):
+        if not self.running: return
+        self.running = False
+        if isinstance(self.sock, socket.socket): #a ring_reader is not closed, the worker may still be using its buffers
+            try: self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error: pass
+            self.sock.close()
+        self.audio_file.close() #the worker gets EPIPE if it is blocked on writing
+        self.smeter_pipe_file.close()
+
+    def __del__(self):
+        self.stop()
+
+if __name__=="__main__":
+    #benchmark: samples/s per core for npdsp, and for the equivalent csdr chain if csdr is installed
+    import time, subprocess, tempfile
+    samp_rate=int(sys.argv[1]) if len(sys.argv)>1 else 2400000
+    seconds=5
+    raw=numpy.random.randint(0, 256, samp_rate*2*seconds).astype(numpy.uint8).tostring()
+    for demodulator in ("nfm", "am", "ssb"):
+        d=dsp()
+        d.set_demodulator(demodulator)
+        d.set_samp_rate(samp_rate)
+        d.set_offset_freq(samp_rate/7)
+        chain=demodulator_chain(d)
+        encoder=ima_adpcm_encoder()
+        start=time.clock()
+        for i in xrange(0, len(raw), 65536):
+            audio, power = chain.process(convert_input(raw[i:i+65536], "csdr convert_u8_f"))
+            encoder.encode((audio*32767).astype(numpy.int16))
+        cpu=time.clock()-start
+        print "npdsp %s: %.2f Msamples/s per core (%.1f%% of a core at %d samples/s)"%(demodulator, samp_rate*seconds/cpu/1e6, 100*cpu/seconds, samp_rate)
+    if os.system("csdr 2> /dev/null") == 32512:
+        print "csdr is not installed, skipping the benchmark of the csdr chain"
+    else:
+        iqfile=tempfile.NamedTemporaryFile()
+        iqfile.write(raw)
+        iqfile.flush()
+        for demodulator in ("nfm", "am", "ssb"):
+            d=csdr.dsp()
+            d.set_demodulator(demodulator)
+            d.set_samp_rate(samp_rate)
+            d.set_audio_compression("adpcm")
+            command=d.chain(demodulator).replace("nc -v 127.0.0.1 {nc_port}", "cat "+iqfile.name)
+            command=command.replace("--fifo {shift_pipe}", str(-1.0/7)).replace("--fifo {bpf_pipe}", "-0.01 0.01").replace("squelch_and_smeter_cc --fifo {squelch_pipe} --outfifo {smeter_pipe} 5 1", "through")
+            command=command.format(decimation=d.decimation, ddc_transition_bw=d.ddc_transition_bw(), bpf_transition_bw=float(d.bpf_transition_bw)/d.if_samp_rate(), last_decimation=d.last_decimation)
+            before=os.times()
+            subprocess.call(command+" > /dev/null", shell=True)
+            after=os.times()
+            cpu=(after[2]+after[3])-(before[2]+before[3])
+            print "csdr %s: %.2f Msamples/s per core (%.1f%% of a core at %d samples/s)"%(demodulator, samp_rate*seconds/cpu/1e6, 100*cpu/seconds, samp_rate)
@@ -47,6 +47,24 @@ import ctypes
 
 #import rtl_mus
 import rxws
+import fanout
+import spectrum
+import pacer
+import metrics
+import static
+import registry
+import channelizer
+import chainpool
+import digimodes
+import demodshare
+import skimmer
+import shmring
+import iqfile
+import evloop
+import workers
+import admission
+import governor
+import affinity
 import uuid
 import signal
 import socket
@@ -74,7 +92,14 @@ def import_all_plugins(directory):
 """
 
 class MultiThreadHTTPServer(ThreadingMixIn, HTTPServer):
-    pass
+    handed_over=set() #requests whose socket has been handed over to the event loop or a worker process
+
+    def shutdown_request(self, request):
+        #a shutdown() would close the connection in the process that has got the socket, too
+        if request in self.handed_over:
+            self.handed_over.discard(request)
+            self.close_request(request)
+        else: HTTPServer.shutdown_request(self, request)
 
 def handle_signal(sig, frame):
     global spectrum_dsp
@@ -82,12 +107,15 @@ def handle_signal(sig, frame):
         print "[openwebrx] Verbose status information on USR1 signal"
         print
         print "time.time() =", time.time()
-        print "clients_mutex.locked() =", clients_mutex.locked()
-        print "clients_mutex_locker =", clients_mutex_locker
         if server_fail: print "server_fail = ", server_fail
         print "spectrum_thread_watchdog_last_tick =", spectrum_thread_watchdog_last_tick
         print
         print "clients:",len(clients)
+        if demodulator_service: print "shared demodulators: %d chains for %d clients" % demodulator_service.counts()
+        if worker_pool: print "clients of the worker processes:", worker_pool.client_counts()
+        if process_scheduler:
+            print "process groups (pgid, chain, kind, cores, nice):"
+            for placement in process_scheduler.placements(): print "\t%d\t%s\t%s\t%s\t%d" % placement
         for client in clients:
             print
             for key in client._fields:
@@ -97,7 +125,13 @@ def handle_signal(sig, frame):
     else:
         print "[openwebrx] Ctrl+C: aborting."
         cleanup_clients(True)
+        if worker_pool: worker_pool.stop()
         spectrum_dsp.stop()
+        if shared_channelizer: shared_channelizer.stop()
+        if demodulator_pool: demodulator_pool.stop()
+        if digimode_decoders: digimode_decoders.stop()
+        if demodulator_service: demodulator_service.stop()
+        if skimmer_service: skimmer_service.stop()
         os._exit(1) #not too graceful exit
 
 def access_log(data):
@@ -105,11 +139,24 @@ def access_log(data):
     logs.access_log.write("["+datetime.datetime.now().isoformat()+"] "+data+"\n")
     logs.access_log.flush()
 
-receiver_failed=spectrum_thread_watchdog_last_tick=rtl_thread=spectrum_dsp=server_fail=None
+receiver_failed=spectrum_thread_watchdog_last_tick=rtl_thread=spectrum_dsp=server_fail=shared_channelizer=ws_loop=dsp_plugin=None
+evented_sessions=[] #only accessed from the thread of ws_loop
+spectrum_ring=spectrum_pyramid=None
+spectrum_frame_interval=spectrum_frame_jitter=None #histograms for /metrics
+static_cache=None
+demodulator_pool=digimode_decoders=demodulator_service=skimmer_service=None
+iq_shm_path=None #set if the I/Q samples come from a shared memory ring buffer, see shmring.py
+iq_recorder=None
+worker_pool=None #in the main process of the "workers" server_mode
+worker_link=None #in a worker process
+admission_control=None
+overload_governor=None #in the main process
+overload_level=governor.LEVEL_NORMAL #in every process, the sessions follow it
+process_scheduler=None #affinity.scheduler, if csdr_scheduling is on
 
 def main():
-    global clients, clients_mutex, pypy, lock_try_time, avatar_ctime, cfg, logs
-    global serverfail, rtl_thread
+    global clients, pypy, avatar_ctime, cfg, logs
+    global serverfail, rtl_thread, shared_channelizer, ws_loop, spectrum_ring, spectrum_pyramid, dsp_plugin, static_cache, demodulator_pool, digimode_decoders, demodulator_service, skimmer_service, iq_shm_path, iq_recorder, worker_pool, admission_control, overload_governor, process_scheduler
     print
     print "OpenWebRX - Open Source SDR Web App for Everyone!  | for license see LICENSE file in the package"
     print "_________________________________________________________________________________________________"
@@ -120,8 +167,16 @@ def main():
     no_arguments=len(sys.argv)==1
     if no_arguments: print "[openwebrx-main] Configuration script not specified. I will use: \"config_webrx.py\""
     cfg=__import__("config_webrx" if no_arguments else sys.argv[1])
-    for option in ("access_log","csdr_dynamic_bufsize","csdr_print_bufsizes","csdr_through"):
-        if not option in dir(cfg): setattr(cfg, option, False) #initialize optional config parameters
+    for option, default in (("access_log",False),("csdr_dynamic_bufsize",False),("csdr_print_bufsizes",False),("csdr_through",False), \
+            ("shared_channelizer",False),("channelizer_channels",8),("channelizer_max_passband",12000),("channelizer_base_port",4952),("channelizer_nmux_memory",10), \
+            ("server_mode","threaded"),("ws_workers",0),("cpu_budget",0),("admission_queue_length",5),("admission_queue_timeout",20), \
+            ("overload_governor",False),("overload_cpu_high",0.9),("overload_cpu_low",0.7), \
+            ("csdr_scheduling",False),("iq_cores",[0]),("chain_cores",[]),("csdr_nice",{}), \
+            ("fft_ring_rows",64),("dsp_plugin","csdr"),("fft_pyramid_levels",1),("fft_delta_codec",False),("fft_latency_budget",0.5),("metrics_enable",False), \
+            ("csdr_chain_pool_size",1),("digimodes_shared",False),("demodulators_shared",False),("skimmer_enable",False),("skimmer_max_channels",32), \
+            ("iq_distribution","nmux"),("iq_shm_path","/dev/shm/openwebrx-iq"), \
+            ("iq_replay_file",None),("iq_replay_speed",1.0),("iq_replay_loop",True),("iq_record_seconds",0),("iq_record_dir","/tmp")):
+        if not option in dir(cfg): setattr(cfg, option, default) #initialize optional config parameters
 
     #Open log files
     logs = type("logs_class", (object,), {"access_log":open(cfg.access_log if cfg.access_log else "/dev/null","a"), "error_log":""})()
@@ -144,14 +199,67 @@ def main():
     except:
         pass
 
-    #Start rtl thread
+    #Load the DSP plugin for the demodulators of the clients (the spectrum is always done by csdr)
+    dsp_plugin=__import__(cfg.dsp_plugin)
+    print "[openwebrx-main] DSP plugin:", cfg.dsp_plugin
+    if cfg.csdr_chain_pool_size>0: demodulator_pool=chainpool.chain_pool(cfg.csdr_chain_pool_size)
+    if cfg.csdr_scheduling: process_scheduler=affinity.scheduler(cfg.iq_cores, cfg.chain_cores, cfg.csdr_nice)
+
+    #Check for csdr
     if os.system("csdr 2> /dev/null") == 32512: #check for csdr
         print "[openwebrx-main] You need to install \"csdr\" to run OpenWebRX!\n"
         return
     if os.system("nmux --help 2> /dev/null") == 32512: #check for nmux
         print "[openwebrx-main] You need to install an up-to-date version of \"csdr\" that contains the \"nmux\" tool to run OpenWebRX! Please upgrade \"csdr\"!\n"
         return
-    if cfg.start_rtl_thread:
+    if cfg.iq_replay_file:
+        replay_format=iqfile.format_of_file(cfg.iq_replay_file)
+        if replay_format: cfg.format_conversion=replay_format[0]
+        else: print "[openwebrx-main] The format of %s is not known from its extension, I will use format_conversion." % cfg.iq_replay_file
+        cfg.start_rtl_command=iqfile.player_command(cfg.iq_replay_file, cfg.samp_rate, iqfile.sample_size_of_format(cfg.format_conversion), cfg.iq_replay_speed, cfg.iq_replay_loop)
+        cfg.start_rtl_thread=True
+    if cfg.iq_distribution=="shm": iq_shm_path=cfg.iq_shm_path
+
+    #Set up the shared channelizer (it is started with the I/Q server, the DSPs of the workers need its settings)
+    if cfg.shared_channelizer:
+        shared_channelizer=channelizer.channelizer()
+        shared_channelizer.samp_rate=cfg.samp_rate
+        shared_channelizer.channel_count=cfg.channelizer_channels
+        shared_channelizer.max_passband=cfg.channelizer_max_passband
+        shared_channelizer.nc_port=cfg.iq_server_port
+        shared_channelizer.iq_shm_path=iq_shm_path
+        shared_channelizer.base_port=cfg.channelizer_base_port
+        shared_channelizer.format_conversion=cfg.format_conversion
+        shared_channelizer.nmux_memory=cfg.channelizer_nmux_memory
+        shared_channelizer.scheduler=process_scheduler
+
+    #Set up shared digimode decoders
+    if cfg.digimodes_enable and cfg.digimodes_shared: digimode_decoders=digimodes.decoder_service(make_decoder_dsp, cfg.shown_center_freq)
+
+    #Set up the service of the shared demodulators (they are started when the clients ask for them)
+    if cfg.demodulators_shared: demodulator_service=demodshare.demodulator_service(make_demodulator_dsp, on_shared_audio)
+
+    #Initialize clients
+    clients=registry.client_registry()
+    if cfg.overload_governor: overload_governor=governor.overload_governor(cfg.overload_cpu_high, cfg.overload_cpu_low)
+    if cfg.cpu_budget>0: admission_control=admission.admission_controller(cfg.cpu_budget, cfg.admission_queue_length, cfg.admission_queue_timeout)
+
+    spectrum_ring=fanout.ring_buffer(cfg.fft_ring_rows)
+    if cfg.fft_pyramid_levels>1:
+        spectrum_pyramid=spectrum.spectrum_pyramid(cfg.fft_size, cfg.fft_pyramid_levels, cfg.fft_compression, cfg.fft_delta_codec)
+        print "[openwebrx-main] Spectrum pyramid levels:", spectrum_pyramid.level_sizes
+
+    #Start worker processes for the WebSocket clients. They are forked before any thread or child process is started:
+    #a thread could hold a lock (of stdout, of the imports...) at the fork, and the child would wait for it forever.
+    if cfg.server_mode=="workers": worker_pool=workers.worker_pool(cfg.ws_workers, worker_main)
+
+    #Start rtl thread
+    if cfg.start_rtl_thread and iq_shm_path:
+        cfg.start_rtl_command += "| "+shmring.writer_command(iq_shm_path, shmring.ring_size(cfg.nmux_memory))
+        rtl_thread=threading.Thread(target = start_rtl_command,  args=())
+        rtl_thread.start()
+        print "[openwebrx-main] Started rtl_thread: "+cfg.start_rtl_command
+    elif cfg.start_rtl_thread:
         nmux_bufcnt = nmux_bufsize = 0
         while nmux_bufsize < cfg.samp_rate/4: nmux_bufsize += 4096
         while nmux_bufsize * nmux_bufcnt < cfg.nmux_memory * 1e6: nmux_bufcnt += 1
@@ -160,11 +268,12 @@ def main():
             return
         print "[openwebrx-main] nmux_bufsize = %d, nmux_bufcnt = %d" % (nmux_bufsize, nmux_bufcnt)
         cfg.start_rtl_command += "| nmux --bufsize %d --bufcnt %d --port %d --address 127.0.0.1" % (nmux_bufsize, nmux_bufcnt, cfg.iq_server_port)
-        rtl_thread=threading.Thread(target = lambda:subprocess.Popen(cfg.start_rtl_command, shell=True),  args=())
+        rtl_thread=threading.Thread(target = start_rtl_command,  args=())
         rtl_thread.start()
         print "[openwebrx-main] Started rtl_thread: "+cfg.start_rtl_command
     print "[openwebrx-main] Waiting for I/Q server to start..."
-    while True:
+    if iq_shm_path: shmring.wait_for_writer(iq_shm_path)
+    while not iq_shm_path:
         testsock=socket.socket()
         try: testsock.connect(("127.0.0.1", cfg.iq_server_port))
         except:
@@ -173,28 +282,32 @@ def main():
         testsock.close()
         break
     print "[openwebrx-main] I/Q server started."
+    if cfg.iq_record_seconds>0: iq_recorder=iqfile.recorder(cfg.iq_server_port, iq_shm_path, cfg.samp_rate, cfg.shown_center_freq, cfg.format_conversion, cfg.iq_record_seconds, cfg.iq_record_dir)
 
-    #Initialize clients
-    clients=[]
-    clients_mutex=threading.Lock()
-    lock_try_time=0
-
-    #Start watchdog thread
-    print "[openwebrx-main] Starting watchdog threads."
-    mutex_test_thread=threading.Thread(target = mutex_test_thread_function, args = ())
-    mutex_test_thread.start()
-    mutex_watchdog_thread=threading.Thread(target = mutex_watchdog_thread_function, args = ())
-    mutex_watchdog_thread.start()
-
+    #Start shared channelizer
+    if shared_channelizer:
+        shared_channelizer.start()
+        print "[openwebrx-main] Shared channelizer started."
 
     #Start spectrum thread
     print "[openwebrx-main] Starting spectrum thread."
     spectrum_thread=threading.Thread(target = spectrum_thread_function, args = ())
     spectrum_thread.start()
+
+    #Start PSK31 skimmer
+    if cfg.skimmer_enable:
+        if not skimmer.numpy: print "[openwebrx-main] You need to install NumPy to use the skimmer, it is disabled now."
+        else:
+            skimmer_service=skimmer.skimmer_service(cfg.iq_server_port, iq_shm_path, cfg.samp_rate, cfg.shown_center_freq, cfg.format_conversion, cfg.skimmer_max_channels, \
+                spectrum_ring, "none" if spectrum_pyramid else cfg.fft_compression)
+            skimmer_service.scheduler=process_scheduler
+            skimmer_service.start()
+    if worker_pool: worker_pool.start(spectrum_ring, skimmer_service.ring if skimmer_service else None, on_worker_client_closed)
     #spectrum_watchdog_thread=threading.Thread(target = spectrum_watchdog_thread_function, args = ())
     #spectrum_watchdog_thread.start()
 
     get_cpu_usage()
+    if admission_control: threading.Thread(target = admission_thread_function, args = ()).start()
     bcastmsg_thread=threading.Thread(target = bcastmsg_thread_function, args = ())
     bcastmsg_thread.start()
 
@@ -207,6 +320,38 @@ def main():
         sdrhu_thread=threading.Thread(target = sdrhu.run, args = ())
         sdrhu_thread.start()
 
+    #Start event loop for WebSocket clients
+    if cfg.server_mode=="evented":
+        print "[openwebrx-main] Starting WebSocket event loop."
+        ws_loop=evloop.event_loop()
+        ws_loop.start()
+
+    #Load htdocs, and fill in the .wrx templates with the configuration
+    static_cache=static.static_files("htdocs", (
+        ("%[RX_PHOTO_DESC]",cfg.photo_desc),
+        ("%[WS_URL]","ws://"+cfg.server_hostname+":"+str(cfg.web_port)+"/ws/"),
+        ("%[RX_TITLE]",cfg.receiver_name),
+        ("%[RX_LOC]",cfg.receiver_location),
+        ("%[RX_QRA]",cfg.receiver_qra),
+        ("%[RX_ASL]",str(cfg.receiver_asl)),
+        ("%[RX_GPS]",str(cfg.receiver_gps[0])+","+str(cfg.receiver_gps[1])),
+        ("%[RX_PHOTO_HEIGHT]",str(cfg.photo_height)),("%[RX_PHOTO_TITLE]",cfg.photo_title),
+        ("%[RX_ADMIN]",cfg.receiver_admin),
+        ("%[RX_ANT]",cfg.receiver_ant),
+        ("%[RX_DEVICE]",cfg.receiver_device),
+        ("%[AUDIO_BUFSIZE]",str(cfg.client_audio_buffer_size)),
+        ("%[START_OFFSET_FREQ]",str(cfg.start_freq-cfg.center_freq)),
+        ("%[START_MOD]",cfg.start_mod),
+        ("%[WATERFALL_COLORS]",cfg.waterfall_colors),
+        ("%[WATERFALL_MIN_LEVEL]",str(cfg.waterfall_min_level)),
+        ("%[WATERFALL_MAX_LEVEL]",str(cfg.waterfall_max_level)),
+        ("%[WATERFALL_AUTO_LEVEL_MARGIN]","[%d,%d]"%cfg.waterfall_auto_level_margin),
+        ("%[DIGIMODES_ENABLE]",("true" if cfg.digimodes_enable else "false")),
+        ("%[MATHBOX_WATERFALL_FRES]",str(cfg.mathbox_waterfall_frequency_resolution)),
+        ("%[MATHBOX_WATERFALL_THIST]",str(cfg.mathbox_waterfall_history_length)),
+        ("%[MATHBOX_WATERFALL_COLORS]",cfg.mathbox_waterfall_colors)
+    ))
+
     #Start HTTP thread
     httpd = MultiThreadHTTPServer(('', cfg.web_port), WebRXHandler)
     print('[openwebrx-main] Starting HTTP server.')
@@ -224,47 +369,32 @@ def measure_thread_function():
         time.sleep(1)
 
 def bcastmsg_thread_function():
-    global clients
+    global clients, overload_level
     while True:
         time.sleep(3)
         try: cpu_usage=get_cpu_usage()
         except: cpu_usage=0
-        cma("bcastmsg_thread")
-        for i in range(0,len(clients)):
-            clients[i].bcastmsg="MSG cpu_usage={0} clients={1}".format(int(cpu_usage*100),len(clients))
-        cmr()
+        if overload_governor:
+            pacers=[client.fft_pacer for client in clients if client.fft_pacer]
+            lagging=float(sum(1 for pacer in pacers if pacer.lagging()))/len(pacers) if pacers else 0
+            if overload_governor.update(cpu_usage, lagging)!=None: overload_level=overload_governor.level #the sessions pick it up
+        bcastmsg="MSG cpu_usage={0} clients={1} overload_level={2}".format(int(cpu_usage*100),len(clients),overload_level)
+        for client in clients:
+            client.bcastmsg=bcastmsg
+        if ws_loop: ws_loop.call_soon_threadsafe(evented_sessions_tick)
+        if worker_pool: worker_pool.broadcast(bcastmsg)
 
-def mutex_test_thread_function():
-    global clients_mutex, lock_try_time
-    while True:
-        time.sleep(0.5)
-        lock_try_time=time.time()
-        clients_mutex.acquire()
-        clients_mutex.release()
-        lock_try_time=0
-
-def cma(what): #clients_mutex acquire
-    global clients_mutex
-    global clients_mutex_locker
-    if not clients_mutex.locked(): clients_mutex_locker = what
-    clients_mutex.acquire()
-
-def cmr():
-    global clients_mutex
-    global clients_mutex_locker
-    clients_mutex_locker = None
-    clients_mutex.release()
-
-def mutex_watchdog_thread_function():
-    global lock_try_time
-    global clients_mutex_locker
-    global clients_mutex
+def admission_thread_function():
+    #measures the load for the admission control, and the CPU used by the DSP of each client to learn the costs
     while True:
-        if lock_try_time != 0 and time.time()-lock_try_time > 3.0:
-            #if 3 seconds pass without unlock
-            print "[openwebrx-mutex-watchdog] Mutex unlock timeout. Locker: \""+str(clients_mutex_locker)+"\" Now unlocking..."
-            clients_mutex.release()
-        time.sleep(0.5)
+        cpu=metrics.process_group_cpu()
+        sessions=[]
+        for client in clients:
+            dsp=client.dsp
+            pgids=dsp.process_groups() if dsp and dsp.running else None
+            if pgids: sessions.append((client.id, dsp.get_demodulator(), dsp.get_secondary_demodulator(), sum(cpu.get(pgid, 0) for pgid in pgids)))
+        admission_control.update(sessions)
+        time.sleep(admission.UPDATE_INTERVAL)
 
 def spectrum_watchdog_thread_function():
     global spectrum_thread_watchdog_last_tick, receiver_failed
@@ -281,14 +411,52 @@ def check_server():
     if server_fail: return server_fail
     #print spectrum_dsp.process.poll()
     if spectrum_dsp and spectrum_dsp.process.poll()!=None: server_fail = "spectrum_thread dsp subprocess failed"
+    if shared_channelizer and shared_channelizer.failed(): server_fail = "shared channelizer subprocess failed"
     #if rtl_thread and not rtl_thread.is_alive(): server_fail = "rtl_thread failed"
     if server_fail: print "[openwebrx-check_server] >>>>>>> ERROR:", server_fail
     return server_fail
 
+def start_rtl_command():
+    #the SDR reader and nmux (or the writer of the shared memory ring buffer) go on the I/Q cores, see affinity.py.
+    #It stays in our process group, so that Ctrl+C stops it too.
+    if not process_scheduler: return subprocess.Popen(cfg.start_rtl_command, shell=True)
+    process=subprocess.Popen(cfg.start_rtl_command, shell=True, preexec_fn=process_scheduler.preexec(None, "iq", False))
+    process_scheduler.placed(None, "rtl", "iq", process.pid)
+
 def apply_csdr_cfg_to_dsp(dsp):
     dsp.csdr_dynamic_bufsize = cfg.csdr_dynamic_bufsize
     dsp.csdr_print_bufsizes = cfg.csdr_print_bufsizes
     dsp.csdr_through = cfg.csdr_through
+    dsp.chain_pool = demodulator_pool
+    dsp.iq_shm_path = iq_shm_path
+    dsp.scheduler = process_scheduler
+
+def make_decoder_dsp():
+    #for the shared digimode decoders, set up like the DSP of a client
+    dsp=csdr.dsp()
+    dsp.set_format_conversion(cfg.format_conversion)
+    dsp.nc_port=cfg.iq_server_port
+    if shared_channelizer: dsp.set_channelizer(shared_channelizer)
+    else: dsp.set_samp_rate(cfg.samp_rate)
+    apply_csdr_cfg_to_dsp(dsp)
+    dsp.label="digimode decoder"
+    return dsp
+
+def make_demodulator_dsp():
+    #for the shared demodulators, set up like the DSP of a client, but the audio is encoded for each client (see demodshare.py)
+    dsp=dsp_plugin.dsp()
+    dsp.set_audio_compression("none")
+    dsp.set_format_conversion(cfg.format_conversion)
+    dsp.nc_port=cfg.iq_server_port
+    if shared_channelizer: dsp.set_channelizer(shared_channelizer)
+    else: dsp.set_samp_rate(cfg.samp_rate)
+    apply_csdr_cfg_to_dsp(dsp)
+    dsp.label="shared demodulator"
+    return dsp
+
+def spectrum_fft_averages():
+    averages=int(round(1.0 * cfg.samp_rate / cfg.fft_size / cfg.fft_fps / (1.0 - cfg.fft_voverlap_factor))) if cfg.fft_voverlap_factor>0 else 0
+    return governor.fft_averages(averages, overload_level)
 
 def spectrum_thread_function():
     global clients, spectrum_dsp, spectrum_thread_watchdog_last_tick
@@ -298,10 +466,11 @@ def spectrum_thread_function():
     dsp.set_samp_rate(cfg.samp_rate)
     dsp.set_fft_size(cfg.fft_size)
     dsp.set_fft_fps(cfg.fft_fps)
-    dsp.set_fft_averages(int(round(1.0 * cfg.samp_rate / cfg.fft_size / cfg.fft_fps / (1.0 - cfg.fft_voverlap_factor))) if cfg.fft_voverlap_factor>0 else 0)
-    dsp.set_fft_compression(cfg.fft_compression)
+    dsp.set_fft_averages(spectrum_fft_averages())
+    dsp.set_fft_compression("none" if spectrum_pyramid else cfg.fft_compression) #the pyramid is made from the rows as float
     dsp.set_format_conversion(cfg.format_conversion)
     apply_csdr_cfg_to_dsp(dsp)
+    dsp.label="spectrum"
     sleep_sec=0.87/cfg.fft_fps
     print "[openwebrx-spectrum] Spectrum thread initialized successfully."
     dsp.start()
@@ -311,91 +480,636 @@ def spectrum_thread_function():
     print "[openwebrx-spectrum] Spectrum thread started."
     bytes_to_read=int(dsp.get_fft_bytes_to_read())
     spectrum_thread_counter=0
+    global spectrum_frame_interval, spectrum_frame_jitter
+    frame_interval=1.0/cfg.fft_fps
+    spectrum_frame_interval=metrics.histogram([frame_interval*x for x in (0.5, 0.8, 0.9, 0.95, 1.05, 1.1, 1.2, 1.5, 2, 5)])
+    spectrum_frame_jitter=metrics.histogram([0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1])
+    last_frame_time=None
     while True:
+        if overload_governor and dsp.fft_averages!=spectrum_fft_averages():
+            print "[openwebrx-spectrum] Restarting with fft_averages =", spectrum_fft_averages()
+            dsp.stop()
+            dsp.set_fft_averages(spectrum_fft_averages())
+            dsp.start()
+            if cfg.csdr_dynamic_bufsize: dsp.read(8)
         data=dsp.read(bytes_to_read)
+        now=time.time()
+        if last_frame_time:
+            spectrum_frame_interval.observe(now-last_frame_time)
+            spectrum_frame_jitter.observe(abs(now-last_frame_time-frame_interval))
+        last_frame_time=now
         #print "gotcha",len(data),"bytes of spectrum data via spectrum_thread_function()"
         if spectrum_thread_counter >= cfg.fft_fps:
             spectrum_thread_counter=0
             spectrum_thread_watchdog_last_tick = time.time() #once every second
         else: spectrum_thread_counter+=1
-        cma("spectrum_thread")
-        correction=0
-        for i in range(0,len(clients)):
-            i-=correction
-            if (clients[i].ws_started):
-                if clients[i].spectrum_queue.full():
-                    print "[openwebrx-spectrum] client spectrum queue full, closing it."
-                    close_client(i, False)
-                    correction+=1
-                else:
-                    clients[i].spectrum_queue.put([data]) # add new string by "reference" to all clients
-        cmr()
-
-def get_client_by_id(client_id, use_mutex=True):
-    global clients
-    output=-1
-    if use_mutex: cma("get_client_by_id")
-    for i in range(0,len(clients)):
-        if(clients[i].id==client_id):
-            output=i
-            break
-    if use_mutex: cmr()
-    if output==-1:
+        if spectrum_pyramid and not worker_pool: data=spectrum_pyramid.make_row(data) #once for all clients (the workers do it from the float rows)
+        spectrum_ring.publish(data) # clients read it from here, each one at its own pace
+        if ws_loop: ws_loop.call_soon_threadsafe(evented_sessions_tick)
+        if worker_pool: worker_pool.notify()
+
+def get_client_by_id(client_id):
+    client=clients.get(client_id)
+    if client==None:
         raise ClientNotFoundException
-    else:
-        return output
+    return client
 
 def log_client(client, what):
     print "[openwebrx-httpd] client {0}#{1} :: {2}".format(client.ip,client.id,what)
 
+def render_metrics():
+    m=metrics.exposition()
+    cpu=metrics.process_group_cpu()
+    cpu_help="CPU time used by the csdr processes."
+    dropped_help="FFT rows not sent to the client: by the pacer, or because it had lagged behind the ring buffer."
+    m.add("openwebrx_clients", "gauge", "Number of clients.", len(clients))
+    if admission_control: admission_control.add_metrics(m)
+    if overload_governor:
+        m.add("openwebrx_overload_level", "gauge", "Features stepped down by the overload governor (see governor.py).", overload_governor.level)
+        m.add("openwebrx_overload_level_changes_total", "counter", "Level changes of the overload governor.", overload_governor.changes)
+    if worker_pool:
+        for index, client_count in worker_pool.client_counts():
+            m.add("openwebrx_worker_clients", "gauge", "WebSocket clients served by the worker process.", client_count, worker=str(index))
+    times=os.times()
+    m.add("process_cpu_seconds_total", "counter", "CPU time used by the OpenWebRX process (npdsp demodulators included).", times[0]+times[1])
+    for client in clients:
+        label=client.id[:8]
+        m.add("openwebrx_client_loopstat", "gauge", "Where the client thread has been last (see the loopstat values in openwebrx.py).", client.loopstat, client=label)
+        writer=client.ws_writer
+        if writer:
+            by_type={}
+            for begin_id, (frames, size) in writer.sent_by_id.items():
+                stats=by_type.setdefault(metrics.message_type(begin_id), [0, 0])
+                stats[0]+=frames
+                stats[1]+=size
+            for type, (frames, size) in by_type.items():
+                m.add("openwebrx_client_frames_sent_total", "counter", "WebSocket frames sent to the client, by type.", frames, client=label, type=type)
+                m.add("openwebrx_client_bytes_sent_total", "counter", "WebSocket payload bytes sent to the client, by type.", size, client=label, type=type)
+            m.add("openwebrx_client_socket_bytes_total", "counter", "Bytes written to the socket of the client, with WebSocket headers.", writer.bytes_sent, client=label)
+            m.add("openwebrx_client_write_syscalls_total", "counter", "System calls used to write to the socket of the client.", writer.syscalls, client=label)
+            m.add("openwebrx_client_pending_bytes", "gauge", "Bytes waiting in OpenWebRX to be written to the socket.", writer.pending_size, client=label)
+            if not writer.closed: m.add("openwebrx_client_socket_backlog_bytes", "gauge", "Bytes waiting in the kernel to be sent to the client.", pacer.socket_backlog(writer.sock), client=label)
+        m.add("openwebrx_client_audio_underruns_total", "counter", "Audio underruns in the browser of the client, as reported by it.", client.audio_underruns, client=label)
+        m.add("openwebrx_client_fft_lag_rows", "gauge", "FFT rows published but not read by the client yet.", client.spectrum_reader.lag(), client=label)
+        m.add("openwebrx_client_fft_rows_dropped_total", "counter", dropped_help, client.spectrum_reader.rows_skipped, client=label, reason="ring")
+        if client.fft_pacer:
+            m.add("openwebrx_client_fft_rows_dropped_total", "counter", dropped_help, client.fft_pacer.rows_dropped, client=label, reason="pacer")
+            m.add("openwebrx_client_fft_fps", "gauge", "Current FFT frame rate of the client.", client.fft_pacer.fps, client=label)
+            m.add("openwebrx_client_latency_seconds", "gauge", "Estimated latency of the client.", client.fft_pacer.latency, client=label)
+            m.add("openwebrx_client_queuing_seconds", "gauge", "Time to send what is waiting for the client, the part of the latency under fft_latency_budget.", client.fft_pacer.queuing, client=label)
+        if client.dsp:
+            m.add("openwebrx_dsp_cpu_seconds_total", "counter", cpu_help, sum(cpu.get(pgid, 0) for pgid in client.dsp.process_groups()), chain="client", client=label)
+    if spectrum_dsp and spectrum_dsp.running:
+        m.add("openwebrx_dsp_cpu_seconds_total", "counter", cpu_help, sum(cpu.get(pgid, 0) for pgid in spectrum_dsp.process_groups()), chain="spectrum")
+    if shared_channelizer:
+        m.add("openwebrx_dsp_cpu_seconds_total", "counter", cpu_help, sum(cpu.get(process.pid, 0) for process in shared_channelizer.processes), chain="channelizer")
+    if digimode_decoders:
+        decoder_count, subscriber_count = digimode_decoders.counts()
+        m.add("openwebrx_digimode_decoders", "gauge", "Shared digimode decoders running.", decoder_count)
+        m.add("openwebrx_digimode_subscribers", "gauge", "Clients reading a shared digimode decoder.", subscriber_count)
+    if demodulator_service:
+        chain_count, subscriber_count = demodulator_service.counts()
+        m.add("openwebrx_shared_demodulators", "gauge", "Shared demodulator chains running.", chain_count)
+        m.add("openwebrx_shared_demodulator_subscribers", "gauge", "Clients listening to a shared demodulator chain.", subscriber_count)
+        m.add("openwebrx_shared_demodulator_chains_saved", "gauge", "Demodulator chains not running because their clients share one with the same settings.", subscriber_count-chain_count)
+        m.add("openwebrx_shared_demodulator_splits_total", "counter", "Clients moved off a shared demodulator chain onto a new one when they retuned.", demodulator_service.splits)
+        m.add("openwebrx_dsp_cpu_seconds_total", "counter", cpu_help, sum(cpu.get(pgid, 0) for pgid in demodulator_service.process_groups()), chain="shared_demodulator")
+    if process_scheduler:
+        for pgid, label, kind, cores, nice in process_scheduler.placements():
+            m.add("openwebrx_process_group_placement", "gauge", "Process groups placed by csdr_scheduling: their cores and nice value (see affinity.py).", 1, pgid=str(pgid), chain=label, kind=kind, cores=affinity.format_cores(cores), nice=str(nice))
+    if skimmer_service:
+        m.add("openwebrx_skimmer_channels", "gauge", "PSK31 signals being decoded by the skimmer.", skimmer_service.channels)
+        m.add("openwebrx_skimmer_characters_total", "counter", "Characters decoded by the skimmer.", skimmer_service.characters)
+    m.add_histogram("openwebrx_registry_lock_wait_seconds", "Time spent waiting for the lock of the client registry.", clients.lock.wait)
+    m.add_histogram("openwebrx_registry_lock_hold_seconds", "Time the lock of the client registry has been held.", clients.lock.hold)
+    if spectrum_frame_interval:
+        m.add("openwebrx_spectrum_frames_total", "counter", "FFT rows made by the spectrum thread.", spectrum_ring.write_index)
+        m.add_histogram("openwebrx_spectrum_frame_interval_seconds", "Time between FFT rows.", spectrum_frame_interval)
+        m.add_histogram("openwebrx_spectrum_frame_jitter_seconds", "Difference of the time between FFT rows from 1/fft_fps.", spectrum_frame_jitter)
+    return m.render()
+
 def cleanup_clients(end_all=False):
     # - if a client doesn't open websocket for too long time, we drop it
     # - or if end_all is true, we drop all clients
     global clients
-    cma("cleanup_clients")
-    correction=0
-    for i in range(0,len(clients)):
-        i-=correction
-        #print "cleanup_clients:: len(clients)=", len(clients), "i=", i
-        if end_all or ((not clients[i].ws_started) and (time.time()-clients[i].gen_time)>45):
+    for client in clients:
+        if end_all or ((not client.ws_started) and (time.time()-client.gen_time)>45):
             if not end_all: print "[openwebrx] cleanup_clients :: client timeout to open WebSocket"
-            close_client(i, False)
-            correction+=1
-    cmr()
+            close_client(client)
 
 def generate_client_id(ip):
-    #add a client
+    return add_client(ip, md5.md5(str(random.random())).hexdigest()).id
+
+def add_client(ip, client_id):
     global clients
-    new_client=namedtuple("ClientStruct", "id gen_time ws_started sprectum_queue ip closed bcastmsg dsp loopstat")
-    new_client.id=md5.md5(str(random.random())).hexdigest()
+    new_client=namedtuple("ClientStruct", "id gen_time ws_started spectrum_reader ip closed bcastmsg dsp loopstat ws_writer fft_pacer audio_underruns")
+    new_client.id=client_id
     new_client.gen_time=time.time()
     new_client.ws_started=False # to check whether client has ever tried to open the websocket
-    new_client.spectrum_queue=Queue.Queue(1000)
+    new_client.spectrum_reader=spectrum_ring.reader()
     new_client.ip=ip
     new_client.bcastmsg=""
     new_client.closed=[False] #byref, not exactly sure if required
     new_client.dsp=None
-    cma("generate_client_id")
-    clients.append(new_client)
+    new_client.ws_writer=None
+    new_client.fft_pacer=None
+    new_client.audio_underruns=0 #reported by openwebrx.js
+    new_client.loopstat=0
+    clients.add(new_client)
     log_client(new_client,"client added. Clients now: {0}".format(len(clients)))
-    cmr()
     cleanup_clients()
-    return new_client.id
+    return new_client
 
-def close_client(i, use_mutex=True):
+def close_client(client):
     global clients
-    log_client(clients[i],"client being closed.")
-    if use_mutex: cma("close_client")
+    if not clients.remove(client.id): return #another thread has closed it already
+    log_client(client,"client being closed.")
     try:
-        clients[i].dsp.stop()
+        if client.dsp and client.dsp.running: client.dsp.stop() #it is not running while the client listens to a shared demodulator
     except:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         print "[openwebrx] close_client dsp.stop() :: error -",exc_type,exc_value
         traceback.print_tb(exc_traceback)
-    clients[i].closed[0]=True
-    access_log("Stopped streaming to client: "+clients[i].ip+"#"+str(clients[i].id)+" (users now: "+str(len(clients)-1)+")")
-    del clients[i]
-    if use_mutex: cmr()
+    client.closed[0]=True
+    if worker_link: worker_link.report_closed(client.id) #to the main process, which has it in its registry as well
+    access_log("Stopped streaming to client: "+client.ip+"#"+str(client.id)+" (users now: "+str(len(clients))+")")
+
+class ws_session:
+    # Everything that belongs to one WebSocket client: its DSP, and the data sent to it.
+    # In the "threaded" server_mode, tick() is called in a loop from the HTTP handler thread of the client.
+    # In the "evented" server_mode, evented_ws_session calls the same methods when the corresponding fd is ready.
+
+    def __init__(self, conn, myclient, client_address):
+        self.conn=conn #anything that has a wfile for rxws to write to
+        self.myclient=myclient
+        self.client_address=client_address
+        self.dsp=None
+        self.dsp_initialized=False
+        self.do_secondary_demod=False
+        self.digimode_subscription=None #to a shared decoder, see digimodes.py
+        self.audio_subscription=None #to a shared demodulator, see demodshare.py
+        self.audio_encoder=demodshare.audio_encoder() if cfg.audio_compression=="adpcm" else None #for the audio of the shared demodulators
+        self.skimmer_reader=None #set while the client shows the skimmer panel
+        self.greeted=False
+        self.fft_view=None #(level, first_bin, bin_count), the client gets whole rows until it sends its view
+        self.fft_delta=None #a spectrum.delta_encoder if the client has asked for FFTD messages
+        myclient.ws_writer=conn.wfile
+        self.fft_pacer=myclient.fft_pacer=pacer.fft_pacer(conn.wfile, cfg.fft_fps, cfg.fft_latency_budget)
+        self.overload_level=governor.LEVEL_NORMAL #what has been applied to this session
+
+    def greet(self):
+        rxws.send(self.conn, "CLIENT DE SERVER openwebrx.py")
+        rxws.flush(self.conn) #the client will only answer if it gets this
+
+    def on_greeting(self, client_ans):
+        myclient=self.myclient
+        if client_ans[:16]!="SERVER DE CLIENT":
+            rxws.send(self.conn, "ERR Bad answer.")
+            raise rxws.WebSocketException
+        self.greeted=True
+        myclient.ws_started=True
+        myclient.spectrum_reader.skip_to_newest() #we don't need what has been published while the page was loading
+        #send default parameters
+        rxws.send(self.conn, "MSG center_freq={0} bandwidth={1} fft_size={2} fft_fps={3} audio_compression={4} fft_compression={5} max_clients={6} fft_pyramid_levels={7} skimmer={8} fft_codecs={9} setup".format(str(cfg.shown_center_freq),str(cfg.samp_rate),cfg.fft_size,cfg.fft_fps,cfg.audio_compression,cfg.fft_compression,cfg.max_clients,spectrum_pyramid.level_count() if spectrum_pyramid else 0,1 if skimmer_service else 0,"delta" if spectrum_pyramid and spectrum_pyramid.delta_codec else "none"))
+
+        # ========= Initialize DSP =========
+        self.dsp=dsp=dsp_plugin.dsp()
+        dsp.set_audio_compression(cfg.audio_compression)
+        dsp.set_fft_compression(cfg.fft_compression) #used by secondary chains
+        dsp.set_format_conversion(cfg.format_conversion)
+        dsp.set_offset_freq(0)
+        dsp.set_bpf(-4000,4000)
+        dsp.set_secondary_fft_size(cfg.digimodes_fft_size)
+        dsp.nc_port=cfg.iq_server_port
+        if shared_channelizer: dsp.set_channelizer(shared_channelizer)
+        else: dsp.set_samp_rate(cfg.samp_rate)
+        apply_csdr_cfg_to_dsp(dsp)
+        dsp.label="client "+myclient.id[:8]
+        dsp.private_secondary_demod=not digimode_decoders
+        myclient.dsp=dsp
+        access_log("Started streaming to client: "+self.client_address[0]+"#"+myclient.id+" (users now: "+str(len(clients))+")")
+
+    def on_message(self, rdata):
+        if not self.greeted: self.on_greeting(rdata)
+        elif rdata[:3]=="SET": self.on_set(rdata)
+
+    def send_audio(self, temp_audio_data):
+        self.myclient.loopstat=11
+        rxws.send(self.conn, temp_audio_data, "AUD ")
+
+    def send_shared_audio(self, chunks):
+        #the chunks are 16-bit samples from a shared demodulator, which we encode here so that the stream stays continuous across chains
+        data="".join(chunks)
+        if self.audio_encoder: data=self.audio_encoder.encode(data)
+        if data: self.send_audio(data)
+
+    def send_spectrum(self):
+        myclient=self.myclient
+        myclient.loopstat=20
+        for spectrum_data in self.fft_pacer.select(myclient.spectrum_reader.read()): #rows are dropped if the client cannot keep up
+            #spectrum_data_mid=len(spectrum_data)/2
+            #rxws.send(self, spectrum_data[spectrum_data_mid:]+spectrum_data[:spectrum_data_mid], "FFT ")
+            # (it seems GNU Radio exchanges the first and second part of the FFT output, we correct it)
+            myclient.loopstat=21
+            if not self.fft_view: rxws.send(self.conn, spectrum_data.whole() if spectrum_pyramid else spectrum_data,"FFT ")
+            elif self.fft_delta: rxws.send(self.conn, self.fft_delta.encode(spectrum_data, *self.fft_view), "FFTD")
+            else: rxws.send(self.conn, spectrum_data.slice(*self.fft_view), "FFTL")
+
+    def send_smeter(self):
+        smeter_level=None
+        source=self.audio_subscription or self.dsp
+        while True:
+            try:
+                self.myclient.loopstat=30
+                level=source.get_smeter_level()
+                if level == None: break #a subscription has no new level, or the chain is not running
+                smeter_level=level
+            except:
+                break #no more lines in the pipe, we keep the last one
+        if smeter_level!=None:
+            self.myclient.loopstat=31
+            rxws.send(self.conn, "MSG s={0}".format(smeter_level))
+
+    def send_bcastmsg(self):
+        myclient=self.myclient
+        if myclient.bcastmsg!="":
+            myclient.loopstat=40
+            rxws.send(self.conn,myclient.bcastmsg)
+            myclient.bcastmsg=""
+
+    def send_secondary(self):
+        myclient=self.myclient
+        dsp=self.dsp
+        myclient.loopstat=41
+        while True:
+            try:
+                secondary_spectrum_data=dsp.read_secondary_fft(dsp.get_secondary_fft_bytes_to_read())
+                if len(secondary_spectrum_data) == 0: break
+                # print "len(secondary_spectrum_data)", len(secondary_spectrum_data) #TODO digimodes
+                rxws.send(self.conn, secondary_spectrum_data, "FFTS")
+            except: break
+        myclient.loopstat=42
+        if self.digimode_subscription:
+            for secondary_demod_data in self.digimode_subscription.read(): rxws.send(self.conn, secondary_demod_data, "DAT ")
+            return
+        while True:
+            try:
+                myclient.loopstat=422
+                secondary_demod_data=dsp.read_secondary_demod(1)
+                myclient.loopstat=423
+                if len(secondary_demod_data) == 0: break
+                # print "len(secondary_demod_data)", len(secondary_demod_data), secondary_demod_data #TODO digimodes
+                rxws.send(self.conn, secondary_demod_data, "DAT ")
+            except: break
+
+    def send_skimmer(self):
+        if not self.skimmer_reader: return
+        self.myclient.loopstat=43
+        for skimmer_data in self.skimmer_reader.read(): rxws.send(self.conn, skimmer_data, "SKM ")
+
+    def on_set(self, rdata):
+        myclient=self.myclient
+        dsp=self.dsp
+        print "[openwebrx-httpd:ws,%s] command: %s"%(myclient.id[:8],rdata)
+        pairs=rdata[4:].split(" ")
+        bpf_set=False
+        new_bpf=dsp.get_bpf()
+        filter_limit=dsp.get_output_rate()/2
+        for pair in pairs:
+            param_name, param_value = pair.split("=")
+            if param_name == "low_cut" and -filter_limit <= int(param_value) <= filter_limit:
+                bpf_set=True
+                new_bpf[0]=int(param_value)
+            elif param_name == "high_cut" and -filter_limit <= int(param_value) <= filter_limit:
+                bpf_set=True
+                new_bpf[1]=int(param_value)
+            elif param_name == "offset_freq" and -cfg.samp_rate/2 <= int(param_value) <= cfg.samp_rate/2:
+                myclient.loopstat=510
+                dsp.set_offset_freq(int(param_value))
+            elif param_name == "squelch_level" and float(param_value) >= 0:
+                myclient.loopstat=520
+                dsp.set_squelch_level(float(param_value))
+            elif param_name=="mod":
+                if (dsp.get_demodulator()!=param_value):
+                    myclient.loopstat=530
+                    dsp.set_demodulator(param_value) #if it is running, only the demodulator is replaced
+            elif param_name == "output_rate":
+                if not self.dsp_initialized:
+                    myclient.loopstat=540
+                    dsp.set_output_rate(int(param_value)) #this also updates the decimation
+            elif param_name=="action" and param_value=="start":
+                if not self.dsp_initialized:
+                    myclient.loopstat=550
+                    self.dsp_initialized=True #the DSP is started by update_audio_source()
+            elif param_name=="secondary_mod" and cfg.digimodes_enable:
+                if (dsp.get_secondary_demodulator() != param_value):
+                    if param_value == "off":
+                        dsp.set_secondary_demodulator(None)
+                        self.do_secondary_demod = False
+                    elif admission_control and not dsp.get_secondary_demodulator() and not admission_control.allow_secondary(dsp.get_demodulator(), param_value):
+                        print "[openwebrx-httpd:ws,%s] digimode refused, not enough CPU left"%myclient.id[:8]
+                        rxws.send(self.conn, "MSG secondary_refused")
+                    else:
+                        dsp.set_secondary_demodulator(param_value)
+                        self.do_secondary_demod = dsp.get_secondary_demodulator() != None #not every DSP plugin supports digimodes
+                        if self.do_secondary_demod: rxws.send(self.conn, "MSG secondary_fft_size={0} if_samp_rate={1} secondary_bw={2} secondary_setup".format(cfg.digimodes_fft_size, dsp.if_samp_rate(), dsp.secondary_bw()))
+            elif param_name=="fft_fps" and 0 <= float(param_value):
+                self.fft_pacer.set_requested_fps(float(param_value))
+            elif param_name=="audio_underruns" and int(param_value) >= myclient.audio_underruns:
+                myclient.audio_underruns=int(param_value) #a count since the page has been loaded
+            elif param_name=="fft_codec" and spectrum_pyramid:
+                if param_value!="delta": self.fft_delta=None
+                elif spectrum_pyramid.delta_codec and not self.fft_delta: self.fft_delta=spectrum.delta_encoder()
+            elif param_name=="fft_view" and spectrum_pyramid:
+                start, end, width = param_value.split(",")
+                self.fft_view=spectrum_pyramid.select(float(start), float(end), int(width))
+            elif param_name=="secondary_offset_freq" and 0 <= int(param_value) <= dsp.if_samp_rate()/2 and cfg.digimodes_enable:
+                dsp.set_secondary_offset_freq(int(param_value))
+            elif param_name=="skimmer" and skimmer_service:
+                if param_value=="0": self.skimmer_reader=None
+                elif not self.skimmer_reader:
+                    self.skimmer_reader=skimmer_service.reader() #only what is decoded from now on
+            else:
+                print "[openwebrx-httpd:ws] invalid parameter"
+        if bpf_set:
+            myclient.loopstat=560
+            dsp.set_bpf(*new_bpf)
+        self.update_audio_source()
+        if digimode_decoders: self.update_digimode_subscription()
+        #code.interact(local=locals())
+
+    def update_audio_source(self):
+        #listens to the shared demodulator with the same settings, or runs the DSP of the client.
+        #A client decoding digimodes runs its own DSP, as the secondary chains need the IF signal of the client.
+        if not self.dsp_initialized: return
+        dsp=self.dsp
+        if demodulator_service and not self.do_secondary_demod:
+            if dsp.running: dsp.stop()
+            key=demodshare.key_of(dsp)
+            if self.audio_subscription: self.audio_subscription=demodulator_service.retune(self.audio_subscription, key)
+            else: self.audio_subscription=demodulator_service.subscribe(key)
+        else:
+            if self.audio_subscription:
+                demodulator_service.unsubscribe(self.audio_subscription)
+                self.audio_subscription=None
+            if not dsp.running: dsp.start()
+
+    def update_overload_level(self):
+        #steps down (or restores) what the overload governor asks for, returns True if anything has changed
+        if self.overload_level==overload_level: return False
+        self.overload_level=level=overload_level
+        self.fft_pacer.set_max_fps(governor.fft_fps(cfg.fft_fps, level))
+        if self.dsp: self.dsp.set_secondary_fft_enabled(governor.secondary_fft_enabled(level))
+        return True
+
+    def update_digimode_subscription(self):
+        #subscribes to the shared decoder of the channel the client is tuned to
+        old=self.digimode_subscription
+        wanted=None
+        if self.dsp_initialized and self.do_secondary_demod:
+            dsp=self.dsp
+            wanted=(dsp.offset_freq+dsp.secondary_offset_freq, dsp.get_secondary_demodulator())
+        if old and (old.offset_freq, old.mode)==wanted: return
+        self.digimode_subscription=digimode_decoders.subscribe(*wanted) if wanted else None
+        if old: digimode_decoders.unsubscribe(old) #after subscribing, so that a decoder we keep is not restarted
+
+    def tick(self):
+        #returns False if the client has been closed by another thread
+        myclient=self.myclient
+        myclient.loopstat=0
+        if myclient.closed[0]:
+            print "[openwebrx-httpd:ws] client closed by other thread"
+            return False
+
+        # ========= send audio =========
+        if self.audio_subscription:
+            myclient.loopstat=10
+            self.send_shared_audio(self.audio_subscription.wait())
+        elif self.dsp_initialized:
+            myclient.loopstat=10
+            self.send_audio(self.dsp.read(256))
+
+        # ========= send spectrum =========
+        self.send_spectrum()
+
+        # ========= send smeter_level =========
+        self.send_smeter()
+
+        # ========= send bcastmsg =========
+        self.send_bcastmsg()
+        self.update_overload_level()
+
+        # ========= send secondary =========
+        if self.do_secondary_demod: self.send_secondary()
+
+        # ========= send skimmer =========
+        self.send_skimmer()
+
+        # ========= process commands =========
+        while True:
+            myclient.loopstat=50
+            rdata=rxws.recv(self.conn, False)
+            myclient.loopstat=51
+            if not rdata: break
+            self.on_message(rdata)
+
+        # ========= send everything queued in this iteration at once =========
+        rxws.flush(self.conn)
+        return True
+
+    def close(self):
+        myclient=self.myclient
+        #stop dsp for the disconnected client
+        myclient.loopstat=991
+        if self.dsp and self.dsp.running:
+            try:
+                self.dsp.stop()
+            except:
+                print "[openwebrx-httpd] error in dsp.stop()"
+        if self.audio_subscription:
+            demodulator_service.unsubscribe(self.audio_subscription)
+            self.audio_subscription=None
+        if self.digimode_subscription:
+            digimode_decoders.unsubscribe(self.digimode_subscription)
+            self.digimode_subscription=None
+
+        #delete disconnected client
+        myclient.loopstat=992
+        log_client(myclient, "sent to client: "+str(myclient.ws_writer)+", fft: "+str(self.fft_pacer))
+        try:
+            close_client(myclient)
+        except:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            print "[openwebrx-httpd] client cannot be closed: ",exc_type,exc_value
+            traceback.print_tb(exc_traceback)
+        myclient.loopstat=1000
+
+class evented_ws_session(ws_session):
+    # A ws_session driven by ws_loop: it is woken up by the socket, the csdr output pipes and the spectrum thread,
+    # so it costs nothing while there is no data to move.
+
+    def __init__(self, sock, myclient, client_address):
+        ws_session.__init__(self, evloop.connection(sock, ws_loop), myclient, client_address)
+        self.decoder=rxws.frame_decoder()
+        self.audio_leftover=""
+        self.dsp_fds={} # fd -> name of the output, see csdr.dsp.poll_fds()
+        self.closed=False
+        evented_sessions.append(self)
+        ws_loop.register(self.conn.fd, evloop.POLLIN, self.on_socket)
+        self.guarded(self.greet)
+
+    def guarded(self, function, *args):
+        if self.closed: return
+        try:
+            function(*args)
+            self.conn.flush()
+        except:
+            self.myclient.loopstat=990
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            print "[openwebrx-httpd:ws] exception: ",exc_type,exc_value
+            traceback.print_tb(exc_traceback)
+            self.close()
+
+    def on_socket(self, fd, events):
+        self.guarded(self.handle_socket, events)
+
+    def handle_socket(self, events):
+        if events & evloop.POLLOUT: self.conn.flush()
+        if events & evloop.POLLIN:
+            self.myclient.loopstat=50
+            self.decoder.feed(self.conn.recv())
+            while True:
+                message=self.decoder.next_message()
+                if not message: break
+                self.myclient.loopstat=51
+                if not rxws.handle_control(self.conn, *message): self.on_message(message[1])
+            self.update_dsp_fds() #the DSP may have been restarted
+        elif events & evloop.POLLERR: raise socket.error("connection closed")
+
+    def update_dsp_fds(self):
+        wanted=dict((fd, name) for name, fd in self.dsp.poll_fds().items()) if self.dsp_initialized else {}
+        for fd in self.dsp_fds.keys():
+            if wanted.get(fd)!=self.dsp_fds[fd]:
+                ws_loop.unregister(fd)
+                del self.dsp_fds[fd]
+        for fd, name in wanted.items():
+            if name=="audio": evloop.set_nonblocking(fd) #the fd may be the same number for a new process
+            if fd not in self.dsp_fds:
+                self.dsp_fds[fd]=name
+                ws_loop.register(fd, evloop.POLLIN, self.on_dsp_fd)
+
+    def on_dsp_fd(self, fd, events):
+        self.guarded(self.handle_dsp_fd, fd, events)
+
+    def handle_dsp_fd(self, fd, events):
+        name=self.dsp_fds.get(fd)
+        if name=="audio":
+            self.myclient.loopstat=10
+            try: data=os.read(fd, 4096)
+            except OSError: data=None
+            if data: self.on_audio(data)
+            elif data=="": #csdr has exited, wait for a restart
+                ws_loop.unregister(fd)
+                del self.dsp_fds[fd]
+        elif name=="smeter": self.send_smeter()
+        elif name in ("secondary_fft", "secondary_demod"): self.send_secondary()
+        if events & evloop.POLLERR and not events & evloop.POLLIN and name:
+            ws_loop.unregister(fd)
+            del self.dsp_fds[fd]
+
+    def on_audio(self, data):
+        data=self.audio_leftover+data
+        if cfg.audio_compression=="none" and len(data)%2: #we can only send whole 16-bit samples
+            self.audio_leftover=data[-1:]
+            data=data[:-1]
+        else: self.audio_leftover=""
+        if data: self.send_audio(data)
+
+    def on_shared_audio(self):
+        #called by ws_loop when a shared demodulator has new audio
+        if self.audio_subscription: self.guarded(self.send_shared_audio_and_smeter)
+
+    def send_shared_audio_and_smeter(self):
+        self.myclient.loopstat=10
+        self.send_shared_audio(self.audio_subscription.read())
+        self.send_smeter()
+
+    def on_tick(self):
+        #called by ws_loop on every spectrum frame and broadcast message
+        if self.myclient.closed[0]:
+            print "[openwebrx-httpd:ws] client closed by other thread"
+            self.close()
+            return
+        self.guarded(self.send_periodic)
+
+    def send_periodic(self):
+        #both go out in the same write
+        self.send_spectrum()
+        self.send_bcastmsg()
+        self.send_skimmer()
+        if self.update_overload_level(): self.update_dsp_fds() #the secondary FFT may have been stopped or started
+
+    def close(self):
+        if self.closed: return
+        self.closed=True
+        for fd in self.dsp_fds.keys(): ws_loop.unregister(fd)
+        self.dsp_fds={}
+        self.conn.close()
+        evented_sessions.remove(self)
+        ws_session.close(self)
+
+def evented_sessions_tick():
+    for session in evented_sessions[:]: session.on_tick()
+
+def evented_sessions_audio():
+    for session in evented_sessions[:]: session.on_shared_audio()
+
+def worker_main(link):
+    #runs in the worker processes of the "workers" server_mode, see workers.py
+    global clients, ws_loop, spectrum_ring, skimmer_service, worker_link
+    worker_link=link
+    signal.signal(signal.SIGINT, handle_worker_signal)
+    signal.signal(signal.SIGTERM, handle_worker_signal)
+    clients=registry.client_registry()
+    spectrum_ring=fanout.ring_buffer(cfg.fft_ring_rows)
+    skimmer_service=workers.skimmer_relay() if cfg.skimmer_enable and skimmer.numpy else None
+    ws_loop=evloop.event_loop()
+    if admission_control: threading.Thread(target = admission_thread_function, args = ()).start() #for the digimodes of our clients
+    link.start(on_worker_feed, on_worker_client)
+    print "[openwebrx-worker] Worker %d started." % link.index
+    ws_loop.run()
+
+def handle_worker_signal(sig, frame):
+    #only what belongs to this worker is stopped, the main process stops the rest
+    cleanup_clients(True)
+    for service in (demodulator_pool, digimode_decoders, demodulator_service):
+        if service: service.stop()
+    os._exit(1)
+
+def on_worker_feed(type, data):
+    #called from the feed thread of a worker, with the messages of the main process
+    global overload_level
+    if type=="FFT ": spectrum_ring.publish(spectrum_pyramid.make_row(data) if spectrum_pyramid else data)
+    elif type=="SKM " and skimmer_service: skimmer_service.ring.publish(data)
+    elif type=="MSG ":
+        for pair in data[4:].split(" "):
+            if pair.startswith("overload_level="): overload_level=int(pair.split("=")[1])
+        for client in clients: client.bcastmsg=data
+    ws_loop.call_soon_threadsafe(evented_sessions_tick)
+
+def on_worker_client(sock, client_id, client_address):
+    #called from the control thread of a worker, with a connection handed over by the main process
+    myclient=add_client(client_address[0], client_id)
+    ws_loop.call_soon_threadsafe(lambda: evented_ws_session(sock, myclient, client_address))
+
+def on_worker_client_closed(client_id):
+    #called in the main process when a worker has closed one of its clients
+    client=clients.remove(client_id)
+    if client: client.closed[0]=True
+
+def on_shared_audio():
+    #called from the reader thread of a shared demodulator, see demodshare.py
+    if ws_loop: ws_loop.call_soon_threadsafe(evented_sessions_audio)
 
 # http://www.codeproject.com/Articles/462525/Simple-HTTP-Server-and-Client-in-Python
 # some ideas are used from the artice above
@@ -414,8 +1128,7 @@ class WebRXHandler(BaseHTTPRequestHandler):
 
     def do_GET(self):
         self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        global dsp_plugin, clients_mutex, clients, avatar_ctime, sw_version, receiver_failed
-        rootdir = 'htdocs'
+        global dsp_plugin, clients, avatar_ctime, sw_version, receiver_failed
         self.path=self.path.replace("..","")
         path_temp_parts=self.path.split("?")
         self.path=path_temp_parts[0]
@@ -425,22 +1138,18 @@ class WebRXHandler(BaseHTTPRequestHandler):
             if self.path=="/":
                 self.path="/index.wrx"
             # there's even another cool tip at http://stackoverflow.com/questions/4419650/how-to-implement-timeout-in-basehttpserver-basehttprequesthandler-python
-            #if self.path[:5]=="/lock": cma("do_GET /lock/") # to test mutex_watchdog_thread. Do not uncomment in production environment!
             if self.path[:4]=="/ws/":
                 print "[openwebrx-ws] Client requested WebSocket connection"
                 if receiver_failed: self.send_error(500,"Internal server error")
+                session=None
                 try:
                     # ========= WebSocket handshake  =========
                     ws_success=True
                     try:
                         rxws.handshake(self)
-                        cma("do_GET /ws/")
-                        client_i=get_client_by_id(self.path[4:], False)
-                        myclient=clients[client_i]
+                        myclient=get_client_by_id(self.path[4:])
                     except rxws.WebSocketException: ws_success=False
                     except ClientNotFoundException: ws_success=False
-                    finally:
-                        if clients_mutex.locked(): cmr()
                     if not ws_success:
                         self.send_error(400, 'Bad request.')
                         return
@@ -450,156 +1159,27 @@ class WebRXHandler(BaseHTTPRequestHandler):
                         print "[openwebrx-httpd] error: second WS connection with the same client id, throwing it."
                         self.send_error(400, 'Bad request.') #client already started
                         return
-                    rxws.send(self, "CLIENT DE SERVER openwebrx.py")
-                    client_ans=rxws.recv(self, True)
-                    if client_ans[:16]!="SERVER DE CLIENT":
-                        rxws.send("ERR Bad answer.")
+                    if worker_pool:
+                        #hand over the connection to a worker process, our copy of the socket will be closed when we return
+                        myclient.ws_started=True #the worker has a client of its own, this one is only counted
+                        if not worker_pool.hand_over(self.connection, myclient.id, self.client_address):
+                            print "[openwebrx-httpd] error: no worker process is running."
+                            clients.remove(myclient.id)
+                            return
+                        self.server.handed_over.add(self.request)
+                        return
+                    if ws_loop:
+                        #hand over the connection to the event loop, our copy of the socket will be closed when we return
+                        sock=socket.fromfd(self.connection.fileno(), self.connection.family, socket.SOCK_STREAM)
+                        client_address=self.client_address
+                        self.server.handed_over.add(self.request)
+                        ws_loop.call_soon_threadsafe(lambda: evented_ws_session(sock, myclient, client_address))
                         return
-                    myclient.ws_started=True
-                    #send default parameters
-                    rxws.send(self, "MSG center_freq={0} bandwidth={1} fft_size={2} fft_fps={3} audio_compression={4} fft_compression={5} max_clients={6} setup".format(str(cfg.shown_center_freq),str(cfg.samp_rate),cfg.fft_size,cfg.fft_fps,cfg.audio_compression,cfg.fft_compression,cfg.max_clients))
-
-                    # ========= Initialize DSP =========
-                    dsp=csdr.dsp()
-                    dsp_initialized=False
-                    dsp.set_audio_compression(cfg.audio_compression)
-                    dsp.set_fft_compression(cfg.fft_compression) #used by secondary chains
-                    dsp.set_format_conversion(cfg.format_conversion)
-                    dsp.set_offset_freq(0)
-                    dsp.set_bpf(-4000,4000)
-                    dsp.set_secondary_fft_size(cfg.digimodes_fft_size)
-                    dsp.nc_port=cfg.iq_server_port
-                    apply_csdr_cfg_to_dsp(dsp)
-                    myclient.dsp=dsp
-                    do_secondary_demod=False
-                    access_log("Started streaming to client: "+self.client_address[0]+"#"+myclient.id+" (users now: "+str(len(clients))+")")
-
-                    while True:
-                        myclient.loopstat=0
-                        if myclient.closed[0]:
-                            print "[openwebrx-httpd:ws] client closed by other thread"
-                            break
-
-                        # ========= send audio =========
-                        if dsp_initialized:
-                            myclient.loopstat=10
-                            temp_audio_data=dsp.read(256)
-                            myclient.loopstat=11
-                            rxws.send(self, temp_audio_data, "AUD ")
-
-                        # ========= send spectrum =========
-                        while not myclient.spectrum_queue.empty():
-                            myclient.loopstat=20
-                            spectrum_data=myclient.spectrum_queue.get()
-                            #spectrum_data_mid=len(spectrum_data[0])/2
-                            #rxws.send(self, spectrum_data[0][spectrum_data_mid:]+spectrum_data[0][:spectrum_data_mid], "FFT ")
-                            # (it seems GNU Radio exchanges the first and second part of the FFT output, we correct it)
-                            myclient.loopstat=21
-                            rxws.send(self, spectrum_data[0],"FFT ")
-
-                        # ========= send smeter_level =========
-                        smeter_level=None
-                        while True:
-                            try:
-                                myclient.loopstat=30
-                                smeter_level=dsp.get_smeter_level()
-                                if smeter_level == None: break
-                            except:
-                                break
-                        if smeter_level!=None:
-                            myclient.loopstat=31
-                            rxws.send(self, "MSG s={0}".format(smeter_level))
-
-                        # ========= send bcastmsg =========
-                        if myclient.bcastmsg!="":
-                            myclient.loopstat=40
-                            rxws.send(self,myclient.bcastmsg)
-                            myclient.bcastmsg=""
-
-                        # ========= send secondary =========
-                        if do_secondary_demod:
-                            myclient.loopstat=41
-                            while True:
-                                try: 
-                                    secondary_spectrum_data=dsp.read_secondary_fft(dsp.get_secondary_fft_bytes_to_read())
-                                    if len(secondary_spectrum_data) == 0: break
-                                    # print "len(secondary_spectrum_data)", len(secondary_spectrum_data) #TODO digimodes
-                                    rxws.send(self, secondary_spectrum_data, "FFTS")
-                                except: break
-                            myclient.loopstat=42
-                            while True:
-                                try:
-                                    myclient.loopstat=422
-                                    secondary_demod_data=dsp.read_secondary_demod(1)
-                                    myclient.loopstat=423
-                                    if len(secondary_demod_data) == 0: break
-                                    # print "len(secondary_demod_data)", len(secondary_demod_data), secondary_demod_data #TODO digimodes
-                                    rxws.send(self, secondary_demod_data, "DAT ")
-                                except: break
-
-                        # ========= process commands =========
-                        while True:
-                            myclient.loopstat=50
-                            rdata=rxws.recv(self, False)
-                            myclient.loopstat=51
-                            #try:
-                            if not rdata: break
-                            elif rdata[:3]=="SET":
-                                print "[openwebrx-httpd:ws,%d] command: %s"%(client_i,rdata)
-                                pairs=rdata[4:].split(" ")
-                                bpf_set=False
-                                new_bpf=dsp.get_bpf()
-                                filter_limit=dsp.get_output_rate()/2
-                                for pair in pairs:
-                                    param_name, param_value = pair.split("=")
-                                    if param_name == "low_cut" and -filter_limit <= int(param_value) <= filter_limit:
-                                        bpf_set=True
-                                        new_bpf[0]=int(param_value)
-                                    elif param_name == "high_cut" and -filter_limit <= int(param_value) <= filter_limit:
-                                        bpf_set=True
-                                        new_bpf[1]=int(param_value)
-                                    elif param_name == "offset_freq" and -cfg.samp_rate/2 <= int(param_value) <= cfg.samp_rate/2:
-                                        myclient.loopstat=510
-                                        dsp.set_offset_freq(int(param_value))
-                                    elif param_name == "squelch_level" and float(param_value) >= 0:
-                                        myclient.loopstat=520
-                                        dsp.set_squelch_level(float(param_value))
-                                    elif param_name=="mod":
-                                        if (dsp.get_demodulator()!=param_value):
-                                            myclient.loopstat=530
-                                            if dsp_initialized: dsp.stop()
-                                            dsp.set_demodulator(param_value)
-                                            if dsp_initialized: dsp.start()
-                                    elif param_name == "output_rate":
-                                        if not dsp_initialized:
-                                            myclient.loopstat=540
-                                            dsp.set_output_rate(int(param_value))
-                                            myclient.loopstat=541
-                                            dsp.set_samp_rate(cfg.samp_rate)
-                                    elif param_name=="action" and param_value=="start":
-                                        if not dsp_initialized:
-                                            myclient.loopstat=550
-                                            dsp.start()
-                                            dsp_initialized=True
-                                    elif param_name=="secondary_mod" and cfg.digimodes_enable:
-                                        if (dsp.get_secondary_demodulator() != param_value):
-                                            if dsp_initialized: dsp.stop()
-                                            if param_value == "off":
-                                                dsp.set_secondary_demodulator(None)
-                                                do_secondary_demod = False
-                                            else:
-                                                dsp.set_secondary_demodulator(param_value)
-                                                do_secondary_demod = True
-                                                rxws.send(self, "MSG secondary_fft_size={0} if_samp_rate={1} secondary_bw={2} secondary_setup".format(cfg.digimodes_fft_size, dsp.if_samp_rate(), dsp.secondary_bw()))
-                                            if dsp_initialized: dsp.start()
-                                    elif param_name=="secondary_offset_freq" and 0 <= int(param_value) <= dsp.if_samp_rate()/2 and cfg.digimodes_enable:
-                                        dsp.set_secondary_offset_freq(int(param_value))
-                                    else:
-                                        print "[openwebrx-httpd:ws] invalid parameter"
-                                if bpf_set:
-                                    myclient.loopstat=560
-                                    dsp.set_bpf(*new_bpf)
-                                #code.interact(local=locals())
+                    self.wfile=rxws.frame_writer(self.connection) #BaseHTTPRequestHandler.finish() will close it
+                    session=ws_session(self, myclient, self.client_address)
+                    session.greet()
+                    session.on_message(rxws.recv(self, True))
+                    while session.tick(): pass
                 except:
                     myclient.loopstat=990
                     exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -613,36 +1193,29 @@ class WebRXHandler(BaseHTTPRequestHandler):
                     #    print "[openwebrx-httpd] error in /ws/ handler: ",exc_type,exc_value
                     #    traceback.print_tb(exc_traceback)
 
-                #stop dsp for the disconnected client
-                myclient.loopstat=991
-                try:
-                    dsp.stop()
-                    del dsp
-                except:
-                    print "[openwebrx-httpd] error in dsp.stop()"
-
-                #delete disconnected client
-                myclient.loopstat=992
-                try:
-                    cma("do_GET /ws/ delete disconnected")
-                    id_to_close=get_client_by_id(myclient.id,False)
-                    close_client(id_to_close,False)
-                except:
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    print "[openwebrx-httpd] client cannot be closed: ",exc_type,exc_value
-                    traceback.print_tb(exc_traceback)
-                finally:
-                    cmr()
-                myclient.loopstat=1000
+                if session: session.close()
                 return
+            elif self.path=="/metrics" and cfg.metrics_enable:
+                self.send_response(200)
+                self.send_header("Content-type", "text/plain; version=0.0.4")
+                self.end_headers()
+                self.wfile.write(render_metrics())
+            elif self.path=="/iq_record" and iq_recorder:
+                if self.client_address[0] not in ("127.0.0.1", "::1"): #it writes to the disk of the server
+                    self.send_error(403, 'Only from localhost.')
+                    return
+                filename=iq_recorder.save()
+                self.send_response(200)
+                self.send_header("Content-type", "text/plain")
+                self.end_headers()
+                self.wfile.write(filename+"\n")
             elif self.path in ("/status", "/status/"):
                 #self.send_header('Content-type','text/plain')
                 getbands=lambda: str(int(cfg.shown_center_freq-cfg.samp_rate/2))+"-"+str(int(cfg.shown_center_freq+cfg.samp_rate/2))
                 self.wfile.write("status="+("inactive" if receiver_failed else "active")+"\nname="+cfg.receiver_name+"\nsdr_hw="+cfg.receiver_device+"\nop_email="+cfg.receiver_admin+"\nbands="+getbands()+"\nusers="+str(len(clients))+"\nusers_max="+str(cfg.max_clients)+"\navatar_ctime="+avatar_ctime+"\ngps="+str(cfg.receiver_gps)+"\nasl="+str(cfg.receiver_asl)+"\nloc="+cfg.receiver_location+"\nsw_version="+sw_version+"\nantenna="+cfg.receiver_ant+"\n")
                 print "[openwebrx-httpd] GET /status/ from",self.client_address[0]
             else:
-                f=open(rootdir+self.path)
-                data=f.read()
+                page=static_cache.get(self.path) #IOError if it does not exist
                 extension=self.path[(len(self.path)-4):len(self.path)]
                 extension=extension[2:] if extension[1]=='.' else extension[1:]
                 checkresult=check_server()
@@ -658,45 +1231,15 @@ class WebRXHandler(BaseHTTPRequestHandler):
                     if cfg.max_clients<=len(clients):
                         self.send_302("retry.html")
                         return
-                self.send_response(200)
-                if(("wrx","html","htm").count(extension)):
-                    self.send_header('Content-type','text/html')
-                elif(extension=="js"):
-                    self.send_header('Content-type','text/javascript')
-                elif(extension=="css"):
-                    self.send_header('Content-type','text/css')
-                self.end_headers()
-                if extension == "wrx":
-                    replace_dictionary=(
-                        ("%[RX_PHOTO_DESC]",cfg.photo_desc),
-                        ("%[CLIENT_ID]", generate_client_id(self.client_address[0])) if "%[CLIENT_ID]" in data else "",
-                        ("%[WS_URL]","ws://"+cfg.server_hostname+":"+str(cfg.web_port)+"/ws/"),
-                        ("%[RX_TITLE]",cfg.receiver_name),
-                        ("%[RX_LOC]",cfg.receiver_location),
-                        ("%[RX_QRA]",cfg.receiver_qra),
-                        ("%[RX_ASL]",str(cfg.receiver_asl)),
-                        ("%[RX_GPS]",str(cfg.receiver_gps[0])+","+str(cfg.receiver_gps[1])),
-                        ("%[RX_PHOTO_HEIGHT]",str(cfg.photo_height)),("%[RX_PHOTO_TITLE]",cfg.photo_title),
-                        ("%[RX_ADMIN]",cfg.receiver_admin),
-                        ("%[RX_ANT]",cfg.receiver_ant),
-                        ("%[RX_DEVICE]",cfg.receiver_device),
-                        ("%[AUDIO_BUFSIZE]",str(cfg.client_audio_buffer_size)),
-                        ("%[START_OFFSET_FREQ]",str(cfg.start_freq-cfg.center_freq)),
-                        ("%[START_MOD]",cfg.start_mod),
-                        ("%[WATERFALL_COLORS]",cfg.waterfall_colors),
-                        ("%[WATERFALL_MIN_LEVEL]",str(cfg.waterfall_min_level)),
-                        ("%[WATERFALL_MAX_LEVEL]",str(cfg.waterfall_max_level)),
-                        ("%[WATERFALL_AUTO_LEVEL_MARGIN]","[%d,%d]"%cfg.waterfall_auto_level_margin),
-                        ("%[DIGIMODES_ENABLE]",("true" if cfg.digimodes_enable else "false")),
-                        ("%[MATHBOX_WATERFALL_FRES]",str(cfg.mathbox_waterfall_frequency_resolution)),
-                        ("%[MATHBOX_WATERFALL_THIST]",str(cfg.mathbox_waterfall_history_length)),
-                        ("%[MATHBOX_WATERFALL_COLORS]",cfg.mathbox_waterfall_colors)
-                    )
-                    for rule in replace_dictionary:
-                        while data.find(rule[0])!=-1:
-                            data=data.replace(rule[0],rule[1])
-                self.wfile.write(data)
-                f.close()
+                    if not governor.admits_new_clients(overload_level):
+                        self.send_302("retry.html")
+                        return
+                    #it may wait in the queue, so the limits above are checked again when it could be admitted
+                    if admission_control and not admission_control.admit(cfg.start_mod, lambda: cfg.max_clients>len(clients) and governor.admits_new_clients(overload_level)):
+                        self.send_302("retry.html")
+                        return
+                if extension == "wrx": page.send_template(self, generate_client_id(self.client_address[0]) if len(page.template)>1 else "")
+                else: page.send(self)
             return
         except IOError:
             self.send_error(404, 'Invalid path.')
@@ -0,0 +1,130 @@
+"""
+OpenWebRX pacer: adapt the FFT frame rate of each client to its link
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import socket
+import struct
+import fcntl
+import time
+
+try: import termios
+except: termios=None
+
+#How it works:
+#  - the latency of a client is estimated as the round-trip time of its TCP connection, plus the time needed to send
+#    what is waiting for it (in the kernel and in our frame_writer), at the rate we have seen the kernel send it,
+#  - the budget applies to the queuing part only: the round-trip time is not made shorter by sending less, so a
+#    client far away (or on a mobile link) gets the same treatment as a near one with the same bandwidth,
+#  - if the queuing is above the budget, FFT rows are dropped, and the frame rate of the client is halved, but the
+#    client still gets MIN_FPS rows per second (so the waterfall never stops for good),
+#  - if it is well below the budget, the frame rate is increased again by 1 fps every second, up to the rate the
+#    client has asked for (0 pauses the waterfall, e.g. while the browser tab is hidden),
+#  - audio is never dropped here: it is sent before the spectrum, and the spectrum makes room for it.
+
+MIN_FPS = 0.5
+
+def socket_backlog(sock):
+    #bytes that the kernel has not sent yet (SIOCOUTQ, only on Linux)
+    if not termios or not hasattr(termios, "TIOCOUTQ"): return 0
+    try: return struct.unpack("i", fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, struct.pack("i", 0)))[0]
+    except: return 0
+
+def socket_rtt(sock):
+    #smoothed round-trip time in seconds, from TCP_INFO (only on Linux)
+    if not hasattr(socket, "TCP_INFO"): return 0.0
+    try:
+        info=sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        return struct.unpack_from("I", info, 68)[0]/1e6 #tcpi_rtt, after 8 bytes and 15 other 32-bit fields
+    except: return 0.0
+
+class fft_pacer:
+
+    def __init__(self, wfile, max_fps, latency_budget):
+        self.wfile = wfile # rxws.frame_writer
+        self.sock = wfile.sock
+        self.max_fps = float(max_fps)
+        self.client_fps = self.max_fps #what the client has asked for
+        self.requested_fps = self.max_fps
+        self.fps = self.max_fps
+        self.latency_budget = latency_budget
+        self.last_sent = 0
+        self.last_update = time.time()
+        self.last_change = self.last_update
+        self.last_bytes_sent = wfile.bytes_sent
+        self.last_backlog = 0
+        self.drain_rate = None #bytes/s
+        self.latency = 0.0 #round-trip time + queuing
+        self.queuing = 0.0 #seconds to send what is waiting for the client
+        self.rows_sent = 0
+        self.rows_dropped = 0
+
+    def set_requested_fps(self, fps):
+        self.client_fps = float(fps)
+        self.requested_fps = max(0.0, min(self.client_fps, self.max_fps))
+        if self.requested_fps: self.fps = self.requested_fps #if that is too much, adapt() will take it down
+
+    def set_max_fps(self, max_fps):
+        #e.g. while the server is overloaded, see governor.py
+        self.max_fps = float(max_fps)
+        self.set_requested_fps(self.client_fps)
+
+    def update(self, now):
+        backlog = socket_backlog(self.sock)
+        dt = now - self.last_update
+        if dt >= 0.05:
+            drained = (self.wfile.bytes_sent - self.last_bytes_sent) - (backlog - self.last_backlog)
+            if self.last_backlog > 0 and backlog > 0: #the rate of the link can only be seen while data is waiting for it
+                rate = drained / dt
+                self.drain_rate = rate if self.drain_rate == None else 0.7*self.drain_rate + 0.3*rate
+            self.last_update = now
+            self.last_bytes_sent = self.wfile.bytes_sent
+            self.last_backlog = backlog
+        backlog += self.wfile.pending_size
+        self.queuing = backlog / self.drain_rate if backlog and self.drain_rate else 0.0
+        self.latency = socket_rtt(self.sock) + self.queuing
+
+    def lagging(self):
+        return self.queuing > self.latency_budget
+
+    def adapt(self, now):
+        if self.lagging() and now - self.last_change >= 0.5:
+            self.fps = max(min(MIN_FPS, self.requested_fps), self.fps/2)
+            self.last_change = now
+        elif self.queuing < self.latency_budget/4 and self.fps < self.requested_fps and now - self.last_change >= 1:
+            self.fps = min(self.requested_fps, self.fps+1)
+            self.last_change = now
+
+    def select(self, rows):
+        #returns the rows to send from the ones that have been published since the last call: the newest one or none
+        if not rows: return rows
+        now = time.time()
+        self.update(now)
+        self.adapt(now)
+        if self.requested_fps <= 0 or now - self.last_sent < 0.8/self.fps or (self.lagging() and now - self.last_sent < 1/MIN_FPS):
+            self.rows_dropped += len(rows)
+            return []
+        self.last_sent = now
+        self.rows_sent += 1
+        self.rows_dropped += len(rows)-1
+        return rows[-1:]
+
+    def __str__(self):
+        return "fps=%.1f/%g latency=%.3fs queuing=%.3fs rows_sent=%d rows_dropped=%d" % (self.fps, self.requested_fps, self.latency, self.queuing, self.rows_sent, self.rows_dropped)
@@ -0,0 +1,57 @@
+"""
+registry: the clients of OpenWebRX, indexed by their id
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import threading
+import metrics
+
+class client_registry:
+    # Clients are kept in a dict by id, so lookup, insert and remove are O(1).
+    # Only add() and remove() take the lock, and it is held only for the dict operation itself.
+    # Readers don't lock at all: dict.get() and dict.values() are atomic under the GIL, and values() returns a snapshot
+    # list that we can iterate over while other threads add or remove clients.
+
+    def __init__(self):
+        self.clients = {}
+        self.lock = metrics.timed_lock(threading.Lock()) #its wait and hold times are on /metrics
+
+    def add(self, client):
+        self.lock.acquire()
+        try: self.clients[client.id] = client
+        finally: self.lock.release()
+
+    def remove(self, client_id):
+        #returns the client removed, or None if it has been removed already (so only one caller gets it)
+        self.lock.acquire()
+        try: return self.clients.pop(client_id, None)
+        finally: self.lock.release()
+
+    def get(self, client_id):
+        return self.clients.get(client_id)
+
+    def snapshot(self):
+        return self.clients.values()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __iter__(self):
+        return iter(self.snapshot())
@@ -24,6 +24,16 @@ import base64
 import sha
 import select
 import code
+import struct
+import binascii
+import ctypes
+import ctypes.util
+import socket
+import errno
+import os
+
+try: import numpy
+except: numpy=None
 
 class WebSocketException(Exception):
     pass
@@ -45,28 +55,129 @@ def handshake(myself):
     #A sample list of keys we get: [('origin', 'http://localhost:8073'), ('upgrade', 'websocket'), ('sec-websocket-extensions', 'x-webkit-deflate-frame'), ('sec-websocket-version', '13'), ('host', 'localhost:8073'), ('sec-websocket-key', 't9J1rgy4fc9fg2Hshhnkmg=='), ('connection', 'Upgrade'), ('pragma', 'no-cache'), ('cache-control', 'no-cache')]
     myself.wfile.write("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: "+ws_key_toreturn+"\r\nCQ-CQ-de: HA5KFU\r\n\r\n")
 
-def get_header(size):
+#Opcodes from RFC 6455 section 5.2
+OPCODE_CONTINUATION=0x0
+OPCODE_TEXT=0x1
+OPCODE_BINARY=0x2
+OPCODE_CLOSE=0x8
+OPCODE_PING=0x9
+OPCODE_PONG=0xA
+
+class WebSocketClosed(WebSocketException):
+    pass
+
+def get_header(size, opcode=OPCODE_BINARY, fin=True):
     #this does something similar: https://github.com/lemmingzshadow/php-websocket/blob/master/server/lib/WebSocket/Connection.php
-    ws_first_byte=0b10000010 # FIN=1, OP=2
-    if(size>125):
-        ws_second_byte=126 # The following two bytes will indicate frame size
-        extended_size=chr((size>>8)&0xff)+chr(size&0xff) #Okay, it uses reverse byte order (little-endian) compared to anything else sent on TCP
-    else:
-        ws_second_byte=size
-        #256 bytes binary message in a single unmasked frame | 0x82 0x7E 0x0100 [256 bytes of binary data]
-        extended_size=""
-    return chr(ws_first_byte)+chr(ws_second_byte)+extended_size
+    ws_first_byte=(0x80 if fin else 0)|opcode # FIN=1, OP=2 by default
+    #256 bytes binary message in a single unmasked frame | 0x82 0x7E 0x0100 [256 bytes of binary data]
+    if size<126: return struct.pack("!BB", ws_first_byte, size)
+    elif size<65536: return struct.pack("!BBH", ws_first_byte, 126, size) # The following two bytes will indicate frame size
+    else: return struct.pack("!BBQ", ws_first_byte, 127, size) # The following eight bytes will indicate frame size
 
 def code_payload(data, masking_key=""):
-    # both encode or decode
-    if masking_key=="":
-        key = (61, 84, 35, 6)
-    else:
-        key = [ord(i) for i in masking_key]
-    encoded=""
-    for i in range(0,len(data)):
-        encoded+=chr(ord(data[i])^key[i%4])
-    return encoded
+    # both encode or decode, on the whole buffer at once
+    if masking_key=="": masking_key="\x3d\x54\x23\x06" # (61, 84, 35, 6)
+    length=len(data)
+    if length==0: return ""
+    if numpy:
+        return (numpy.frombuffer(data, dtype=numpy.uint8)^numpy.resize(numpy.frombuffer(masking_key, dtype=numpy.uint8), length)).tostring()
+    # without numpy, we XOR the whole buffer as a single big integer, that is done in C as well
+    key=(masking_key*(length/4+1))[:length]
+    return binascii.unhexlify("%0*x"%(length*2, int(binascii.hexlify(data),16)^int(binascii.hexlify(key),16)))
+
+class frame_decoder:
+    # Incremental decoder for the frames coming from the client:
+    #  - feed() it with whatever has been read from the socket,
+    #  - next_message() returns (opcode, payload) for each complete message, or None if more data is needed.
+    # Fragmented messages are put together from their continuation frames.
+    # Control frames (ping, pong, close) can come between the fragments, they are returned as they arrive.
+
+    def __init__(self, max_message_size=1024*1024):
+        self.buffer=""
+        self.fragments=[]
+        self.fragments_size=0
+        self.fragments_opcode=None
+        self.max_message_size=max_message_size
+
+    def feed(self, data):
+        self.buffer+=data
+
+    def header_size(self):
+        #returns the size of the header of the frame at the beginning of the buffer, or 0 if we cannot tell yet
+        if len(self.buffer)<2: return 0
+        second_byte=ord(self.buffer[1])
+        return 2+{126:2, 127:8}.get(second_byte&0x7f, 0)+(4 if second_byte&0x80 else 0)
+
+    def missing(self):
+        #returns how many bytes we need at least to complete the frame at the beginning of the buffer
+        header_size=self.header_size()
+        if not header_size: return 2-len(self.buffer)
+        if len(self.buffer)<header_size: return header_size-len(self.buffer)
+        return max(header_size+self.payload_size()-len(self.buffer), 1)
+
+    def in_frame(self):
+        #True if we have already got a part of a frame
+        return len(self.buffer)>0
+
+    def payload_size(self):
+        length=ord(self.buffer[1])&0x7f
+        if length==126: return struct.unpack("!H", self.buffer[2:4])[0]
+        elif length==127: return struct.unpack("!Q", self.buffer[2:10])[0]
+        return length
+
+    def next_frame(self):
+        #returns (fin, opcode, payload), or None if the frame is not complete yet
+        header_size=self.header_size()
+        if not header_size or len(self.buffer)<header_size: return None
+        first_byte=ord(self.buffer[0])
+        fin=first_byte&0x80!=0
+        opcode=first_byte&0x0f
+        if first_byte&0x70: raise WebSocketException("reserved bits are set, but no extension has been negotiated")
+        length=self.payload_size()
+        if opcode&0x8 and (length>125 or not fin): raise WebSocketException("invalid control frame")
+        if length+self.fragments_size>self.max_message_size: raise WebSocketException("message is too big: %d bytes"%length)
+        if len(self.buffer)<header_size+length: return None
+        payload=self.buffer[header_size:header_size+length]
+        masked=ord(self.buffer[1])&0x80!=0
+        #RFC 6455 says the client must mask its frames, but we also accept unmasked ones, as the old recv() did
+        if masked: payload=code_payload(payload, self.buffer[header_size-4:header_size])
+        self.buffer=self.buffer[header_size+length:]
+        return (fin, opcode, payload)
+
+    def next_message(self):
+        while True:
+            frame=self.next_frame()
+            if not frame: return None
+            fin, opcode, payload = frame
+            if opcode&0x8: return (opcode, payload) #control frame
+            if opcode==OPCODE_CONTINUATION:
+                if self.fragments_opcode==None: raise WebSocketException("continuation frame without a message to continue")
+            elif self.fragments_opcode!=None: raise WebSocketException("new message before the previous one was finished")
+            else: self.fragments_opcode=opcode
+            self.fragments.append(payload)
+            self.fragments_size+=len(payload)
+            if fin:
+                message=(self.fragments_opcode, "".join(self.fragments))
+                self.fragments=[]
+                self.fragments_size=0
+                self.fragments_opcode=None
+                return message
+
+def send_frame(myself, payload, opcode):
+    myself.wfile.write(get_header(len(payload), opcode)+payload)
+    flush(myself)
+
+def handle_control(myself, opcode, payload):
+    #answers the control frames, returns True if the message was one of them
+    if opcode==OPCODE_PING:
+        send_frame(myself, payload, OPCODE_PONG)
+        return True
+    elif opcode==OPCODE_PONG:
+        return True
+    elif opcode==OPCODE_CLOSE:
+        send_frame(myself, payload[:2], OPCODE_CLOSE) #echo the status code
+        raise WebSocketClosed("closed by client")
+    return False
 
 def xxdg(data):
     output=""
@@ -90,6 +201,7 @@ def xxd(data):
 
 def readsock(myself,size,blocking):
     #http://thenestofheliopolis.blogspot.hu/2011/01/how-to-implement-non-blocking-two-way.html
+    #returns None if there is nothing to read yet (only if not blocking), and "" if the connection has been closed
     if blocking:
         return myself.rfile.read(size)
     else:
@@ -100,36 +212,25 @@ def readsock(myself,size,blocking):
             f = fd[0]
             if f[1] > 0:
                 return myself.rfile.read(size)
-    return ""
+    return None
 
 
 def recv(myself, blocking=False, debug=False):
-    bufsize=70000
-    #myself.connection.setblocking(blocking) #umm... we cannot do that with rfile
+    #returns the next text or binary message, or "" if there is none yet (only if not blocking)
+    if not hasattr(myself, "ws_decoder"): myself.ws_decoder=frame_decoder()
+    decoder=myself.ws_decoder
     if debug: print "ws_recv begin"
-    try:
-        data=readsock(myself,6,blocking)
-        #print "rxws.recv bytes:",xxd(data) 
-    except:
-        if debug: print "ws_recv error" 
-        return ""
-    if debug: print "ws_recv recved"
-    if(len(data)==0): return ""
-    fin=ord(data[0])&128!=0
-    is_text_frame=ord(data[0])&15==1
-    length=ord(data[1])&0x7f
-    data+=readsock(myself,length,blocking)
-    #print "rxws.recv length is ",length," (multiple packets together?) len(data) =",len(data)
-    has_one_byte_length=length<125
-    masked=ord(data[1])&0x80!=0
-    #print "len=", length, len(data)-2
-    #print "fin, is_text_frame, has_one_byte_length, masked = ", (fin, is_text_frame, has_one_byte_length, masked)
-    #print xxd(data)
-    if fin and is_text_frame and has_one_byte_length:
-        if masked:
-            return code_payload(data[6:], data[2:6])
-        else:
-            return data[2:]
+    while True:
+        message=decoder.next_message()
+        if message:
+            if debug: print "ws_recv message: opcode =", message[0], "length =", len(message[1])
+            if handle_control(myself, *message): continue
+            return message[1]
+        #if we have a part of a frame already, the rest should arrive soon, so we wait for it
+        data=readsock(myself, decoder.missing(), blocking or decoder.in_frame())
+        if data==None: return ""
+        if data=="": raise WebSocketClosed("connection closed")
+        decoder.feed(data)
 
 #Useful links for ideas on WebSockets:
 #  http://stackoverflow.com/questions/8125507/how-can-i-send-and-receive-websocket-messages-on-the-server-side
@@ -144,28 +245,123 @@ def flush(myself):
     
 
 def send(myself, data, begin_id="", debug=0):
-    base_frame_size=35000 #could guess by MTU?
-    debug=0
-    #try:
-    while True:
-        counter=0
-        from_end=len(data)-counter
-        if from_end+len(begin_id)>base_frame_size:
-            data_to_send=begin_id+data[counter:counter+base_frame_size-len(begin_id)]
-            header=get_header(len(data_to_send))
-            flush(myself)
-            myself.wfile.write(header+data_to_send)
-            flush(myself)
-            if debug: print "rxws.send ==================== #1 if branch :: from={0} to={1} dlen={2} hlen={3}".format(counter,counter+base_frame_size-len(begin_id),len(data_to_send),len(header))
+    #the whole message goes in a single frame, the payload is not copied: header+begin_id and data are written separately,
+    #and frame_writer sends them together with writev()
+    myself.wfile.write(get_header(len(begin_id)+len(data))+begin_id)
+    myself.wfile.write(data)
+    if debug: print "rxws.send :: dlen={0} begin_id={1}".format(len(data),begin_id)
+    if hasattr(myself.wfile, "frame_sent"): myself.wfile.frame_sent(begin_id, len(begin_id)+len(data))
+    if not getattr(myself.wfile, "coalescing", False): flush(myself)
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_char_p), ("iov_len", ctypes.c_size_t)]
+
+try:
+    libc_writev=ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).writev
+    libc_writev.argtypes=[ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_int]
+    libc_writev.restype=ctypes.c_ssize_t
+except: libc_writev=None
+IOV_MAX=1024
+
+class frame_writer:
+    # Can be used as wfile for send(): it collects the frames to a client instead of writing them one by one,
+    # then flush() sends all of them with one writev() system call, without joining the buffers.
+    # With coalescing=True, send() does not flush, so the caller can flush once after sending audio, FFT and MSG frames.
+    # It also counts what has been sent, to be able to see how many syscalls we need for a given amount of data.
+
+    def __init__(self, sock, coalescing=True):
+        self.sock=sock
+        self.fd=sock.fileno()
+        self.coalescing=coalescing
+        self.pending=[]
+        self.pending_size=0
+        self.max_pending_bytes=None
+        self.closed=False
+        self.bytes_sent=0
+        self.frames_sent=0
+        self.syscalls=0
+        self.sent_by_id={} # begin_id -> [frames, payload bytes]
+
+    def write(self, data):
+        if not data: return
+        self.pending.append(data)
+        self.pending_size+=len(data)
+        if self.max_pending_bytes and self.pending_size>self.max_pending_bytes:
+            raise socket.error(errno.ENOBUFS, "client is too slow, %d bytes pending" % self.pending_size)
+
+    def frame_sent(self, begin_id="", size=0):
+        self.frames_sent+=1
+        stats=self.sent_by_id.get(begin_id)
+        if stats: #this is the usual case, so no setdefault() with a new list every time
+            stats[0]+=1
+            stats[1]+=size
+        else: self.sent_by_id[begin_id]=[1, size]
+
+    def send_buffers(self, buffers):
+        #returns the number of bytes sent, or None if the (non-blocking) socket cannot take anything now
+        self.syscalls+=1
+        if not libc_writev:
+            try: return self.sock.send("".join(buffers))
+            except socket.error as e:
+                if e[0] in (errno.EAGAIN, errno.EWOULDBLOCK): return None
+                raise
+        iov=(iovec*len(buffers))(*[iovec(buf, len(buf)) for buf in buffers]) #iov_base points into the strings, no copy
+        sent=libc_writev(self.fd, iov, len(buffers))
+        if sent<0:
+            error=ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK): return None
+            if error==errno.EINTR: return 0
+            raise socket.error(error, os.strerror(error))
+        return sent
+
+    def flush(self):
+        #returns True if everything has been sent (a non-blocking socket may not take all of it)
+        while self.pending:
+            sent=self.send_buffers(self.pending[:IOV_MAX])
+            if sent==None: return False
+            self.bytes_sent+=sent
+            self.pending_size-=sent
+            i=0
+            while i<len(self.pending) and sent>=len(self.pending[i]):
+                sent-=len(self.pending[i])
+                i+=1
+            self.pending=self.pending[i:]
+            if sent: self.pending[0]=self.pending[0][sent:]
+        return True
+
+    def close(self):
+        self.closed=True
+
+    def __str__(self):
+        return "bytes_sent=%d frames_sent=%d syscalls=%d pending=%d"%(self.bytes_sent, self.frames_sent, self.syscalls, self.pending_size)
+
+if __name__=="__main__":
+    #microbenchmark of the frame codec against the implementation it has replaced
+    import timeit, os
+    def code_payload_bytewise(data, masking_key=""):
+        if masking_key=="":
+            key = (61, 84, 35, 6)
         else:
-            data_to_send=begin_id+data[counter:]
-            header=get_header(len(data_to_send))
-            flush(myself)
-            myself.wfile.write(header+data_to_send)
-            flush(myself)
-            if debug: print "rxws.send :: #2 else branch :: dlen={0} hlen={1}".format(len(data_to_send),len(header))
-            #if debug: print "header:\n"+xxdg(header)+"\n\nws data:\n"+xxdg(data_to_send)
-            break
-        counter+=base_frame_size-len(begin_id)
-    #except:
-    #   pass
+            key = [ord(i) for i in masking_key]
+        encoded=""
+        for i in range(0,len(data)):
+            encoded+=chr(ord(data[i])^key[i%4])
+        return encoded
+    def throughput(function, size, number):
+        return size*number/min(timeit.repeat(function, number=number, repeat=3))/1e6
+    print "numpy:", "yes" if numpy else "no"
+    for size in (16, 256, 4096, 65536):
+        data=os.urandom(size)
+        key=os.urandom(4)
+        assert code_payload(data, key)==code_payload_bytewise(data, key)
+        header=get_header(size, OPCODE_TEXT)
+        frame=header[0]+chr(ord(header[1])|0x80)+header[2:]+key+code_payload(data, key)
+        def decode():
+            decoder=frame_decoder()
+            decoder.feed(frame)
+            decoder.next_message()
+        number=max(10, 2000000/size)
+        print "%6d bytes | bytewise unmask: %8.2f MB/s | bulk unmask: %8.2f MB/s | frame_decoder: %8.2f MB/s"%(size, \
+            throughput(lambda: code_payload_bytewise(data, key), size, max(1, number/20)), \
+            throughput(lambda: code_payload(data, key), size, number), \
+            throughput(decode, size, number))
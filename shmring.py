@@ -0,0 +1,220 @@
+"""
+OpenWebRX shmring: the I/Q stream in a ring buffer in shared memory, instead of nmux and a TCP connection for each reader
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import io
+import sys
+import time
+import mmap
+import errno
+import ctypes
+import signal
+import socket
+import struct
+
+#How it works:
+#  - "shmring.py write" sits at the end of start_rtl_command instead of nmux: it reads the I/Q samples from its stdin
+#    right into a file in /dev/shm, mapped into memory, which is a ring buffer,
+#  - the header of the file has the number of bytes written so far (write_position), it only grows. The byte at
+#    position p is at HEADER_SIZE+p%data_size in the file,
+#  - a reader keeps its own position, so readers cannot slow down each other or the writer. It maps the file, and
+#    gets the samples between its position and write_position as buffer objects that point into the mapping:
+#    NumPy can use them without a copy (npdsp, skimmer),
+#  - the csdr chains read their stdin, so they get a "shmring.py cat" in front of them instead of "nc": this is
+#    one copy into a pipe, instead of the copies of nmux, the TCP connection and nc,
+#  - if a reader falls behind by more than the buffer, the writer overwrites what it has not read yet: this is an
+#    overrun. The reader notices it from the positions, skips to the newest samples and counts it.
+#The positions are multiples of ALIGN, so that readers always get whole I/Q samples (1, 2 or 4 bytes for I and Q).
+
+MAGIC = "OWRXIQ01"
+HEADER_FORMAT = "<8sQQQQ" #magic, data_size, write_position, writer_pid, closed
+HEADER_SIZE = 64
+ALIGN = 8 #bytes, the size of the biggest I/Q sample (complex float)
+WRITE_CHUNK = 65536 #bytes, at most this much is being overwritten while write_position has not been updated yet
+POLL_INTERVAL = 0.01 #s, readers check for new samples this often
+WRITER_CHECK_INTERVAL = 5 #s without new samples, after which a reader checks if the writer is still alive
+
+def ring_size(memory_mb):
+    #the size of the data part, from nmux_memory
+    return max(int(memory_mb*1e6)/4096, 2*WRITE_CHUNK/4096)*4096
+
+class ring_writer:
+
+    def __init__(self, path, data_size):
+        self.path = path
+        self.data_size = data_size
+        self.write_position = 0
+        temp_path = "%s.%d" % (path, os.getpid())
+        f = open(temp_path, "w+b")
+        f.truncate(HEADER_SIZE+data_size)
+        self.mm = mmap.mmap(f.fileno(), HEADER_SIZE+data_size)
+        f.close()
+        struct.pack_into(HEADER_FORMAT, self.mm, 0, MAGIC, data_size, 0, os.getpid(), 0)
+        os.rename(temp_path, path) #readers of a previous ring keep the old file until they close it
+        print >>sys.stderr, "[openwebrx-shmring] writing %d bytes of ring buffer at %s" % (data_size, path)
+
+    def write_from(self, f):
+        #reads into the ring, returns the number of bytes, 0 at the end of the file
+        offset = self.write_position%self.data_size
+        length = min(WRITE_CHUNK, self.data_size-offset)
+        count = f.readinto((ctypes.c_char*length).from_buffer(self.mm, HEADER_SIZE+offset))
+        if not count: return 0
+        self.write_position += count
+        struct.pack_into("<Q", self.mm, 16, self.write_position) #after the data: readers only read what is complete
+        return count
+
+    def close(self):
+        struct.pack_into("<Q", self.mm, 32, 1)
+        try: os.unlink(self.path)
+        except OSError: pass
+
+class ring_reader:
+
+    def __init__(self, path):
+        f = open(path, "rb")
+        self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        magic, self.data_size, write_position, self.writer_pid, closed = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if magic != MAGIC: raise IOError("not an OpenWebRX I/Q ring buffer: "+path)
+        self.position = write_position-write_position%ALIGN #we start with the newest samples
+        self.last_read = self.position #the start of the data we have returned last time
+        self.overruns = 0
+        self.skipped_bytes = 0
+
+    def write_position(self):
+        return struct.unpack_from("<Q", self.mm, 16)[0]
+
+    def writer_closed(self):
+        return struct.unpack_from("<Q", self.mm, 32)[0] != 0
+
+    def writer_alive(self):
+        if self.writer_closed(): return False
+        try: os.kill(self.writer_pid, 0)
+        except OSError as e: return e.errno == errno.EPERM
+        return True
+
+    def check_overrun(self, write_position):
+        #the writer may be writing WRITE_CHUNK bytes past write_position, over what is data_size bytes behind it
+        limit = write_position+WRITE_CHUNK-self.data_size
+        if self.last_read < limit and self.last_read < self.position:
+            self.overruns += 1 #what we have returned last time has been overwritten while the caller was using it
+        if self.position < limit:
+            new_position = write_position-write_position%ALIGN
+            if self.last_read >= limit: self.overruns += 1 #otherwise we have counted it already
+            self.skipped_bytes += new_position-self.position
+            self.position = new_position
+        self.last_read = self.position
+
+    def read(self, max_size=WRITE_CHUNK, block=True):
+        #returns a buffer that points into the ring, or "" at the end of the stream (or if there is nothing new and block is False)
+        idle_since = time.time()
+        while True:
+            write_position = self.write_position()
+            self.check_overrun(write_position)
+            available = (write_position-self.position)-(write_position-self.position)%ALIGN
+            if available > 0: break
+            if not block or self.writer_closed(): return ""
+            if time.time()-idle_since > WRITER_CHECK_INTERVAL: #it may have been killed before it could close
+                if not self.writer_alive(): return ""
+                idle_since = time.time()
+            time.sleep(POLL_INTERVAL)
+        offset = self.position%self.data_size
+        length = min(available, max_size-max_size%ALIGN, self.data_size-offset) #at the end of the ring we return less
+        self.position += length
+        return buffer(self.mm, HEADER_SIZE+offset, length)
+
+    def read_last(self, size):
+        #returns a copy of the newest size bytes (at most what the ring holds), for iqfile.recorder
+        write_position = self.write_position()
+        start = max(write_position-size, write_position+WRITE_CHUNK-self.data_size, 0)
+        start += (-start)%ALIGN
+        parts = []
+        position = start
+        while position < write_position:
+            offset = position%self.data_size
+            length = min(write_position-position, self.data_size-offset)
+            parts.append(self.mm[HEADER_SIZE+offset:HEADER_SIZE+offset+length])
+            position += length
+        #the writer may have overwritten the oldest bytes while we were copying them
+        damaged = self.write_position()+WRITE_CHUNK-self.data_size-start
+        data = "".join(parts)
+        if damaged > 0: data = data[damaged+(-damaged)%ALIGN:]
+        return data
+
+    def recv(self, max_size):
+        #so that it can be used instead of a socket
+        return self.read(max_size)
+
+    def close(self):
+        self.mm.close()
+
+def wait_for_writer(path, timeout=None):
+    started = time.time()
+    while timeout == None or time.time()-started < timeout:
+        try:
+            reader = ring_reader(path)
+            if reader.writer_alive():
+                reader.close()
+                return True
+            reader.close()
+        except (IOError, OSError, ValueError): pass #not created yet
+        time.sleep(0.1)
+    return False
+
+def open_iq_stream(nc_port, shm_path):
+    #something with a recv(), for the readers in Python: the ring buffer if there is one, a connection to nmux otherwise
+    if shm_path: return ring_reader(shm_path)
+    return socket.create_connection(("127.0.0.1", nc_port))
+
+def writer_command(shm_path, data_size):
+    #the end of start_rtl_command, instead of nmux
+    return "%s %s write %s %d" % (sys.executable, os.path.abspath(__file__), shm_path, data_size)
+
+def source_command(nc_port, shm_path):
+    #the start of a shell pipeline that outputs the I/Q stream
+    if shm_path: return "%s %s cat %s" % (sys.executable, os.path.abspath(__file__), shm_path)
+    return "nc -v 127.0.0.1 %d" % nc_port
+
+def writer_main(path, data_size):
+    writer = ring_writer(path, data_size)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) #so that readers learn from the header that we have stopped
+    stdin = io.FileIO(0, "r")
+    try:
+        while writer.write_from(stdin): pass
+    finally:
+        writer.close()
+
+def cat_main(path):
+    reader = ring_reader(path)
+    while True:
+        data = reader.read()
+        if not data: break
+        try: os.write(1, data)
+        except OSError: break #the chain has been stopped
+        if reader.overruns:
+            print >>sys.stderr, "[openwebrx-shmring] reader of %s has fallen behind, skipped %d bytes" % (path, reader.skipped_bytes)
+            reader.overruns = reader.skipped_bytes = 0
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "write": writer_main(sys.argv[2], int(sys.argv[3]))
+    elif len(sys.argv) == 3 and sys.argv[1] == "cat": cat_main(sys.argv[2])
+    else: print >>sys.stderr, "usage: shmring.py write <path> <data_size> | shmring.py cat <path>"
@@ -0,0 +1,407 @@
+"""
+OpenWebRX skimmer: decode every PSK31 signal in the band at once
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import sys
+import math
+import json
+import time
+import array
+import select
+import signal
+import socket
+import subprocess
+import threading
+import fanout
+import spectrum
+import npdsp
+import shmring
+
+try: import numpy
+except: numpy=None
+
+#How it works:
+#  - every few seconds, skimmer_service looks at the newest row of the spectrum thread, and tells the skimmer process
+#    the parts of the band where there is something above the noise floor (the bins of the main FFT are too wide to
+#    tell PSK31 signals apart, but they show where to look),
+#  - the skimmer process (this file, started by skimmer_service) reads the I/Q stream (see shmring.py), and cuts it into
+#    blocks. The FFT of a block is used twice: averaged, it shows the carriers inside those parts of the band with
+#    a resolution of a few Hz, and its bins around each carrier make the channel of a decoder (like npdsp.ddc, but
+#    the FFT is shared by all the channels),
+#  - the decoders come from a bounded pool: a new carrier gets one if there is one free, and gives it back when it
+#    has not been seen for HOLD_TIME seconds,
+#  - filtering, AFC and the estimation of the symbol timing run on all the channels at once, on [channel, sample]
+#    arrays. Only the bit decisions and the varicode decoding go channel by channel, at 31.25 symbols/s,
+#  - the decoded characters are written to stdout as JSON lines, and skimmer_service publishes them into a ring
+#    buffer, from which the clients that have sent "SET skimmer=1" read them.
+
+SYMBOL_RATE = 31.25
+CHANNEL_RATE = 500 #Hz, approximately: the sample rate of the channels
+IF_FFT_SIZE = 128 #samples of a channel made from one block
+IF_OVERLAP = 16
+CHANNEL_CUTOFF = 45.0 #Hz, of the channel filter
+DETECT_INTERVAL = 1.0 #s
+SNR_THRESHOLD_DB = 10
+MAX_SIGNAL_WIDTH = 120.0 #Hz, wider signals are not PSK31
+PEAK_WIDTH_DB = 20 #the width of a signal is measured this much below its peak
+MIN_SPACING = 40.0 #Hz between carriers
+HOLD_TIME = 10.0 #s
+REGION_THRESHOLD_DB = 6
+REGION_INTERVAL = 2.0 #s
+
+#PSK31 varicode, by character code
+VARICODE = ["1010101011", "1011011011", "1011101101", "1101110111", "1011101011", "1101011111", "1011101111", "1011111101",
+    "1011111111", "11101111", "11101", "1101101111", "1011011101", "11111", "1101110101", "1110101011",
+    "1011110111", "1011110101", "1110101101", "1110101111", "1101011011", "1101101011", "1101101101", "1101010111",
+    "1101111011", "1101111101", "1110110111", "1101010101", "1101011101", "1110111011", "1011111011", "1101111111",
+    "1", "111111111", "101011111", "111110101", "111011011", "1011010101", "1010111011", "101111111",
+    "11111011", "11110111", "101101111", "111011111", "1110101", "110101", "1010111", "110101111",
+    "10110111", "10111101", "11101101", "11111111", "101110111", "101011011", "101101011", "110101101",
+    "110101011", "110110111", "11110101", "110111101", "111101101", "1010101", "111010111", "1010101111",
+    "1010111101", "1111101", "11101011", "10101101", "10110101", "1110111", "11011011", "11111101",
+    "101010101", "1111111", "111111101", "101111101", "11010111", "10111011", "11011101", "10101011",
+    "11010101", "111011101", "10101111", "1101111", "1101101", "101010111", "110110101", "101011101",
+    "101110101", "101111011", "1010101101", "111110111", "111101111", "111111011", "1010111111", "101101101",
+    "1011011111", "1011", "1011111", "101111", "101101", "11", "111101", "1011011",
+    "101011", "1101", "111101011", "10111111", "11011", "111011", "1111", "111",
+    "111111", "110111111", "10101", "10111", "101", "110111", "1111011", "1101011",
+    "11011111", "1011101", "111010101", "1010110111", "110111011", "1010110101", "1011010111", "1110110101"]
+VARICODE_CHARACTERS = dict((code, chr(character)) for character, code in enumerate(VARICODE))
+
+class varicode_decoder:
+
+    def __init__(self):
+        self.bits = ""
+
+    def push(self, bit):
+        #returns the character if bit completes one
+        self.bits += "1" if bit else "0"
+        if self.bits.endswith("00"): #characters are separated by at least two zeros, and have none of them inside
+            code = self.bits[:-2].lstrip("0")
+            self.bits = ""
+            return VARICODE_CHARACTERS.get(code) if code else None
+        if len(self.bits) > 12: self.bits = "" #noise: no character is that long
+        return None
+
+class channel:
+    # The state of a decoder that works channel by channel.
+
+    def __init__(self, frequency, sample_index, samples_per_symbol):
+        self.frequency = frequency #offset from the center of the band, in Hz, corrected by the AFC
+        self.last_seen = time.time()
+        self.active = True #its carrier was there at the last detection
+        self.next_symbol_time = sample_index + samples_per_symbol/2.0 #index of the next sample to decide on, fractional
+        self.tail = numpy.zeros(2, dtype=numpy.complex64) #the last samples of the previous block, for the interpolation
+        self.last_symbol = 0j
+        self.varicode = varicode_decoder()
+        self.text = ""
+
+class skimmer_dsp:
+
+    def __init__(self, samp_rate, max_channels):
+        self.samp_rate = samp_rate
+        self.max_channels = max_channels
+        self.decimation = npdsp.smooth_decimation(samp_rate, CHANNEL_RATE)
+        self.channel_rate = float(samp_rate)/self.decimation
+        self.samples_per_symbol = self.channel_rate/SYMBOL_RATE
+        self.fft_size = self.decimation*IF_FFT_SIZE
+        self.hop = self.decimation*(IF_FFT_SIZE-IF_OVERLAP)
+        self.bin_width = float(samp_rate)/self.fft_size
+        taps_length = self.decimation*IF_OVERLAP+1
+        taps = npdsp.lowpass_taps(0.5/self.decimation-1.65/taps_length, taps_length)
+        self.if_bins = (numpy.fft.fftfreq(IF_FFT_SIZE)*IF_FFT_SIZE).astype(numpy.int64)
+        self.response = (numpy.fft.fft(taps, self.fft_size)[self.if_bins%self.fft_size]/self.decimation).astype(numpy.complex64)
+        channel_taps_length = int(3.3*self.channel_rate/20.0)|1 #20 Hz transition band
+        self.channel_taps_length = channel_taps_length
+        self.filter_size = 1
+        while self.filter_size < IF_FFT_SIZE-IF_OVERLAP+channel_taps_length-1: self.filter_size *= 2
+        self.channel_response = numpy.fft.fft(npdsp.lowpass_taps(CHANNEL_CUTOFF/self.channel_rate, channel_taps_length), self.filter_size)
+        self.buffer = numpy.zeros(self.fft_size-self.hop, dtype=numpy.complex64)
+        self.power = numpy.zeros(self.fft_size, dtype=numpy.float32) #averaged, in FFT order (not centered)
+        self.block_count = 0
+        self.sample_index = 0 #of the channels, for the symbol timing
+        self.channels = [] #channel objects, the arrays below have a row for each of them
+        self.bin_shift = numpy.zeros(0, dtype=numpy.int64)
+        self.block_phase = numpy.zeros(0)
+        self.nco_phase = numpy.zeros(0)
+        self.history = numpy.zeros((0, channel_taps_length-1), dtype=numpy.complex64)
+        self.afc = numpy.zeros(0, dtype=numpy.complex128)
+        self.timing = numpy.zeros(0, dtype=numpy.complex128)
+        self.regions = None #list of (low, high) offsets where carriers are searched, None means everywhere
+
+    def add_channel(self, frequency):
+        self.channels.append(channel(frequency, self.sample_index, self.samples_per_symbol))
+        self.bin_shift = numpy.append(self.bin_shift, int(round(frequency/self.bin_width)))
+        self.block_phase = numpy.append(self.block_phase, 0.0)
+        self.nco_phase = numpy.append(self.nco_phase, 0.0)
+        self.history = numpy.vstack((self.history, numpy.zeros((1, self.channel_taps_length-1), dtype=numpy.complex64)))
+        self.afc = numpy.append(self.afc, 0j)
+        self.timing = numpy.append(self.timing, 0j)
+
+    def remove_channels(self, keep):
+        #keep is a list of booleans, one for each channel
+        self.channels = [c for c, k in zip(self.channels, keep) if k]
+        keep = numpy.array(keep, dtype=bool)
+        self.bin_shift, self.block_phase, self.nco_phase = self.bin_shift[keep], self.block_phase[keep], self.nco_phase[keep]
+        self.history, self.afc, self.timing = self.history[keep], self.afc[keep], self.timing[keep]
+
+    def process(self, samples):
+        #returns a list of (frequency, text) decoded from the samples
+        self.buffer = numpy.concatenate((self.buffer, samples))
+        output = []
+        while len(self.buffer) >= self.fft_size:
+            block = numpy.fft.fft(self.buffer[:self.fft_size])
+            self.buffer = self.buffer[self.hop:]
+            power = (block.real**2+block.imag**2).astype(numpy.float32)
+            self.power = power if self.block_count == 0 else 0.8*self.power+0.2*power
+            self.block_count += 1
+            if self.channels: output += self.process_channels(block)
+            self.sample_index += IF_FFT_SIZE-IF_OVERLAP
+        return output
+
+    def process_channels(self, block):
+        length = IF_FFT_SIZE-IF_OVERLAP
+        n = numpy.arange(length)
+        #shift and decimate: the bins around each carrier, then a small inverse FFT (see npdsp.ddc)
+        bins = (self.if_bins[numpy.newaxis,:]+self.bin_shift[:,numpy.newaxis])%self.fft_size
+        x = numpy.fft.ifft(block[bins]*self.response, axis=1)[:,IF_OVERLAP:]
+        x *= numpy.exp(1j*self.block_phase)[:,numpy.newaxis]
+        self.block_phase = (self.block_phase-2*math.pi*self.bin_shift*self.hop/float(self.fft_size))%(2*math.pi)
+        #the rest of the shift, which is less than a bin
+        residual = numpy.array([c.frequency for c in self.channels])-self.bin_shift*self.bin_width
+        phase_step = -2*math.pi*residual/self.channel_rate
+        x *= numpy.exp(1j*(self.nco_phase[:,numpy.newaxis]+phase_step[:,numpy.newaxis]*n))
+        self.nco_phase = (self.nco_phase+phase_step*length)%(2*math.pi)
+        #channel filter, with overlap-save along the rows
+        x = numpy.hstack((self.history, x.astype(numpy.complex64)))
+        self.history = x[:,length:]
+        y = numpy.fft.ifft(numpy.fft.fft(x, self.filter_size, axis=1)*self.channel_response, axis=1)[:,self.channel_taps_length-1:self.channel_taps_length-1+length]
+        #AFC: the square of a BPSK signal has no modulation, only a carrier at twice the frequency error
+        squared = y*y
+        self.afc = 0.7*self.afc+numpy.sum(squared[:,1:]*numpy.conj(squared[:,:-1]), axis=1)
+        frequency_error = numpy.angle(self.afc)/2*self.channel_rate/(2*math.pi)
+        #symbol timing: the envelope of PSK31 has its maximum in the middle of the symbols (Oerder & Meyr)
+        envelope = y.real**2+y.imag**2
+        self.timing = 0.7*self.timing+numpy.sum(envelope*numpy.exp(-2j*math.pi*(self.sample_index+n)/self.samples_per_symbol), axis=1)
+        symbol_center = (-numpy.angle(self.timing)/(2*math.pi)*self.samples_per_symbol)%self.samples_per_symbol
+        output = []
+        for i, c in enumerate(self.channels):
+            if c.active: c.frequency += 0.2*frequency_error[i] #on noise alone it would wander away
+            if abs(c.frequency-self.bin_shift[i]*self.bin_width) > self.bin_width:
+                self.bin_shift[i] = int(round(c.frequency/self.bin_width))
+            text = self.decide(c, y[i], symbol_center[i])
+            if text and c.active: output.append((c.frequency, text)) #squelch: no carrier, no text
+        return output
+
+    def decide(self, c, samples, symbol_center):
+        #samples the symbols of a channel, and decodes them
+        samples = numpy.concatenate((c.tail, samples))
+        first_index = self.sample_index-len(c.tail)
+        sps = self.samples_per_symbol
+        text = ""
+        while True:
+            symbol_time = c.next_symbol_time+0.3*((symbol_center-c.next_symbol_time+sps/2)%sps-sps/2) #towards the center
+            if symbol_time >= first_index+len(samples)-1: break #in the next block
+            c.next_symbol_time = symbol_time
+            position = max(0.0, symbol_time-first_index)
+            index = int(position)
+            fraction = position-index
+            symbol = samples[index]*(1-fraction)+samples[index+1]*fraction
+            character = c.varicode.push((symbol*numpy.conj(c.last_symbol)).real > 0) #no phase reversal: 1
+            if character: text += character
+            c.last_symbol = symbol
+            c.next_symbol_time += sps
+        c.tail = samples[-2:]
+        return text
+
+    def centered_power(self):
+        #the averaged power spectrum, from -samp_rate/2 to samp_rate/2
+        return numpy.fft.fftshift(self.power)
+
+    def find_carriers(self):
+        #returns the frequencies of the PSK31 carriers, from the averaged power spectrum
+        smoothing = max(1, int(SYMBOL_RATE/self.bin_width)) #the idle doublet (two lines at +-SYMBOL_RATE/2) becomes one peak
+        power = numpy.convolve(self.centered_power(), numpy.ones(smoothing)/float(smoothing), mode="same")
+        floor = numpy.median(power[::16])
+        threshold = floor*10**(SNR_THRESHOLD_DB/10.0)
+        #the candidates are the maxima of their neighbourhood, this way the skirts of a strong signal are not taken for carriers
+        half_window = max(1, int(MIN_SPACING/2/self.bin_width))
+        local_maximum = numpy.copy(power)
+        for shift in range(1, half_window+1):
+            local_maximum[shift:] = numpy.maximum(local_maximum[shift:], power[:-shift])
+            local_maximum[:-shift] = numpy.maximum(local_maximum[:-shift], power[shift:])
+        carriers = []
+        for peak in numpy.flatnonzero((power == local_maximum) & (power > threshold)):
+            #the width of the signal, PEAK_WIDTH_DB below its maximum
+            level = max(threshold, power[peak]*10**(-PEAK_WIDTH_DB/10.0))
+            start = self.signal_edge(power, peak, -1, level)
+            end = self.signal_edge(power, peak, 1, level)+1
+            if (end-start)*self.bin_width > MAX_SIGNAL_WIDTH: continue #not PSK31
+            weights = power[start:end]
+            frequency = (numpy.sum(weights*numpy.arange(start, end))/numpy.sum(weights)-self.fft_size/2)*self.bin_width
+            if self.regions != None and not any(low <= frequency <= high for low, high in self.regions): continue
+            carriers.append(frequency)
+        return carriers
+
+    def signal_edge(self, power, peak, step, level):
+        #walks from the peak until the power falls below level, or until a deep valley (the next signal begins there)
+        valley = index = peak
+        while 0 <= index+step < len(power) and power[index+step] > level:
+            index += step
+            if power[index] < power[valley]: valley = index
+            elif power[index] > 2*power[valley] and power[valley] < power[peak]*10**(-SNR_THRESHOLD_DB/10.0): return valley
+        return index
+
+    def update_channels(self):
+        #starts decoders on the new carriers, and stops the ones whose carrier has disappeared
+        now = time.time()
+        for c in self.channels: c.active = False
+        for frequency in self.find_carriers():
+            known = [c for c in self.channels if abs(c.frequency-frequency) < MIN_SPACING/2]
+            for c in known: c.last_seen, c.active = now, True
+            if not known and len(self.channels) < self.max_channels: self.add_channel(frequency)
+        keep = [now-c.last_seen < HOLD_TIME for c in self.channels]
+        if not all(keep): self.remove_channels(keep)
+
+def skimmer_main(nc_port, shm_path, samp_rate, format_conversion, max_channels):
+    #the skimmer process: reads the I/Q stream, and the regions to search from stdin
+    dsp = skimmer_dsp(samp_rate, max_channels)
+    print >>sys.stderr, "[openwebrx-skimmer] decimation = %d, channel rate = %g Hz, resolution = %g Hz" % (dsp.decimation, dsp.channel_rate, dsp.bin_width)
+    stream = shmring.open_iq_stream(nc_port, shm_path)
+    from_ring = not isinstance(stream, socket.socket) #it has no fd to wait for, we poll it
+    sample_size = npdsp.input_sample_size(format_conversion)
+    leftover = ""
+    last_detect = time.time()
+    commands = ""
+    while True:
+        readable = select.select([sys.stdin] if from_ring else [stream, sys.stdin], [], [], shmring.POLL_INTERVAL if from_ring else None)[0]
+        if sys.stdin in readable:
+            data = os.read(sys.stdin.fileno(), 65536)
+            if not data: break #OpenWebRX has exited
+            commands += data
+            while "\n" in commands:
+                line, commands = commands.split("\n", 1)
+                command = json.loads(line)
+                if "regions" in command: dsp.regions = command["regions"]
+        if from_ring:
+            data = stream.read(262144, block=False)
+            if not data and stream.writer_closed(): break
+        elif stream in readable:
+            data = stream.recv(262144)
+            if not data: break
+        else: data = ""
+        if not data: continue
+        if leftover: data = leftover+str(data)
+        usable = len(data)-len(data)%sample_size
+        leftover = data[usable:]
+        if usable < len(data): data = data[:usable]
+        for frequency, text in dsp.process(npdsp.convert_input(data, format_conversion)):
+            sys.stdout.write(json.dumps({"freq": round(frequency, 1), "text": text})+"\n")
+        if time.time()-last_detect >= DETECT_INTERVAL:
+            last_detect = time.time()
+            dsp.update_channels()
+            sys.stdout.write(json.dumps({"channels": len(dsp.channels)})+"\n")
+        sys.stdout.flush()
+
+def spectrum_db(row, fft_compression):
+    #the bins of a row of the spectrum ring, in dB
+    if isinstance(row, spectrum.spectrum_row):
+        data, offset = row.levels[0]
+        if row.format == spectrum.FORMAT_FLOAT32: return array.array("f", data).tolist()
+        return [offset+value*spectrum.UINT8_STEP for value in bytearray(data)]
+    if fft_compression == "adpcm": return [value/100.0 for value in npdsp.ima_adpcm_decode(row)[10:]] #COMPRESS_FFT_PAD_N samples of padding
+    return array.array("f", row).tolist()
+
+class skimmer_service:
+
+    def __init__(self, nc_port, shm_path, samp_rate, center_freq, format_conversion, max_channels, spectrum_ring, fft_compression):
+        self.nc_port = nc_port
+        self.shm_path = shm_path #of the I/Q ring buffer, if there is one, see shmring.py
+        self.samp_rate = samp_rate
+        self.center_freq = center_freq
+        self.format_conversion = format_conversion
+        self.max_channels = max_channels
+        self.spectrum_reader = spectrum_ring.reader()
+        self.fft_compression = fft_compression
+        self.ring = fanout.ring_buffer(256) #of "SKM " messages
+        self.channels = 0
+        self.characters = 0
+        self.process = None
+        self.scheduler = None #affinity.scheduler to place the process group on a core with
+
+    def start(self):
+        command = [sys.executable, os.path.abspath(__file__), str(self.nc_port), self.shm_path or "", str(self.samp_rate), self.format_conversion, str(self.max_channels)]
+        preexec_function = self.scheduler.preexec(self, "digimode") if self.scheduler else os.setpgrp
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, preexec_fn=preexec_function)
+        if self.scheduler: self.scheduler.placed(self, "skimmer", "digimode", self.process.pid)
+        for target in (self.read_function, self.regions_function):
+            thread = threading.Thread(target = target, args = ())
+            thread.daemon = True
+            thread.start()
+        print "[openwebrx-skimmer] started with at most %d decoders" % self.max_channels
+
+    def read_function(self):
+        while True:
+            line = self.process.stdout.readline()
+            if not line: break
+            message = json.loads(line)
+            if "channels" in message: self.channels = message["channels"]
+            if "text" in message:
+                self.characters += len(message["text"])
+                self.ring.publish(json.dumps({"freq": int(self.center_freq+message["freq"]), "text": message["text"]}))
+        print "[openwebrx-skimmer] skimmer process has exited"
+
+    def regions_function(self):
+        while self.process.poll() == None:
+            time.sleep(REGION_INTERVAL)
+            rows = self.spectrum_reader.read()
+            if not rows: continue
+            try: self.process.stdin.write(json.dumps({"regions": self.find_regions(spectrum_db(rows[-1], self.fft_compression))})+"\n")
+            except IOError: break #it has exited
+            self.process.stdin.flush()
+
+    def find_regions(self, bins):
+        #the parts of the band above the noise floor, as (low, high) offsets in Hz, widened by a bin on both sides
+        floor = sorted(bins)[len(bins)/2]
+        bin_width = float(self.samp_rate)/len(bins)
+        regions = []
+        for i, value in enumerate(bins):
+            if value < floor+REGION_THRESHOLD_DB: continue
+            low = (i-len(bins)/2-1)*bin_width
+            if regions and regions[-1][1] >= low: regions[-1][1] = low+3*bin_width
+            else: regions.append([low, low+3*bin_width])
+        return regions
+
+    def reader(self):
+        return self.ring.reader()
+
+    def stop(self):
+        if not self.process: return
+        try: os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
+        except OSError: pass
+        if self.scheduler: self.scheduler.release(self)
+
+if __name__ == "__main__":
+    if not numpy:
+        print >>sys.stderr, "[openwebrx-skimmer] NumPy is needed for the skimmer"
+        sys.exit(1)
+    skimmer_main(int(sys.argv[1]), sys.argv[2], int(sys.argv[3]), sys.argv[4], int(sys.argv[5]))
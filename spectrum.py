@@ -0,0 +1,263 @@
+"""
+OpenWebRX spectrum: a pyramid of decimated FFT rows, so that each client gets only what it can display
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import sys
+import time
+import zlib
+import struct
+import array
+import math
+import demodshare
+
+try: import numpy
+except: numpy=None
+
+#How it works:
+#  - the spectrum thread gets each FFT row from csdr as float (in dB), and makes the levels of the pyramid from it:
+#    level 0 is the row itself, and each next level has half as many bins, each one the maximum of two bins of the
+#    previous level (so that narrow signals do not disappear when zoomed out),
+#  - each level is encoded once per row (as float, or as 8 bits per bin if fft_compression is "adpcm"),
+#  - a client tells its view with "SET fft_view=<start>,<end>,<width>" (start and end are relative to the whole band,
+#    width is in pixels), and gets the coarsest level that still has a bin per pixel, only in the range of the view.
+#    Until it does, it gets the whole row in an "FFT " message, as without the pyramid (compressed as by
+#    `csdr compress_fft_adpcm_f_u8` if fft_compression is "adpcm"),
+#  - clients that answer "SET fft_codec=delta" to fft_codecs=delta in the setup message get FFTD messages instead:
+#    the 8 bit bins are predicted from the previous rows the client has got, and only the difference is sent,
+#    deflated. Each client has its own delta_encoder, as the pacer gives each one different rows.
+#    The prediction is an average of the previous rows (ema), not the previous row: the noise of two rows is
+#    independent, so a difference to one row would have twice the noise in it.
+#    The offset of the 8 bit bins only changes if the noise floor moves a lot (OFFSET_HYSTERESIS), as every change
+#    needs a keyframe.
+#
+#Format of the FFTL message, after the "FFTL" id (little endian):
+#  uint8 format (0: float32, 1: uint8), uint8 level, uint16 reserved, uint32 level_size, uint32 first_bin, float32 offset
+#  followed by the bins. With uint8 bins, the value in dB is offset+bin/2.
+#Format of the FFTD message, after the "FFTD" id (little endian):
+#  uint8 flags (1: keyframe), uint8 level, uint16 reserved, uint32 level_size, uint32 first_bin, uint32 bin_count,
+#  float32 offset, followed by bin_count residuals as a raw deflate stream. For each bin, with ema (int32) kept by
+#  both sides: bin=(((ema+8)>>4)+residual)&255, then ema+=(bin*16-ema)>>2. On a keyframe, the prediction is 0 and ema
+#  starts from bin*16. The value in dB is offset+bin/2, as with FFTL.
+
+FORMAT_FLOAT32 = 0
+FORMAT_UINT8 = 1
+HEADER = struct.Struct("<BBHIIf")
+UINT8_STEP = 0.5 #dB
+MIN_LEVEL_SIZE = 64 #bins
+VIEW_MARGIN = 0.125 #of the width of the view, added on both sides so that small pans do not show empty areas
+OFFSET_HYSTERESIS = 20 #dB
+DELTA_HEADER = struct.Struct("<BBHIIIf")
+DELTA_KEYFRAME = 1
+DEFLATE_LEVEL = 1 #the residuals are mostly noise, higher levels make them only slower
+COMPRESS_FFT_PAD_N = 10 #bins, as in csdr and openwebrx.js
+
+def compress_fft_adpcm(data):
+    #the same as `csdr compress_fft_adpcm_f_u8`: the row is padded with copies of its first bin (so that the ADPCM
+    #decoder has settled by the first real bin), converted to 1/100 dB in 16 bits, and coded from a reset state
+    if numpy:
+        bins = numpy.frombuffer(data, dtype=numpy.float32)
+        padded = numpy.concatenate((numpy.repeat(bins[:1], COMPRESS_FFT_PAD_N), bins))
+        pcm = numpy.clip(padded*100, -32768, 32767).astype(numpy.int16).tostring()
+    else:
+        bins = array.array("f", data)
+        pcm = array.array("h", (int(max(-32768, min(32767, value*100))) for value in [bins[0]]*COMPRESS_FFT_PAD_N+bins.tolist())).tostring()
+    return demodshare.audio_encoder().encode(pcm)
+
+def max_hold(bins):
+    #halves the number of bins
+    if numpy: return numpy.maximum(bins[0::2], bins[1::2])
+    return array.array("f", map(max, bins[0::2], bins[1::2]))
+
+class spectrum_row:
+    # One FFT row, encoded at every level of the pyramid.
+
+    def __init__(self, levels, format, quantized=None, source=None):
+        self.levels = levels # list of (encoded bins, offset)
+        self.source = source #the row from csdr, as float
+        self.whole_row = None #made by whole() for the first client that needs it
+        self.quantized = quantized # list of (uint8 NumPy array, offset), for delta_encoder
+        self.format = format
+        self.bytes_per_bin = 4 if format == FORMAT_FLOAT32 else 1
+
+    def slice(self, level, first_bin, bin_count):
+        #returns the FFTL message (without the "FFTL" id)
+        data, offset = self.levels[level]
+        level_size = len(data)/self.bytes_per_bin
+        return HEADER.pack(self.format, level, 0, level_size, first_bin, offset) + \
+            data[first_bin*self.bytes_per_bin:(first_bin+bin_count)*self.bytes_per_bin]
+
+    def whole(self):
+        #returns the "FFT " message (without the id), for the clients that have not told their view yet
+        if self.whole_row == None: self.whole_row = compress_fft_adpcm(self.source) if self.format == FORMAT_UINT8 else self.source
+        return self.whole_row
+
+class spectrum_pyramid:
+
+    def __init__(self, fft_size, levels, fft_compression, delta_codec=False):
+        self.fft_size = fft_size
+        self.level_sizes = [fft_size]
+        while len(self.level_sizes) < levels and self.level_sizes[-1]%2 == 0 and self.level_sizes[-1]/2 >= MIN_LEVEL_SIZE:
+            self.level_sizes.append(self.level_sizes[-1]/2)
+        self.format = FORMAT_UINT8 if fft_compression == "adpcm" else FORMAT_FLOAT32
+        self.delta_codec = delta_codec and numpy != None
+        self.offsets = [None]*len(self.level_sizes)
+
+    def level_count(self):
+        return len(self.level_sizes)
+
+    def offset(self, level, minimum):
+        #the offset follows the noise floor, so that 128 dB above it fits into 8 bits, but it only moves if it has to
+        offset = self.offsets[level]
+        if offset == None or minimum < offset or minimum > offset+OFFSET_HYSTERESIS:
+            offset = self.offsets[level] = math.floor(minimum)-OFFSET_HYSTERESIS/2
+        return offset
+
+    def quantize(self, level, bins):
+        offset = self.offset(level, float(numpy.min(bins)))
+        return (numpy.clip(numpy.round((bins-offset)/UINT8_STEP), 0, 255).astype(numpy.uint8), offset)
+
+    def encode(self, level, bins):
+        #returns the bins for FFTL, and the quantized bins for delta_encoder (or None)
+        if self.format == FORMAT_FLOAT32:
+            return ((bins.astype(numpy.float32).tostring() if numpy else bins.tostring()), 0.0), \
+                (self.quantize(level, bins) if self.delta_codec else None)
+        if numpy:
+            quantized, offset = self.quantize(level, bins)
+            return (quantized.tostring(), offset), (quantized, offset)
+        offset = self.offset(level, min(bins))
+        return (str(bytearray(max(0, min(255, int((value-offset)/UINT8_STEP+0.5))) for value in bins)), offset), None
+
+    def make_row(self, data):
+        #data is a row from `csdr fft_exchange_sides_ff`, as float
+        bins = numpy.frombuffer(data, dtype=numpy.float32) if numpy else array.array("f", data)
+        levels = []
+        quantized = []
+        for level in xrange(len(self.level_sizes)):
+            if level: bins = max_hold(bins)
+            encoded, quantized_bins = self.encode(level, bins)
+            levels.append(encoded)
+            quantized.append(quantized_bins)
+        return spectrum_row(levels, self.format, quantized if self.delta_codec else None, data)
+
+    def select(self, start, end, width):
+        #returns (level, first_bin, bin_count) for a view
+        start = max(0.0, min(start, 1.0))
+        end = max(start, min(end, 1.0))
+        level = 0
+        while level+1 < len(self.level_sizes) and (end-start)*self.level_sizes[level+1] >= width: level += 1
+        margin = (end-start)*VIEW_MARGIN
+        level_size = self.level_sizes[level]
+        first_bin = min(level_size-1, max(0, int(math.floor((start-margin)*level_size))))
+        last_bin = min(level_size, int(math.ceil((end+margin)*level_size)))
+        return (level, first_bin, max(1, last_bin-first_bin))
+
+class delta_encoder:
+    # The FFTD messages of one client, see above.
+
+    def __init__(self):
+        self.view = None #(level, first_bin, bin_count, offset) of the previous row, a change needs a keyframe
+        self.ema = None
+
+    def keyframe(self):
+        #the next row will be a keyframe
+        self.view = None
+
+    def encode(self, row, level, first_bin, bin_count):
+        #returns the FFTD message (without the "FFTD" id)
+        quantized, offset = row.quantized[level]
+        bins = quantized[first_bin:first_bin+bin_count].astype(numpy.int32)
+        view = (level, first_bin, len(bins), offset)
+        if view != self.view:
+            residuals = bins
+            self.ema = bins*16
+            self.view = view
+        else:
+            residuals = bins-((self.ema+8)>>4)
+            self.ema += (bins*16-self.ema)>>2
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+        return DELTA_HEADER.pack(DELTA_KEYFRAME if residuals is bins else 0, level, 0, len(quantized), first_bin, len(bins), offset) + \
+            compressor.compress(residuals.astype(numpy.uint8).tostring()) + compressor.flush()
+
+def synthetic_rows(fft_size, count, averages):
+    #noise with a few carriers, the spectrum of some band
+    rows = []
+    t = numpy.arange(fft_size*averages)
+    shape = 1+3*numpy.exp(-((numpy.arange(fft_size)-fft_size/2)/(fft_size/4.0))**2) #like the passband of a receiver
+    for i in xrange(count):
+        iq = (numpy.random.randn(fft_size*averages)+1j*numpy.random.randn(fft_size*averages))*0.01
+        for frequency, amplitude in ((0.1, 0.5), (0.23, 0.05), (-0.3, 0.002*(1+math.sin(i/5.0)))):
+            iq += amplitude*numpy.exp(2j*math.pi*frequency*(t+i*len(t)))
+        power = numpy.abs(numpy.fft.fftshift(numpy.fft.fft(iq.reshape(averages, fft_size)*numpy.hanning(fft_size), axis=1), axes=1))**2
+        rows.append((10*numpy.log10(power.mean(0)*shape/fft_size)).astype(numpy.float32).tostring())
+    return rows
+
+def benchmark(rows_file=None, fft_size=4096):
+    #compares the bytes per row and the CPU time of the FFT formats, on rows from `csdr fft_exchange_sides_ff` (float) or
+    #on synthetic ones
+    import os
+    import subprocess
+    import npdsp
+    if rows_file:
+        data = open(rows_file, "rb").read()
+        rows = [data[i:i+fft_size*4] for i in xrange(0, len(data)-fft_size*4+1, fft_size*4)]
+    else:
+        numpy.random.seed(1)
+        rows = synthetic_rows(fft_size, 50, 90) #90 averages: fft_fps=9 and fft_voverlap_factor=0.3 at 2.4 Msps
+    print "%d rows of %d bins, %s" % (len(rows), fft_size, rows_file or "synthetic")
+    def report(name, size, cpu):
+        print "%-32s %8.0f bytes/row %8s" % (name, size, ("%.0f us/row" % (cpu*1e6)) if cpu != None else "")
+    report("none (float)", fft_size*4, None)
+    report("adpcm (compress_fft_adpcm_f_u8)", fft_size/2+5, None)
+    if os.system("csdr 2> /dev/null") != 32512:
+        process = subprocess.Popen(["csdr", "compress_fft_adpcm_f_u8", str(fft_size)], stdin=subprocess.PIPE, stdout=open(os.devnull, "w"))
+        before = os.times()
+        process.communicate("".join(rows)*20)
+        after = os.times()
+        report("  csdr, child CPU time", fft_size/2+5, (after[2]+after[3]-before[2]-before[3])/len(rows)/20)
+    else: print "  (csdr is not installed, the CPU time of adpcm is not measured)"
+    #the 8 bit bins are made once per row for all clients, the delta coding is done for each client
+    pyramid = spectrum_pyramid(fft_size, 1, "adpcm", True)
+    encoder = delta_encoder()
+    quantize_cpu = encode_cpu = 0.0
+    uint8_size = delta_size = 0
+    for data in rows*4:
+        start = time.time()
+        row = pyramid.make_row(data)
+        quantize_cpu += time.time()-start
+        uint8_size += len(row.slice(0, 0, fft_size))-HEADER.size
+        start = time.time()
+        delta_size += len(encoder.encode(row, 0, 0, fft_size))
+        encode_cpu += time.time()-start
+    report("uint8 (FFTL, 0.5 dB), per row", float(uint8_size)/len(rows)/4, quantize_cpu/len(rows)/4)
+    report("delta (FFTD), per client", float(delta_size)/len(rows)/4, encode_cpu/len(rows)/4)
+    #the error of ADPCM, padded as in csdr: it has to catch up with the first bins
+    errors = []
+    for data in rows[:10]:
+        bins = numpy.frombuffer(data, dtype=numpy.float32)
+        decoded = numpy.array(npdsp.ima_adpcm_decode(compress_fft_adpcm(data))[COMPRESS_FFT_PAD_N:])/100.0
+        errors.append(numpy.abs(decoded-bins))
+    errors = numpy.concatenate(errors)
+    print "error: adpcm %.2f dB mean, %.2f dB max; uint8 and delta %.2f dB mean, %.2f dB max" % \
+        (numpy.mean(errors), numpy.max(errors), UINT8_STEP/4, UINT8_STEP/2)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "benchmark": benchmark(sys.argv[2] if len(sys.argv) > 2 else None, int(sys.argv[3]) if len(sys.argv) > 3 else 4096)
+    else: print >>sys.stderr, "usage: spectrum.py benchmark [<file of float FFT rows> [<fft_size>]]"
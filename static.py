@@ -0,0 +1,137 @@
+"""
+OpenWebRX static: serve the files in htdocs from memory, with ETag and gzip
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import gzip
+import md5
+import mimetypes
+import cStringIO
+
+#How it works:
+#  - the files are read once, at startup, with their gzip compressed version and ETag,
+#  - on each request we only stat() the file, and read it again if it has been modified meanwhile,
+#  - the browser revalidates them with If-None-Match, and gets a 304 if it has them already,
+#  - .wrx templates are filled in at startup with everything but %[CLIENT_ID], so a request only has to join
+#    the parts with the new client id.
+
+COMPRESSIBLE_TYPES = ("text/html", "text/javascript", "text/css", "image/svg+xml", "application/json")
+CONTENT_TYPES = { "wrx": "text/html", "html": "text/html", "htm": "text/html", "js": "text/javascript", "css": "text/css" }
+
+def gzip_compress(data, level=9):
+    buf = cStringIO.StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=level, mtime=0) #mtime=0: the same data gives the same bytes
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+def accepts_gzip(headers):
+    return "gzip" in headers.get("accept-encoding", "")
+
+class static_file:
+
+    def __init__(self, path, mtime, data, template_values):
+        self.path = path
+        self.mtime = mtime
+        extension = path.rsplit(".", 1)[-1].lower()
+        self.content_type = CONTENT_TYPES.get(extension) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if extension == "wrx":
+            self.template = compile_template(data, template_values)
+            return
+        self.template = None
+        self.data = data
+        self.etag = '"%s"' % md5.md5(data).hexdigest()[:16]
+        self.gzip_data = None
+        if self.content_type in COMPRESSIBLE_TYPES:
+            compressed = gzip_compress(data)
+            if len(compressed) < len(data): self.gzip_data = compressed
+
+    def send(self, handler):
+        #sends the file to a BaseHTTPRequestHandler
+        use_gzip = self.gzip_data and accepts_gzip(handler.headers)
+        etag = self.etag[:-1]+'-gz"' if use_gzip else self.etag #the two versions are different bodies
+        if_none_match = handler.headers.get("if-none-match", "")
+        if etag in if_none_match or if_none_match.strip() == "*":
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.end_headers()
+            return
+        body = self.gzip_data if use_gzip else self.data
+        handler.send_response(200)
+        handler.send_header("Content-type", self.content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.send_header("ETag", etag)
+        handler.send_header("Cache-Control", "no-cache") #the browser may keep it, but has to revalidate it
+        if self.gzip_data: handler.send_header("Vary", "Accept-Encoding")
+        if use_gzip: handler.send_header("Content-Encoding", "gzip")
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def send_template(self, handler, client_id):
+        #.wrx pages contain a new client id every time, they cannot be cached
+        body = client_id.join(self.template)
+        handler.send_response(200)
+        handler.send_header("Content-type", self.content_type)
+        handler.send_header("Cache-Control", "no-store")
+        if accepts_gzip(handler.headers):
+            body = gzip_compress(body, 6)
+            handler.send_header("Content-Encoding", "gzip")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+def compile_template(data, template_values):
+    #returns the parts of the page between the %[CLIENT_ID] placeholders
+    for key, value in template_values:
+        data = data.replace(key, value)
+    return data.split("%[CLIENT_ID]")
+
+class static_files:
+
+    def __init__(self, rootdir, template_values):
+        self.rootdir = os.path.abspath(rootdir)
+        self.template_values = template_values # (placeholder, value) pairs for .wrx files
+        self.files = {}
+        for dirpath, dirnames, filenames in os.walk(self.rootdir):
+            for filename in filenames: self.load("/"+os.path.relpath(os.path.join(dirpath, filename), self.rootdir))
+        print "[openwebrx-static] %d files loaded from %s" % (len(self.files), rootdir)
+
+    def load(self, path):
+        filename = os.path.abspath(self.rootdir+path)
+        if not filename.startswith(self.rootdir+os.sep): raise IOError("not in "+self.rootdir)
+        try: mtime = os.stat(filename).st_mtime
+        except OSError as e: raise IOError(*e.args) #the caller answers IOError with 404
+        f = open(filename, "rb")
+        data = f.read()
+        f.close()
+        self.files[path] = static_file(path, mtime, data, self.template_values)
+        return self.files[path]
+
+    def get(self, path):
+        #raises IOError if the file does not exist
+        cached = self.files.get(path)
+        if cached:
+            try: mtime = os.stat(self.rootdir+path).st_mtime
+            except OSError:
+                del self.files[path]
+                raise IOError("deleted: "+path)
+            if mtime == cached.mtime: return cached
+        return self.load(path) #new or modified
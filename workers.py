@@ -0,0 +1,239 @@
+"""
+OpenWebRX workers: serve the WebSocket clients from several processes, so that they are not limited by the GIL
+
+    This file is part of OpenWebRX,
+    an open-source SDR receiver software with a web UI.
+    Copyright (c) 2013-2015 by Andras Retzler <randras@sdr.hu>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import sys
+import errno
+import signal
+import socket
+import struct
+import threading
+import traceback
+import multiprocessing
+import _multiprocessing #sendfd() and recvfd(), as Python 2 has no socket.sendmsg()
+import fanout
+
+#How it works:
+#  - the main process forks the workers at startup, and keeps a pair of Unix sockets to each of them:
+#     - the control socket: the main process sends the WebSocket connections over it (the fd, after the handshake),
+#       and the worker answers with a line when a client of it has been closed,
+#     - the feed socket: the main process sends the FFT rows, the skimmer messages and the broadcast messages over it,
+#       as messages of FEED_HEADER + payload. A feeder thread sends them for each worker, from its own ring_reader, so
+#       a slow worker only skips rows, it does not hold up the spectrum thread or the other workers,
+#  - a worker runs the "evented" server_mode for the clients it gets: an event loop, the DSPs of the clients (they
+#    read the I/Q samples from nmux or the shared memory ring buffer by themselves), and its own spectrum ring,
+#    which it fills from the feed socket. The FFT pyramid rows are made in each worker from the float rows,
+#  - a new client goes to the worker with the fewest clients. The client id is generated by the main process
+#    (GET /), which keeps the client in its registry, so max_clients and the user count cover all the workers.
+#The shared demodulators and digimode decoders are shared between the clients of the same worker.
+
+FEED_HEADER = struct.Struct("<4sI") #message type, payload size
+HANDOVER_HEADER = struct.Struct("<H") #size of the text sent before the fd: "client_id family ip port"
+
+def recv_exact(sock, size):
+    #returns "" if the peer has closed the socket
+    data = ""
+    while len(data) < size:
+        try: chunk = sock.recv(size - len(data))
+        except socket.error as e:
+            if e[0] == errno.EINTR: continue
+            raise
+        if not chunk: return ""
+        data += chunk
+    return data
+
+class worker_process:
+    # What the main process knows about a worker.
+
+    def __init__(self, index, pid, control_sock, feed_sock):
+        self.index = index
+        self.pid = pid
+        self.control_sock = control_sock
+        self.feed_sock = feed_sock
+        self.lock = threading.Lock() #for sending on the control socket
+        self.client_ids = set()
+        self.bcastmsg = None
+        self.alive = True
+
+class worker_pool:
+
+    def __init__(self, count, worker_main):
+        #worker_main(worker_link) runs in each worker process, and should not return. This has to be called before any
+        #thread is started in the main process: the children would inherit the locks held by the threads at the fork.
+        count = count or multiprocessing.cpu_count()
+        sys.stdout.flush() #or the children would print what is in the buffer again
+        self.workers = []
+        for index in xrange(count):
+            control_main, control_worker = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            feed_main, feed_worker = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            pid = os.fork()
+            if pid == 0:
+                for sock in [control_main, feed_main] + [s for w in self.workers for s in (w.control_sock, w.feed_sock)]: sock.close()
+                try: worker_main(worker_link(index, control_worker, feed_worker))
+                except:
+                    exc_type, exc_value, exc_traceback = sys.exc_info()
+                    print "[openwebrx-workers] worker %d failed:" % index, exc_type, exc_value
+                    traceback.print_tb(exc_traceback)
+                os._exit(1)
+            control_worker.close()
+            feed_worker.close()
+            self.workers.append(worker_process(index, pid, control_main, feed_main))
+        self.condition = threading.Condition()
+        self.on_closed = None
+        print "[openwebrx-workers] started %d worker processes" % count
+
+    def start(self, spectrum_ring, skimmer_ring, on_closed):
+        #spectrum_ring has the FFT rows as they come from csdr, skimmer_ring (can be None) the "SKM " messages.
+        #on_closed(client_id) is called when a worker has closed a client.
+        self.on_closed = on_closed
+        for worker in self.workers:
+            for target, args in ((self.feed_function, (worker, spectrum_ring.reader(), skimmer_ring.reader() if skimmer_ring else None)), \
+                    (self.control_function, (worker,))):
+                thread = threading.Thread(target = target, args = args)
+                thread.daemon = True
+                thread.start()
+
+    def notify(self):
+        #wakes up the feeders, after something has been published
+        self.condition.acquire()
+        self.condition.notify_all()
+        self.condition.release()
+
+    def broadcast(self, message):
+        for worker in self.workers: worker.bcastmsg = message
+        self.notify()
+
+    def feed_function(self, worker, spectrum_reader, skimmer_reader):
+        while worker.alive:
+            self.condition.acquire()
+            if not spectrum_reader.lag() and not (skimmer_reader and skimmer_reader.lag()) and not worker.bcastmsg:
+                self.condition.wait(1)
+            self.condition.release()
+            messages = [("FFT ", row) for row in spectrum_reader.read()]
+            if skimmer_reader: messages += [("SKM ", data) for data in skimmer_reader.read()]
+            bcastmsg = worker.bcastmsg
+            worker.bcastmsg = None
+            if bcastmsg: messages.append(("MSG ", bcastmsg))
+            if not messages: continue
+            try: worker.feed_sock.sendall("".join(FEED_HEADER.pack(type, len(data)) + data for type, data in messages))
+            except socket.error: break #the worker has exited, control_function handles it
+
+    def control_function(self, worker):
+        control_file = worker.control_sock.makefile("r", 0)
+        while True:
+            line = control_file.readline()
+            if not line: break
+            command, client_id = line.split()
+            if command != "closed": continue
+            worker.client_ids.discard(client_id)
+            self.on_closed(client_id)
+        print "[openwebrx-workers] worker %d (pid %d) has exited" % (worker.index, worker.pid)
+        worker.alive = False
+        self.notify()
+        for client_id in list(worker.client_ids): self.on_closed(client_id)
+        worker.client_ids.clear()
+
+    def hand_over(self, sock, client_id, client_address):
+        #sends the connection to the worker with the fewest clients, returns it (or None if no worker is alive)
+        alive = [worker for worker in self.workers if worker.alive]
+        if not alive: return None
+        worker = min(alive, key = lambda worker: len(worker.client_ids))
+        text = "%s %d %s %d" % (client_id, sock.family, client_address[0], client_address[1])
+        worker.lock.acquire()
+        try:
+            worker.control_sock.sendall(HANDOVER_HEADER.pack(len(text)) + text)
+            _multiprocessing.sendfd(worker.control_sock.fileno(), sock.fileno())
+            worker.client_ids.add(client_id)
+        finally:
+            worker.lock.release()
+        return worker
+
+    def client_counts(self):
+        return [(worker.index, len(worker.client_ids)) for worker in self.workers if worker.alive]
+
+    def stop(self):
+        for worker in self.workers:
+            try: os.kill(worker.pid, signal.SIGTERM)
+            except OSError: pass #it has exited already
+
+class worker_link:
+    # The end of the sockets in a worker process.
+
+    def __init__(self, index, control_sock, feed_sock):
+        self.index = index
+        self.control_sock = control_sock
+        self.feed_sock = feed_sock
+        self.lock = threading.Lock()
+
+    def start(self, on_feed, on_client):
+        #on_feed(type, payload) is called for each message of the feed socket,
+        #on_client(sock, client_id, client_address) for each connection handed over, both from their own threads
+        for target, args in ((self.feed_function, (on_feed,)), (self.control_function, (on_client,))):
+            thread = threading.Thread(target = target, args = args)
+            thread.daemon = True
+            thread.start()
+
+    def feed_function(self, on_feed):
+        while True:
+            header = recv_exact(self.feed_sock, FEED_HEADER.size)
+            if not header: break
+            type, size = FEED_HEADER.unpack(header)
+            data = recv_exact(self.feed_sock, size) if size else ""
+            if size and not data: break
+            on_feed(type, data)
+        self.main_exited()
+
+    def control_function(self, on_client):
+        while True:
+            #we read exactly the text, so that recvfd() gets the byte that carries the fd
+            header = recv_exact(self.control_sock, HANDOVER_HEADER.size)
+            if not header: break
+            text = recv_exact(self.control_sock, HANDOVER_HEADER.unpack(header)[0])
+            if not text: break
+            fd = _multiprocessing.recvfd(self.control_sock.fileno())
+            client_id, family, ip, port = text.split(" ")
+            sock = socket.fromfd(fd, int(family), socket.SOCK_STREAM)
+            os.close(fd) #fromfd() has made a copy of it
+            on_client(sock, client_id, (ip, int(port)))
+        self.main_exited()
+
+    def main_exited(self):
+        print "[openwebrx-workers] worker %d: the main process has exited" % self.index
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def report_closed(self, client_id):
+        self.lock.acquire()
+        try: self.control_sock.sendall("closed %s\n" % client_id)
+        except socket.error: pass #the main process has exited
+        finally: self.lock.release()
+
+class skimmer_relay:
+    # Stands in for skimmer.skimmer_service in a worker: the messages of the skimmer come from the feed socket.
+
+    def __init__(self):
+        self.ring = fanout.ring_buffer(256)
+
+    def reader(self):
+        return self.ring.reader()
+
+    def stop(self):
+        pass